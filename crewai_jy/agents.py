@@ -1,8 +1,8 @@
-from typing import List
+from typing import Any, List, Optional, Sequence
 from textwrap import dedent 
 from crewai import Agent
 from tools.exa_search_tool import ExaSearchToolset
-from langchain_openai import ChatOpenAI
+from llm import chat_llm
 from langsmith import traceable
 from langchain_community.llms import Ollama
 from utils.logging import logger, debug_process_inputs
@@ -10,11 +10,11 @@ from utils.logging import logger, debug_process_inputs
 @traceable
 class AccountResearchAgents():
 
-    def __init__(self):
-        self.searchExaTool = ExaSearchToolset()
+    def __init__(self, job_id: Optional[str] = None, llm_cache: bool = True, callbacks: Sequence[Any] = ()):
+        self.searchExaTool = ExaSearchToolset(job_id=job_id)
         # self.ollama_llm = Ollama(model="llama3:instruct")
-        self.llm = ChatOpenAI(model="gpt-3.5-turbo-0125")
-        # self.llm = ChatOpenAI(model="gpt-4-turbo-preview")
+        self.llm = chat_llm("gpt-3.5-turbo-0125", cache=llm_cache, callbacks=callbacks)
+        # self.llm = chat_llm("gpt-4-turbo-preview", cache=llm_cache, callbacks=callbacks)
 
     def report_writer(self, target_account: str, topics: List[str]) -> Agent:
         return Agent(
@@ -1,95 +1,209 @@
-from datetime import datetime
-import json
-from threading import Thread
-from uuid import uuid4
+from threading import BoundedSemaphore
 
-from flask import Flask, jsonify, request, abort
+from flask import Flask, Response, jsonify, request, abort, stream_with_context
 from flask_cors import CORS
-from dotenv import load_dotenv
 
-from crew import AccountResearchCrew
-from job_manager import append_event, jobs, jobs_lock, Event
+from executor import QueueFull
+from job_manager import get_job, get_job_version, is_evicted, wait_for_change, wait_for_events
+from service import (
+    MAX_LONG_POLL_SECONDS, MAX_LONG_POLLS, STREAM_HEARTBEAT_SECONDS, TERMINAL_STATUSES, cancel_crew, crew_options,
+    batch_status, job_timeline, list_jobs, queue_position, render_metrics, stats, status_body, status_etag, stream_frames, submit_batch, submit_crew, validate_batch, validate_crew)
+from compression import negotiate
+from serialization import dumps
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
 from utils.logging import logger
 from langsmith import traceable
 from utils.logging import debug_process_inputs
-import traceback
 
 
-load_dotenv()
-
 app = Flask(__name__)
 app.config['PROPAGATE_EXCEPTIONS'] = True
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-@traceable(name="kick off crew", process_inputs=debug_process_inputs)    
-def kickoff_crew(job_id, target_account: str, topics: list[str]):
-    logger.info(f"Running kickoff_crew with job_id={job_id}, target_account={target_account}, topics={topics}")
+# Each parked long poll holds a WSGI thread.
+long_poll_slots = BoundedSemaphore(MAX_LONG_POLLS)
 
-    results = None
-    try:
-        account_research_crew = AccountResearchCrew(job_id)
-        account_research_crew.setup_crew(
-            target_account, topics)
-        results = account_research_crew.kickoff()
-        logger.info(f"Crew for job {job_id} is complete", results)
-
-    except Exception as e:
-        logger.error(f"Error in kickoff_crew for job {job_id}: {e}")
-        logger.error(traceback.format_exc())
-        append_event(job_id, f"An error occurred: {e}")
-        with jobs_lock:
-            jobs[job_id].status = 'ERROR'
-            jobs[job_id].result = str(e)
-
-    with jobs_lock:
-        jobs[job_id].status = 'COMPLETE'
-        jobs[job_id].result = results
-        jobs[job_id].events.append(
-            Event(timestamp=datetime.now(), data="Crew complete"))
-
-@traceable(name="run crew", process_inputs=debug_process_inputs)    
+
+def get_job_or_abort(job_id, since=0):
+    job = get_job(job_id, since)
+    if job is None:
+        if is_evicted(job_id):
+            abort(410, description="Job has expired")
+        abort(404, description="Job not found")
+    return job
+
+
+def json_response(body, encoding=None):
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def not_modified(etag):
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+
+@traceable(name="run crew", process_inputs=debug_process_inputs)
 @app.route('/api/crew', methods=['POST'])
 def run_crew():
     logger.info("Received request to run crew")
     # Validation
     data = request.json
-    if not data or 'target_account' not in data or 'topics' not in data:
+    if not validate_crew(data):
         abort(400, description="Invalid input data provided.")
 
-    job_id = str(uuid4())
     target_account = data['target_account']
     topics = data['topics']
+    # ?max_age=<seconds> (or "max_age" in the body) accepts a cached report.
+    try:
+        max_age, max_tokens_budget = crew_options(data, request.args.get('max_age'))
+    except ValueError as e:
+        abort(400, description=str(e))
 
-    thread = Thread(target=kickoff_crew, args=(
-        job_id, target_account, topics))
-    thread.start()
+    try:
+        job_id = submit_crew(target_account, topics, coalesce=data.get('coalesce', True) is not False,
+                             max_age=max_age, llm_cache=data.get('llm_cache', True) is not False,
+                             max_tokens_budget=max_tokens_budget)
+    except QueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
 
     return jsonify({"job_id": job_id}), 202
 
-@traceable(name="get status", process_inputs=debug_process_inputs)    
+@app.route('/api/crew/batch', methods=['POST'])
+def run_crew_batch():
+    items = validate_batch(request.json)
+    if items is None:
+        abort(400, description="Invalid batch: expected a non-empty list of {target_account, topics} items.")
+
+    try:
+        batch_id, job_ids = submit_batch(items)
+    except QueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+
+    return jsonify({"batch_id": batch_id, "job_ids": job_ids}), 202
+
+@app.route('/api/crew/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    status = batch_status(batch_id)
+    if status is None:
+        abort(404, description="Batch not found")
+    return json_response(*negotiate(lambda: dumps(status), request.headers.get('Accept-Encoding')))
+
+@traceable(name="get status", process_inputs=debug_process_inputs)
 @app.route('/api/crew/<job_id>', methods=['GET'])
 def get_status(job_id):
-    with jobs_lock:
-        job = jobs.get(job_id)
-        if job is None:
-            abort(404, description="Job not found")
-
-    # Initialize result_json as None to handle cases where job.result is None
-    result_json = None
-    # Only attempt to parse job.result if it's not None
-    if job.result is not None:
+    # Clients pass back the `cursor` of their previous poll to only receive
+    # events appended since then.
+    since = request.args.get('since', default=0, type=int)
+
+    # With ?wait=<seconds> the request parks instead of returning at once:
+    # with &version=<n> until the job moves past the version the client
+    # already has, otherwise until it has events past `since`.
+    wait = min(request.args.get('wait', default=0, type=float), MAX_LONG_POLL_SECONDS)
+    version = request.args.get('version', type=int)
+    if wait > 0:
+        if not long_poll_slots.acquire(blocking=False):
+            response = jsonify({"error": "Too many waiting requests"})
+            response.headers['Retry-After'] = '1'
+            return response, 503
         try:
-            result_json = json.loads(job.result)
-        except json.JSONDecodeError:
-            # If parsing fails, set result_json to the original job.result string
-            result_json = job.result
-
-    return jsonify({
-        "job_id": job_id,
-        "status": job.status,
-        "result": result_json,
-        "events": [{"timestamp": event.timestamp.isoformat(), "data": event.data} for event in job.events]
-    })
+            if version is not None:
+                wait_for_change(job_id, version, wait)
+            else:
+                wait_for_events(job_id, since, wait)
+        finally:
+            long_poll_slots.release()
+
+    # Most polls find the job unchanged; answer those from its version alone
+    # before copying any events.
+    current = get_job_version(job_id)
+    if current is not None:
+        version, status = current
+        response = not_modified(status_etag(version, status, since, queue_position(job_id, status)))
+        if response is not None:
+            return response
+
+    job = get_job_or_abort(job_id, since)
+    # The copy carries the version it was taken at, so the ETag always
+    # matches the payload even if the job changed since the check above.
+    position = queue_position(job_id, job.status)
+    etag = status_etag(job.version, job.status, since, position)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    body, encoding = status_body(job_id, job, since, position, request.headers.get('Accept-Encoding'))
+    response = json_response(body, encoding)
+    response.set_etag(etag, weak=True)
+    return response
+
+@app.route('/api/crew/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    status = cancel_crew(job_id)
+    if status is None:
+        get_job_or_abort(job_id)
+    if status in TERMINAL_STATUSES and status != 'CANCELLED':
+        return jsonify({"job_id": job_id, "status": status, "error": "Job has already finished"}), 409
+    return jsonify({"job_id": job_id, "status": status}), 202
+
+@app.route('/api/crew/<job_id>/stream', methods=['GET'])
+def stream_status(job_id):
+    # EventSource resends the id of the last event it received when it
+    # reconnects, so a dropped stream resumes where it left off.
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', default=0, type=int)
+    get_job_or_abort(job_id, since)
+
+    def generate():
+        cursor = since
+        while True:
+            job = wait_for_events(job_id, cursor, STREAM_HEARTBEAT_SECONDS)
+            if job is None:
+                return
+            frames, done = stream_frames(job_id, job)
+            yield from frames
+            cursor = job.seq
+            if done:
+                return
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/crew/<job_id>/timeline', methods=['GET'])
+def get_timeline(job_id):
+    timeline = job_timeline(job_id)
+    if timeline is None:
+        get_job_or_abort(job_id)
+    return json_response(*negotiate(lambda: dumps(timeline), request.headers.get('Accept-Encoding')))
+
+@app.route('/api/crews', methods=['GET'])
+def get_crews():
+    # Either ?ids=a,b,c for specific jobs, or ?status=&target_account= filters.
+    ids = [job_id for job_id in request.args.get('ids', '').split(',') if job_id]
+    body = list_jobs(ids=ids,
+                     status=request.args.get('status'),
+                     target_account=request.args.get('target_account'),
+                     limit=request.args.get('limit', default=100, type=int))
+    return json_response(*negotiate(lambda: body, request.headers.get('Accept-Encoding')))
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    return jsonify(stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
 
 if __name__ == '__main__':
     app.run(debug=True, port=3001)
@@ -0,0 +1,271 @@
+"""ASGI edition of the crew API, served by uvicorn.
+
+Same routes and payloads as api.py, but handlers are coroutines: parked long
+polls and SSE streams cost a suspended task rather than a WSGI thread each,
+and crews still run on the shared executor from service.py.
+
+    uvicorn api_asgi:app --port 3001
+"""
+import asyncio
+from functools import partial
+from typing import Callable, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from executor import QueueFull
+from job_manager import Job, get_job, get_job_version, is_evicted, job_store
+from service import (
+    MAX_LONG_POLL_SECONDS, MAX_LONG_POLLS, STREAM_HEARTBEAT_SECONDS, TERMINAL_STATUSES, cancel_crew, crew_options,
+    batch_status, job_timeline, list_jobs, queue_position, render_metrics, stats, status_body, status_etag, stream_frames, submit_batch, submit_crew, validate_batch, validate_crew)
+from compression import negotiate
+from serialization import dumps
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from utils.logging import logger
+
+
+app = FastAPI(title="Account research crew API")
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["ETag", "Retry-After"])
+
+# Only touched from the event loop, so a plain counter is enough.
+parked_long_polls = 0
+
+
+async def read(fn, *args):
+    # In-memory reads only hold a shard lock for a moment; hop to the thread
+    # pool only when a durable backend may have to go to disk.
+    if job_store.durable:
+        return await run_in_threadpool(fn, *args)
+    return fn(*args)
+
+
+async def get_job_or_raise(job_id: str, since: int = 0) -> Job:
+    job = await read(get_job, job_id, since)
+    if job is None:
+        if is_evicted(job_id):
+            raise HTTPException(status_code=410, detail="Job has expired")
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+def changed_since(job_id: str, version: Optional[int]) -> bool:
+    current = get_job_version(job_id)
+    return current is None or current[0] != version or current[1] in TERMINAL_STATUSES
+
+
+async def wait_for_change(job_id: str, version: Optional[int], timeout: float):
+    """Suspend until the job moves past `version`, finishes, or the timeout
+    elapses."""
+    await wait_until(job_id, partial(changed_since, job_id, version), timeout)
+
+
+async def wait_for_events(job_id: str, since: int, timeout: float):
+    """Suspend until the job has events past `since`, finishes, or the
+    timeout elapses."""
+    await wait_until(job_id, partial(job_store.has_events_since, job_id, since), timeout)
+
+
+async def wait_until(job_id: str, ready: Callable[[], bool], timeout: float):
+    """Suspend until `ready()` or the timeout elapses. The job store wakes us
+    through a listener, so no thread is parked and nothing polls while the
+    job is idle."""
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    unsubscribe = job_store.subscribe(job_id, partial(loop.call_soon_threadsafe, changed.set))
+    if unsubscribe is None:
+        return
+    try:
+        deadline = loop.time() + timeout
+        while not ready():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            changed.clear()
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return
+    finally:
+        unsubscribe()
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    candidates = [value.strip().removeprefix('W/') for value in header.split(',')]
+    return '*' in candidates or f'"{etag}"' in candidates
+
+
+def json_response(body: bytes, encoding: Optional[str] = None, headers: Optional[dict] = None) -> Response:
+    headers = {**(headers or {}), 'Vary': 'Accept-Encoding'}
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return Response(body, media_type='application/json', headers=headers)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={'ETag': f'W/"{etag}"'})
+
+
+@app.post('/api/crew', status_code=202)
+async def run_crew(request: Request):
+    logger.info("Received request to run crew")
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not validate_crew(data):
+        raise HTTPException(status_code=400, detail="Invalid input data provided.")
+
+    # ?max_age=<seconds> (or "max_age" in the body) accepts a cached report.
+    try:
+        max_age, max_tokens_budget = crew_options(data, request.query_params.get('max_age'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        # With max_age the report cache is read from SQLite, so this runs
+        # off the event loop.
+        job_id = await run_in_threadpool(
+            submit_crew, data['target_account'], data['topics'], coalesce=data.get('coalesce', True) is not False,
+            max_age=max_age, llm_cache=data.get('llm_cache', True) is not False, max_tokens_budget=max_tokens_budget)
+    except QueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=429, headers={'Retry-After': str(e.retry_after)})
+    return {"job_id": job_id}
+
+
+@app.post('/api/crew/batch', status_code=202)
+async def run_crew_batch(request: Request):
+    try:
+        items = validate_batch(await request.json())
+    except ValueError:
+        items = None
+    if items is None:
+        raise HTTPException(status_code=400,
+                            detail="Invalid batch: expected a non-empty list of {target_account, topics} items.")
+
+    try:
+        # Creating and queueing every job takes shard locks and, with a
+        # durable store, enqueues writes; none of it belongs on the loop.
+        batch_id, job_ids = await run_in_threadpool(submit_batch, items)
+    except QueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=429, headers={'Retry-After': str(e.retry_after)})
+    return {"batch_id": batch_id, "job_ids": job_ids}
+
+
+@app.get('/api/crew/batch/{batch_id}')
+async def get_batch_status(batch_id: str, request: Request):
+    status = await read(batch_status, batch_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return json_response(*negotiate(lambda: dumps(status), request.headers.get('accept-encoding')))
+
+
+@app.get('/api/crew/{job_id}')
+async def get_status(job_id: str, request: Request, since: int = 0, wait: float = 0,
+                     version: Optional[int] = None):
+    global parked_long_polls
+    if wait > 0:
+        if parked_long_polls >= MAX_LONG_POLLS:
+            return JSONResponse({"error": "Too many waiting requests"}, status_code=503,
+                                headers={'Retry-After': '1'})
+        parked_long_polls += 1
+        try:
+            if version is not None:
+                await wait_for_change(job_id, version, min(wait, MAX_LONG_POLL_SECONDS))
+            else:
+                await wait_for_events(job_id, since, min(wait, MAX_LONG_POLL_SECONDS))
+        finally:
+            parked_long_polls -= 1
+
+    current = get_job_version(job_id)
+    if current is not None:
+        current_version, status = current
+        etag = status_etag(current_version, status, since, queue_position(job_id, status))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    job = await get_job_or_raise(job_id, since)
+    position = queue_position(job_id, job.status)
+    etag = status_etag(job.version, job.status, since, position)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    body, encoding = status_body(job_id, job, since, position, request.headers.get('accept-encoding'))
+    return json_response(body, encoding, {'ETag': f'W/"{etag}"'})
+
+
+@app.delete('/api/crew/{job_id}', status_code=202)
+async def cancel_job(job_id: str):
+    # Writes through to the durable backend, if there is one.
+    status = await run_in_threadpool(cancel_crew, job_id)
+    if status is None:
+        await get_job_or_raise(job_id)
+    if status in TERMINAL_STATUSES and status != 'CANCELLED':
+        return JSONResponse({"job_id": job_id, "status": status, "error": "Job has already finished"},
+                            status_code=409)
+    return {"job_id": job_id, "status": status}
+
+
+@app.get('/api/crew/{job_id}/stream')
+async def stream_status(job_id: str, request: Request, since: int = 0):
+    last_event_id = request.headers.get('last-event-id')
+    if last_event_id is not None and last_event_id.isdigit():
+        since = int(last_event_id)
+    await get_job_or_raise(job_id, since)
+
+    async def generate():
+        cursor = since
+        seen_version = None
+        while True:
+            await wait_for_change(job_id, seen_version, STREAM_HEARTBEAT_SECONDS)
+            job = await read(get_job, job_id, cursor)
+            if job is None:
+                return
+            frames, done = stream_frames(job_id, job)
+            for frame in frames:
+                yield frame
+            cursor = job.seq
+            seen_version = job.version
+            if done:
+                return
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.get('/api/crew/{job_id}/timeline')
+async def get_timeline(job_id: str, request: Request):
+    timeline = await read(job_timeline, job_id)
+    if timeline is None:
+        await get_job_or_raise(job_id)
+    return json_response(*negotiate(lambda: dumps(timeline), request.headers.get('accept-encoding')))
+
+
+@app.get('/api/crews')
+async def get_crews(request: Request, ids: str = '', status: Optional[str] = None, target_account: Optional[str] = None,
+                    limit: int = 100):
+    # Either ?ids=a,b,c for specific jobs, or ?status=&target_account= filters.
+    job_ids = [job_id for job_id in ids.split(',') if job_id]
+    body = await read(partial(list_jobs, ids=job_ids, status=status, target_account=target_account, limit=limit))
+    return json_response(*negotiate(lambda: body, request.headers.get('accept-encoding')))
+
+
+@app.get('/api/stats')
+async def get_stats():
+    return stats()
+
+
+@app.get('/metrics')
+async def get_metrics():
+    return Response(render_metrics(), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    # loop="auto" picks uvloop when it is installed.
+    uvicorn.run(app, port=3001, loop="auto")
@@ -0,0 +1,258 @@
+"""End-to-end load benchmark of api.py running real crews on fake services.
+
+Crews, agents, tasks and the job store all run for real; only ChatOpenAI and
+Exa are replaced by the deterministic fakes in benchmarks/fakes.py. Clients
+submit jobs through POST /api/crew and poll them to completion, and the
+report shows job throughput, job and poll latency, RSS growth and threads.
+
+    python -m benchmarks.end_to_end --jobs 40 --concurrency 8 --workers 4
+
+With --llm http the real ChatOpenAI talks to a fake OpenAI server instead,
+which also reports sockets opened per job and time to the first LLM byte;
+--handshake-ms charges each new connection for its TCP/TLS setup. Run it
+with CREW_SHARED_LLM_POOL=0 to compare against a client per job:
+
+    python -m benchmarks.end_to_end --llm http --handshake-ms 50
+
+With --save the results are written as JSON. The run fails (exit status 1)
+when more than --max-errors jobs fail, and with --baseline also when
+throughput drops or p99 latency grows by more than --tolerance against a
+saved run, so it can gate performance changes.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from werkzeug.serving import make_server
+
+from benchmarks.job_store_contention import percentile
+
+
+PORT = 3103
+TERMINAL_STATUSES = ('COMPLETE', 'ERROR', 'CANCELLED')
+
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # Peak rather than current RSS, in KiB on Linux and bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+async def load(base_url: str, jobs: int, concurrency: int, accounts: int, topics: int,
+               poll_interval: float) -> dict:
+    job_latencies: List[float] = []
+    poll_latencies: List[float] = []
+    errors = rejected = 0
+    peak_threads = threading.active_count()
+    next_job = 0
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        async def run_job(index: int):
+            nonlocal errors, rejected, peak_threads
+            body = {"target_account": f"Account {index % accounts}",
+                    "topics": [f"Topic {t}" for t in range(topics)]}
+            start = time.perf_counter()
+            response = await client.post("/api/crew", json=body)
+            while response.status_code == 429:
+                rejected += 1
+                await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+                response = await client.post("/api/crew", json=body)
+            if response.status_code >= 400:
+                errors += 1
+                return
+            job_id = response.json()["job_id"]
+            while True:
+                poll_start = time.perf_counter()
+                response = await client.get(f"/api/crew/{job_id}")
+                poll_latencies.append(time.perf_counter() - poll_start)
+                peak_threads = max(peak_threads, threading.active_count())
+                if response.status_code >= 400:
+                    errors += 1
+                    return
+                status = response.json()["status"]
+                if status in TERMINAL_STATUSES:
+                    if status != 'COMPLETE':
+                        errors += 1
+                    job_latencies.append(time.perf_counter() - start)
+                    return
+                await asyncio.sleep(poll_interval)
+
+        async def client_loop():
+            nonlocal next_job
+            while next_job < jobs:
+                index = next_job
+                next_job += 1
+                await run_job(index)
+
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "jobs": jobs,
+        "seconds": elapsed,
+        "jobs_per_sec": len(job_latencies) / elapsed,
+        "job_p50_s": percentile(job_latencies, 50),
+        "job_p95_s": percentile(job_latencies, 95),
+        "job_p99_s": percentile(job_latencies, 99),
+        "poll_p50_ms": percentile(poll_latencies, 50) * 1000,
+        "poll_p99_ms": percentile(poll_latencies, 99) * 1000,
+        "rss_growth_mb": (rss_bytes() - rss_before) / 2**20,
+        "peak_threads": peak_threads,
+        "errors": errors,
+        "rejected": rejected,
+    }
+
+
+def instrument_ttfb(port: int) -> List[Tuple[Optional[str], float]]:
+    """Time every request to the fake OpenAI server until its response
+    headers arrive, tagged with the job making it."""
+    from timeline import timelines
+
+    samples: List[Tuple[Optional[str], float]] = []
+    original = httpx.HTTPTransport.handle_request
+
+    def handle_request(self, request):
+        if request.url.port != port:
+            return original(self, request)
+        start = time.perf_counter()
+        # Returns once the status line and headers are in; the body is
+        # streamed afterwards.
+        response = original(self, request)
+        current = timelines.current()
+        samples.append((current[0] if current else None, time.perf_counter() - start))
+        return response
+
+    httpx.HTTPTransport.handle_request = handle_request
+    return samples
+
+
+def llm_connection_stats(samples: List[Tuple[Optional[str], float]], connections: int, jobs: int) -> dict:
+    first: Dict[Optional[str], float] = {}
+    for job_id, seconds in samples:
+        first.setdefault(job_id, seconds)
+    return {
+        "llm_calls": len(samples),
+        "llm_ttfb_p50_ms": percentile([seconds for _, seconds in samples], 50) * 1000,
+        "first_llm_ttfb_p50_ms": percentile(list(first.values()), 50) * 1000,
+        "sockets_per_job": connections / jobs if jobs else 0.0,
+    }
+
+
+def regressions(results: dict, baseline: Optional[dict], tolerance: float, max_errors: int) -> List[str]:
+    found = []
+    if results["errors"] > max_errors:
+        found.append(f"errors {results['errors']} above --max-errors {max_errors}")
+    if baseline is None:
+        return found
+    if results["jobs_per_sec"] < baseline["jobs_per_sec"] * (1 - tolerance):
+        found.append(f"jobs/sec {results['jobs_per_sec']:.2f} vs baseline {baseline['jobs_per_sec']:.2f}")
+    for key in ("job_p99_s", "poll_p99_ms", "first_llm_ttfb_p50_ms", "sockets_per_job"):
+        if key in results and key in baseline and results[key] > baseline[key] * (1 + tolerance):
+            found.append(f"{key} {results[key]:.3f} vs baseline {baseline[key]:.3f}")
+    if results["errors"] > baseline["errors"]:
+        found.append(f"errors {results['errors']} vs baseline {baseline['errors']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=40, help="Jobs to run in total.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients submitting and polling at once.")
+    parser.add_argument("--workers", type=int, default=4, help="CREW_MAX_WORKERS for the server.")
+    parser.add_argument("--accounts", type=int, default=0,
+                        help="Distinct accounts to cycle through; 0 makes every job unique.")
+    parser.add_argument("--topics", type=int, default=2, help="Topics per job.")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between status polls.")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="Median fake LLM latency.")
+    parser.add_argument("--llm-sigma", type=float, default=0.5, help="Log-normal spread of LLM latency.")
+    parser.add_argument("--llm-output-bytes", type=int, default=4000, help="Size of each fake LLM answer.")
+    parser.add_argument("--exa-latency-ms", type=float, default=100, help="Median fake Exa latency.")
+    parser.add_argument("--exa-sigma", type=float, default=0.3, help="Log-normal spread of Exa latency.")
+    parser.add_argument("--exa-output-bytes", type=int, default=3000, help="Size of each fake Exa response.")
+    parser.add_argument("--llm", choices=("fake", "http"), default="fake",
+                        help="Fake ChatOpenAI in-process, or real ChatOpenAI against a fake OpenAI server.")
+    parser.add_argument("--handshake-ms", type=float, default=0,
+                        help="With --llm http, delay charged for each new connection.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="Results JSON from an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression.")
+    parser.add_argument("--max-errors", type=int, default=0, help="Failed jobs allowed before the run fails.")
+    args = parser.parse_args()
+
+    # The service reads its configuration when first imported.
+    os.environ['CREW_MAX_WORKERS'] = str(args.workers)
+    os.environ['CREW_MAX_PENDING'] = str(max(args.concurrency, 32))
+    os.environ.setdefault('LANGCHAIN_TRACING_V2', 'false')
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    # Keep LLM responses in memory only, so one run cannot warm the next.
+    os.environ.setdefault('CREW_LLM_CACHE_DB', '')
+
+    import api
+    from benchmarks import fakes
+    from utils.logging import logger
+
+    fakes.install(fakes.FakeSettings(
+        llm_latency_ms=args.llm_latency_ms, llm_sigma=args.llm_sigma, llm_output_bytes=args.llm_output_bytes,
+        exa_latency_ms=args.exa_latency_ms, exa_sigma=args.exa_sigma, exa_output_bytes=args.exa_output_bytes,
+        seed=args.seed), llm=args.llm == "fake")
+    openai_server = None
+    if args.llm == "http":
+        openai_server = fakes.FakeOpenAIServer(handshake_ms=args.handshake_ms).start()
+        os.environ['OPENAI_BASE_URL'] = os.environ['OPENAI_API_BASE'] = openai_server.base_url
+        ttfb_samples = instrument_ttfb(openai_server.server_address[1])
+    logger.setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    server = make_server('127.0.0.1', PORT, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        results = asyncio.run(load(f"http://127.0.0.1:{PORT}", args.jobs, args.concurrency,
+                                   args.accounts or args.jobs, args.topics, args.poll_interval))
+    finally:
+        server.shutdown()
+    if openai_server is not None:
+        results.update(llm_connection_stats(ttfb_samples, openai_server.connections, args.jobs))
+        openai_server.shutdown()
+
+    print(f"{'jobs/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'poll p50':>10} {'poll p99':>10} "
+          f"{'rss +MB':>8} {'threads':>8} {'errors':>7} {'429s':>6}")
+    print(f"{results['jobs_per_sec']:>8.2f} {results['job_p50_s']:>7.2f}s {results['job_p95_s']:>7.2f}s "
+          f"{results['job_p99_s']:>7.2f}s {results['poll_p50_ms']:>8.2f}ms {results['poll_p99_ms']:>8.2f}ms "
+          f"{results['rss_growth_mb']:>8.1f} {results['peak_threads']:>8} {results['errors']:>7} "
+          f"{results['rejected']:>6}")
+    if openai_server is not None:
+        print(f"LLM calls {results['llm_calls']}, TTFB p50 {results['llm_ttfb_p50_ms']:.2f}ms, "
+              f"first call per job p50 {results['first_llm_ttfb_p50_ms']:.2f}ms, "
+              f"sockets per job {results['sockets_per_job']:.2f}")
+
+    if args.save:
+        with open(args.save, 'w') as out:
+            json.dump(results, out, indent=2)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    found = regressions(results, baseline, args.tolerance, args.max_errors)
+    for regression in found:
+        print(f"REGRESSION: {regression}")
+    if found:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
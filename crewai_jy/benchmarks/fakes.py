@@ -0,0 +1,210 @@
+"""Deterministic stand-ins for ChatOpenAI and Exa, for benchmarks that run
+real crews without paying for LLM calls or searches.
+
+Latencies are drawn from a log-normal distribution around a configurable
+median, from a seeded generator, and outputs have a configurable size. The
+fake LLM answers in the ReAct format crewai parses: an agent with the Exa
+tool searches once before answering, and every final answer is a single
+JSON object that validates as AccountInfo, TopicInfo and SubTopic alike, so
+no task needs a second LLM call to convert its output.
+
+    install(FakeSettings(llm_latency_ms=800, exa_latency_ms=300))
+
+FakeOpenAIServer serves the same answers over the OpenAI HTTP API instead,
+so the real ChatOpenAI and its connection pool are exercised; it counts the
+connections clients open and can charge a handshake delay for each one.
+"""
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.pydantic_v1 import Field
+
+
+@dataclass
+class FakeSettings:
+    llm_latency_ms: float = 800
+    llm_sigma: float = 0.5
+    llm_output_bytes: int = 4000
+    exa_latency_ms: float = 300
+    exa_sigma: float = 0.3
+    exa_output_bytes: int = 3000
+    seed: int = 0
+
+
+settings = FakeSettings()
+_random = random.Random(settings.seed)
+_random_lock = threading.Lock()
+
+
+def _sleep(median_ms: float, sigma: float):
+    if median_ms <= 0:
+        return
+    with _random_lock:
+        factor = _random.lognormvariate(0, sigma)
+    time.sleep(median_ms * factor / 1000)
+
+
+def fake_report(size: int) -> str:
+    """A JSON report of roughly `size` bytes, valid for every task's output model."""
+    filler = "Deterministic benchmark finding. " * 4
+    details = []
+    while len(json.dumps(details)) < size:
+        n = len(details)
+        details.append({
+            "description": f"{filler}#{n}",
+            "sources": [{"title": f"Source {n}", "url": f"https://example.com/{n}", "year": 2024}],
+        })
+    subtopic = {"name": "Benchmark subtopic", "details": details}
+    topic = {"title": "Benchmark topic", "insights": ["Benchmark insight"], "subtopics": [subtopic]}
+    return json.dumps({
+        "account_name": "Benchmark account",
+        "topics": [topic],
+        **topic,
+        **subtopic,
+    })
+
+
+def fake_answer(prompt: str) -> str:
+    """A ReAct step for `prompt`, after the configured LLM latency."""
+    _sleep(settings.llm_latency_ms, settings.llm_sigma)
+    if "Exa Search Toolset" in prompt and "Observation:" not in prompt:
+        return ("Thought: I should search for this.\nAction: Exa Search Toolset\n"
+                'Action Input: {"target_account": "Benchmark account", "topic": "benchmark"}')
+    return f"Thought: I now know the final answer\nFinal Answer: {fake_report(settings.llm_output_bytes)}"
+
+
+class FakeChatOpenAI(BaseChatModel):
+    """Drop-in for langchain_openai.ChatOpenAI as built by llm.chat_llm."""
+    model_name: str = Field(default="fake-gpt", alias="model")
+    temperature: float = 0.7
+    http_client: Any = None
+
+    class Config:
+        allow_population_by_field_name = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-openai"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        text = fake_answer(prompt)
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(text) // 4
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=text))],
+            llm_output={"token_usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                        "total_tokens": prompt_tokens + completion_tokens},
+                        "model_name": self.model_name})
+
+
+class FakeExaResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class FakeExa:
+    """Drop-in for exa_py.api.Exa as used by tools/exa_search_tool.py."""
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key
+
+    def _respond(self, label: str) -> FakeExaResponse:
+        _sleep(settings.exa_latency_ms, settings.exa_sigma)
+        line = f"Title: {label}\nURL: https://example.com/{label}\nSnippet: benchmark result text.\n"
+        return FakeExaResponse((line * (settings.exa_output_bytes // len(line) + 1))[:settings.exa_output_bytes])
+
+    def search(self, query: str, **kwargs) -> FakeExaResponse:
+        return self._respond("search")
+
+    def find_similar(self, url: str, **kwargs) -> FakeExaResponse:
+        return self._respond("similar")
+
+    def get_contents(self, ids, **kwargs) -> FakeExaResponse:
+        return self._respond("contents")
+
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: "FakeOpenAIServer"
+
+    def setup(self):
+        super().setup()
+        # Stands in for the TCP and TLS handshakes of a new connection.
+        with self.server.lock:
+            self.server.connections += 1
+        if self.server.handshake_ms > 0:
+            time.sleep(self.server.handshake_ms / 1000)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        prompt = "\n".join(str(message.get('content', '')) for message in request.get('messages', []))
+        text = fake_answer(prompt)
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(text) // 4
+        body = json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get('model', 'fake-gpt'),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """The chat completions endpoint of the OpenAI API, answering with fakes."""
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, handshake_ms: float = 0):
+        super().__init__(('127.0.0.1', port), _OpenAIHandler)
+        self.handshake_ms = handshake_ms
+        self.lock = threading.Lock()
+        self.connections = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def install(new_settings: Optional[FakeSettings] = None, llm: bool = True):
+    """Swap the fakes into the crew modules; call after importing them.
+
+    With `llm=False` the real ChatOpenAI stays, e.g. pointed at a
+    FakeOpenAIServer through OPENAI_BASE_URL.
+    """
+    global settings, _random
+    import llm as llm_module
+    from tools import exa_search_tool
+
+    if new_settings is not None:
+        settings = new_settings
+        with _random_lock:
+            _random = random.Random(settings.seed)
+    if llm:
+        llm_module.ChatOpenAI = FakeChatOpenAI
+    exa_search_tool.Exa = FakeExa
@@ -0,0 +1,78 @@
+"""Append throughput of the in-memory job store versus the SQLite backend.
+
+Each writer thread plays one crew appending events to its own job. For the
+SQLite mode the clock also covers draining the writer queue, so the numbers
+include the cost of actually getting every event onto disk.
+
+    python -m benchmarks.job_store_backends --jobs 32 --events 500
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from threading import Thread
+
+from job_manager import JobStore
+from storage import SQLiteBackend
+from utils.logging import logger
+
+
+def run(store: JobStore, num_jobs: int, events_per_job: int, payload_size: int) -> dict:
+    payload = "x" * payload_size
+    append_seconds = [0.0] * num_jobs
+
+    def writer(index: int):
+        job_id = f"job-{index}"
+        store.create(job_id)
+        store.start(job_id)
+        start = time.perf_counter()
+        for _ in range(events_per_job):
+            store.append_event(job_id, payload)
+        append_seconds[index] = time.perf_counter() - start
+        store.finish(job_id, 'COMPLETE', payload, "Crew complete")
+
+    threads = [Thread(target=writer, args=(i,)) for i in range(num_jobs)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    appended = time.perf_counter() - start
+    if store._backend is not None:
+        store._backend.flush()
+    durable = time.perf_counter() - start
+
+    total = num_jobs * events_per_job
+    return {
+        "appends_per_sec": total / appended,
+        "durable_per_sec": total / durable,
+        "mean_append_us": sum(append_seconds) / total * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=32, help="Concurrent jobs, one writer thread each.")
+    parser.add_argument("--events", type=int, default=500, help="Events appended per job.")
+    parser.add_argument("--payload", type=int, default=2048, help="Bytes per event payload.")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SQLiteBackend(os.path.join(tmp, "jobs.db"))
+        sqlite_store = JobStore()
+        sqlite_store.use_backend(backend)
+        modes = [("memory", JobStore()), ("sqlite (WAL)", sqlite_store)]
+
+        print(f"{'mode':<14} {'appends/s':>12} {'durable/s':>12} {'mean append':>14}")
+        for name, store in modes:
+            stats = run(store, args.jobs, args.events, args.payload)
+            print(f"{name:<14} {stats['appends_per_sec']:>12.0f} {stats['durable_per_sec']:>12.0f} "
+                  f"{stats['mean_append_us']:>12.1f}us")
+        backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Contention benchmark for the job store.
+
+Runs concurrent appends (crew callbacks) and reads (status polls) against the
+sharded JobStore and against the previous single global lock design for a
+fixed time each, and reports throughput and p99 latency for each.
+
+Threads share the GIL, so sharding cannot make pure-Python reads run in
+parallel: reads/s tracks the per-read cost, which is a little higher for
+JobStore (alias lookup, lock wait metrics, last access time). What sharding
+buys is that a thread descheduled while holding its lock stalls only the
+jobs in its shard, which shows in the append p99.
+
+    python -m benchmarks.job_store_contention --jobs 64 --readers 32 --duration 10
+"""
+import argparse
+import logging
+import time
+from dataclasses import replace
+from datetime import datetime
+from threading import Event as Flag, Lock, Thread
+from typing import Dict, List, Optional
+
+from job_manager import Event, Job, JobStore
+from utils.logging import logger
+
+
+class GlobalLockStore:
+    """The original job_manager design: one dict behind one module-level lock."""
+
+    def __init__(self):
+        self.jobs_lock = Lock()
+        self.jobs: Dict[str, Job] = {}
+
+    def append_event(self, job_id: str, event_data: str):
+        with self.jobs_lock:
+            if job_id not in self.jobs:
+                self.jobs[job_id] = Job(status='STARTED', events=[], result='')
+            self.jobs[job_id].events.append(
+                Event(timestamp=datetime.now(), data=event_data))
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return replace(job, events=list(job.events))
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(store, num_jobs: int, num_readers: int, events_per_job: int, payload_size: int,
+        append_rate: float, duration: float) -> dict:
+    job_ids = [f"job-{i}" for i in range(num_jobs)]
+    payload = "x" * payload_size
+    # Both designs start from the same history, so a read copies as many
+    # events in one as in the other.
+    for job_id in job_ids:
+        for _ in range(events_per_job):
+            store.append_event(job_id, payload)
+
+    append_latencies: List[List[float]] = [[] for _ in job_ids]
+    read_latencies: List[List[float]] = [[] for _ in range(num_readers)]
+    go, stop = Flag(), [False]
+
+    def writer(index: int):
+        # Paced like crew callbacks rather than flat out, so each design does
+        # the same writes and reads see lists of the same length throughout.
+        samples = append_latencies[index]
+        job_id = job_ids[index]
+        go.wait()
+        next_at = time.perf_counter()
+        while not stop[0]:
+            start = time.perf_counter()
+            store.append_event(job_id, payload)
+            samples.append(time.perf_counter() - start)
+            next_at += 1 / append_rate
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+
+    def reader(index: int):
+        samples = read_latencies[index]
+        i = index
+        go.wait()
+        while not stop[0]:
+            start = time.perf_counter()
+            store.get(job_ids[i % num_jobs])
+            samples.append(time.perf_counter() - start)
+            i += 1
+
+    threads = [Thread(target=writer, args=(i,)) for i in range(num_jobs)]
+    threads += [Thread(target=reader, args=(i,)) for i in range(num_readers)]
+
+    # Started threads compete for the GIL, which makes starting the rest
+    # slow, so nothing runs until all of them are up.
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    go.set()
+    time.sleep(duration)
+    stop[0] = True
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    appends = [s for samples in append_latencies for s in samples]
+    reads = [s for samples in read_latencies for s in samples]
+    return {
+        "elapsed": elapsed,
+        "appends_per_sec": len(appends) / elapsed,
+        "reads_per_sec": len(reads) / elapsed,
+        "append_p99_ms": percentile(appends, 99) * 1000,
+        "read_p99_ms": percentile(reads, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=32, help="Concurrent jobs, one writer thread each.")
+    parser.add_argument("--readers", type=int, default=16, help="Concurrent polling threads.")
+    parser.add_argument("--events", type=int, default=200, help="Events each job holds before the run.")
+    parser.add_argument("--append-rate", type=float, default=100,
+                        help="Events appended per job per second during the run.")
+    parser.add_argument("--duration", type=float, default=3, help="Seconds to run each design for.")
+    parser.add_argument("--payload", type=int, default=2048, help="Bytes per event payload.")
+    parser.add_argument("--shards", type=int, default=16, help="Lock shards for JobStore.")
+    args = parser.parse_args()
+
+    # Per-append INFO logging would dominate the measurement.
+    logger.setLevel(logging.WARNING)
+
+    designs = [
+        ("global lock", GlobalLockStore()),
+        (f"sharded ({args.shards})", JobStore(num_shards=args.shards)),
+    ]
+    print(f"{'design':<16} {'appends/s':>12} {'reads/s':>12} {'append p99':>12} {'read p99':>12}")
+    for name, store in designs:
+        stats = run(store, args.jobs, args.readers, args.events, args.payload, args.append_rate, args.duration)
+        print(f"{name:<16} {stats['appends_per_sec']:>12.0f} {stats['reads_per_sec']:>12.0f} "
+              f"{stats['append_p99_ms']:>10.3f}ms {stats['read_p99_ms']:>10.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
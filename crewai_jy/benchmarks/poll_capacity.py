@@ -0,0 +1,138 @@
+"""Concurrent-poll capacity of the Flask (WSGI) and ASGI editions of the API.
+
+Both apps are served in-process against the same job store, seeded with
+finished jobs carrying realistic event logs plus idle running jobs. While a
+set of long polls is parked on the running jobs, many clients hammer plain
+status polls; the report shows poll throughput, latency, rejected requests
+and the threads each server needed.
+
+    python -m benchmarks.poll_capacity --clients 200 --parked 200 --seconds 10
+"""
+import argparse
+import asyncio
+import logging
+import threading
+import time
+from typing import List
+
+import httpx
+import uvicorn
+from werkzeug.serving import make_server
+
+import api
+import api_asgi
+from benchmarks.job_store_contention import percentile
+from job_manager import append_event, create_job, finish_job, get_job, start_job
+from utils.logging import logger
+
+
+FLASK_PORT = 3101
+ASGI_PORT = 3102
+
+
+def seed_jobs(finished: int, running: int, events: int, payload: int):
+    body = "x" * payload
+    for i in range(finished):
+        job_id = f"done-{i}"
+        create_job(job_id)
+        start_job(job_id)
+        for _ in range(events):
+            append_event(job_id, body)
+        finish_job(job_id, 'COMPLETE', '{"account_name": "bench", "topics": []}', "Crew complete")
+    for i in range(running):
+        job_id = f"running-{i}"
+        create_job(job_id)
+        start_job(job_id)
+        append_event(job_id, "Task Started")
+
+
+def serve_flask():
+    server = make_server('127.0.0.1', FLASK_PORT, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_asgi():
+    server = uvicorn.Server(uvicorn.Config(api_asgi.app, host='127.0.0.1', port=ASGI_PORT,
+                                           log_level='warning', loop='auto'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def load(base_url: str, clients: int, parked: int, seconds: float, finished: int, running: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=clients + parked, max_keepalive_connections=clients + parked)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def park(index: int):
+            nonlocal errors
+            job_id = f"running-{index % running}"
+            version = get_job(job_id).version
+            while time.perf_counter() < deadline:
+                response = await client.get(f"/api/crew/{job_id}", params={"wait": 30, "version": version})
+                if response.status_code >= 400:
+                    errors += 1
+                    await asyncio.sleep(1)
+
+        async def poll(index: int):
+            nonlocal errors
+            i = index
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(f"/api/crew/done-{i % finished}")
+                latencies.append(time.perf_counter() - start)
+                if response.status_code >= 400:
+                    errors += 1
+                i += 1
+
+        parkers = [asyncio.create_task(park(i)) for i in range(parked)]
+        await asyncio.sleep(0.5)
+        threads_parked = threading.active_count()
+        await asyncio.gather(*(poll(i) for i in range(clients)))
+        for task in parkers:
+            task.cancel()
+        await asyncio.gather(*parkers, return_exceptions=True)
+
+    return {
+        "polls_per_sec": len(latencies) / seconds,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "errors": errors,
+        "threads": threads_parked,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=100, help="Concurrent plain pollers.")
+    parser.add_argument("--parked", type=int, default=100, help="Concurrent parked long polls.")
+    parser.add_argument("--seconds", type=float, default=10, help="Duration of each run.")
+    parser.add_argument("--jobs", type=int, default=50, help="Finished jobs to poll.")
+    parser.add_argument("--events", type=int, default=40, help="Events per finished job.")
+    parser.add_argument("--payload", type=int, default=4096, help="Bytes per event.")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    running = max(1, args.parked // 4)
+    seed_jobs(args.jobs, running, args.events, args.payload)
+
+    print(f"{'server':<8} {'polls/s':>10} {'p50':>10} {'p99':>10} {'errors':>8} {'threads':>8}")
+    for name, start, port in [("flask", serve_flask, FLASK_PORT), ("asgi", serve_asgi, ASGI_PORT)]:
+        server = start()
+        stats = asyncio.run(load(f"http://127.0.0.1:{port}", args.clients, args.parked, args.seconds,
+                                 args.jobs, running))
+        print(f"{name:<8} {stats['polls_per_sec']:>10.0f} {stats['p50_ms']:>8.2f}ms {stats['p99_ms']:>8.2f}ms "
+              f"{stats['errors']:>8} {stats['threads']:>8}")
+        if name == "flask":
+            server.shutdown()
+        else:
+            server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
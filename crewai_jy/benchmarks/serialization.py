@@ -0,0 +1,75 @@
+"""Status payload encoding: stdlib json versus orjson with cached event fragments.
+
+Builds a finished job with many events and times encoding its full status
+body the way get_status used to (a list of dicts with isoformat() per event
+through json.dumps) against serialization.encode_status, both on the first
+poll and on repeat polls where the event fragments are already cached.
+
+    python -m benchmarks.serialization --events 10000
+"""
+import argparse
+import json
+import logging
+import time
+from datetime import datetime
+
+from job_manager import JobStore
+from serialization import encode_status
+from utils.logging import logger
+
+
+def encode_stdlib(job_id, job) -> bytes:
+    waited_until = job.started_at or datetime.now()
+    return json.dumps({
+        "job_id": job_id,
+        "status": job.status,
+        "result": json.loads(job.result),
+        "queue_position": None,
+        "queue_wait_seconds": (waited_until - job.created_at).total_seconds(),
+        "version": job.version,
+        "cursor": job.seq,
+        "events": [{"seq": event.seq, "timestamp": event.timestamp.isoformat(), "data": event.data}
+                   for event in job.events]
+    }).encode()
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=10000, help="Events in the job.")
+    parser.add_argument("--payload", type=int, default=512, help="Bytes per event.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed repetitions, best is reported.")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    store = JobStore()
+    store.create("bench")
+    store.start("bench")
+    for i in range(args.events):
+        store.append_event("bench", f"event {i} " + "x" * args.payload)
+    store.finish("bench", 'COMPLETE', json.dumps({"account_name": "bench", "topics": []}), "Crew complete")
+
+    stdlib = best_of(lambda: encode_stdlib("bench", store.get("bench")), args.repeat)
+    # Nothing is cached yet, so this encode pays for every event fragment.
+    cold_job = store.get("bench")
+    start = time.perf_counter()
+    size = len(encode_status("bench", cold_job, None))
+    cold = time.perf_counter() - start
+    warm = best_of(lambda: encode_status("bench", store.get("bench"), None), args.repeat)
+
+    print(f"{args.events} events, {size / 1e6:.1f} MB body")
+    print(f"{'stdlib json':<26} {stdlib * 1000:>9.2f}ms")
+    print(f"{'orjson, first poll':<26} {cold * 1000:>9.2f}ms")
+    print(f"{'orjson, cached fragments':<26} {warm * 1000:>9.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""Token estimates and budgets for crew runs.
+
+Given a budget, `setup_crew` estimates what its 3N+1 tasks will cost
+before any of them runs: each task's agent and task prompt counted with
+tiktoken, plus the outputs of its context tasks, the tool results a
+researcher reads, and the answers it writes, for the LLM calls a task
+typically makes.
+
+The crew then degrades until the estimate fits: first the
+context handed to each task is truncated, then strategy research is
+skipped. While the crew runs, each task is checked again against the
+tokens actually spent, and an LLM call that would take the job past its
+budget is refused with TokenBudgetExceeded, which stops the crew.
+
+A cheaper model is not among the degradations: every agent already runs
+on gpt-3.5-turbo, and the budget counts tokens, which another model would
+not reduce.
+
+Async tasks call the LLM concurrently, so each admitted call reserves its
+prompt and completion allowance until its usage is known, and its
+max_tokens is capped at what the budget has left; `CompletionCapTransport`
+applies the cap to the request.
+"""
+import json
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Sequence, Set
+from uuid import UUID
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from tokens import EXPECTED_COMPLETION_TOKENS, count_tokens, truncate
+
+# Tokens a task's output takes when passed on as context.
+OUTPUT_TOKENS = {'research_account': 1200, 'research_strategy': 1200, 'manage_research': 1000,
+                 'write_report': 2500}
+# LLM calls per task: ReAct steps for agents with tools, otherwise the
+# answer and one round of delegation or formatting.
+TOOL_TASK_CALLS = 4
+PLAIN_TASK_CALLS = 2
+# One Exa result added to the scratchpad per tool step.
+OBSERVATION_TOKENS = 1000
+# A thought and action between tool steps.
+STEP_TOKENS = 100
+# ReAct instructions and tool descriptions around the task prompt.
+PROMPT_OVERHEAD_TOKENS = 400
+# Context per task once truncated to fit a budget.
+TRUNCATED_CONTEXT_TOKENS = 1500
+_MIN_CONTEXT_TOKENS = 200
+
+# max_tokens for the LLM call being made on this thread, set by TokenBudget.
+completion_cap: ContextVar[Optional[int]] = ContextVar('completion_cap', default=None)
+
+
+class TokenBudgetExceeded(Exception):
+    pass
+
+
+def _context_tokens(task, skipped: Set[int], cap: Optional[int]) -> int:
+    total = sum(OUTPUT_TOKENS.get(getattr(context, 'task_type', None), 1000)
+                for context in task.context or () if id(context) not in skipped)
+    return min(total, cap) if cap is not None else total
+
+
+def estimate_task(task, context_tokens: int) -> int:
+    agent = task.agent
+    prompt = count_tokens('\n'.join((agent.role, agent.goal, agent.backstory, task.description,
+                                     task.expected_output))) + PROMPT_OVERHEAD_TOKENS + context_tokens
+    if agent.tools:
+        calls = TOOL_TASK_CALLS
+        # Every step resends the scratchpad, which grows by one result.
+        observations = OBSERVATION_TOKENS * calls * (calls - 1) // 2
+    else:
+        calls, observations = PLAIN_TASK_CALLS, 0
+    completion = OUTPUT_TOKENS.get(task.task_type, 1000) + (calls - 1) * STEP_TOKENS
+    return calls * prompt + observations + completion
+
+
+class TokenBudget(BaseCallbackHandler):
+    """Tracks a job's estimated and actual tokens against its budget.
+
+    Attached to the LLM calls of the job's tasks as a callback, it counts
+    the usage of every call and refuses calls that would exceed `limit`,
+    counting the reservations of calls still in flight. With no limit it
+    only records the usage.
+    """
+    # Let TokenBudgetExceeded out of LangChain's callback manager.
+    raise_error = True
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.estimated: Optional[int] = None
+        self.actual = 0
+        self.context_cap: Optional[int] = None
+        self.degradations: List[str] = []
+        self._lock = threading.Lock()
+        # Estimates of planned tasks that have not started, by id().
+        self._pending: Dict[int, int] = {}
+        self._optional: Set[int] = set()
+        # Prompt and completion allowance of calls in flight, by run id.
+        self._reserved: Dict[UUID, int] = {}
+
+    @staticmethod
+    def _estimate(tasks: Sequence[Any], skipped: Set[int], cap: Optional[int]) -> Dict[int, int]:
+        return {id(task): estimate_task(task, _context_tokens(task, skipped, cap))
+                for task in tasks if id(task) not in skipped}
+
+    def plan(self, tasks: Sequence[Any], optional: Sequence[Any]) -> List[Any]:
+        """Estimate `tasks` and degrade until they fit; returns those to run.
+
+        Tasks in `optional` are dropped as the last step.
+        """
+        if self.limit is None:
+            # Nothing to fit, so the prompts are not counted at all.
+            return list(tasks)
+        self._optional = {id(task) for task in optional}
+        levels = [(None, set()), (TRUNCATED_CONTEXT_TOKENS, set()), (TRUNCATED_CONTEXT_TOKENS, self._optional)]
+        for cap, skipped in levels:
+            estimates = self._estimate(tasks, skipped, cap)
+            if sum(estimates.values()) <= self.limit:
+                break
+        self.context_cap = cap
+        self._pending = estimates
+        self.estimated = sum(estimates.values())
+        if cap is not None:
+            self.degradations.append(f"context truncated to {cap} tokens per task")
+        if skipped:
+            self.degradations.append(f"skipped {len(skipped)} strategy research tasks")
+        return [task for task in tasks if id(task) not in skipped]
+
+    def start_task(self, task, context: Optional[str]) -> Optional[str]:
+        """Check `task` against what is left; returns its context, truncated
+        if need be, or raises TokenBudgetExceeded for an optional task that
+        no longer fits."""
+        with self._lock:
+            estimate = self._pending.pop(id(task), None)
+            if self.limit is None or estimate is None:
+                return context
+            # Keep enough for the tasks still to come.
+            available = self.limit - self.actual - sum(self._reserved.values()) - sum(self._pending.values())
+            cap = self.context_cap
+            if estimate > available:
+                if id(task) in self._optional:
+                    self.degradations.append(f"skipped {task.task_type} for {task.topic} at runtime")
+                    raise TokenBudgetExceeded(f"{task.task_type} skipped to stay within the token budget")
+                without_context = estimate_task(task, 0)
+                calls = TOOL_TASK_CALLS if task.agent.tools else PLAIN_TASK_CALLS
+                fitting = max((available - without_context) // calls, _MIN_CONTEXT_TOKENS)
+                if cap is None or fitting < cap:
+                    cap = fitting
+                    self.degradations.append(f"context of {task.task_type} truncated to {cap} tokens at runtime")
+        return truncate(context, cap) if context and cap is not None else context
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, **kwargs: Any):
+        if self.limit is None:
+            return
+        prompt = sum(count_tokens(str(message.content)) + 3 for batch in messages for message in batch)
+        completion = (kwargs.get('invocation_params') or {}).get('max_tokens') or EXPECTED_COMPLETION_TOKENS
+        with self._lock:
+            remaining = self.limit - self.actual - sum(self._reserved.values())
+            if prompt + completion > remaining:
+                self.degradations.append("stopped an LLM call that would exceed the budget")
+                raise TokenBudgetExceeded(
+                    f"Token budget of {self.limit} exhausted after {self.actual} tokens")
+            self._reserved[run_id] = prompt + completion
+        completion_cap.set(remaining - prompt)
+
+    def _settle(self, run_id: UUID, tokens: int):
+        with self._lock:
+            self._reserved.pop(run_id, None)
+            self.actual += tokens
+        completion_cap.set(None)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        # Cached responses report no usage and cost nothing.
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        self._settle(run_id, usage.get('total_tokens', 0))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._settle(run_id, 0)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "budget": self.limit,
+                "estimated": self.estimated,
+                "actual": self.actual,
+                "degradations": list(self.degradations),
+            }
+
+
+def _with_max_tokens(request: httpx.Request, cap: int) -> httpx.Request:
+    try:
+        body = json.loads(request.read())
+    except ValueError:
+        return request
+    if not isinstance(body, dict) or 'messages' not in body:
+        return request
+    if body.get('max_tokens') is not None and body['max_tokens'] <= cap:
+        return request
+    body['max_tokens'] = cap
+    headers = [(name, value) for name, value in request.headers.raw if name.lower() != b'content-length']
+    return httpx.Request(request.method, request.url, headers=headers, content=json.dumps(body).encode(),
+                         extensions=request.extensions)
+
+
+class CompletionCapTransport(httpx.BaseTransport):
+    """Lowers the max_tokens of chat requests to `completion_cap`."""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        cap = completion_cap.get()
+        return self._transport.handle_request(_with_max_tokens(request, cap) if cap is not None else request)
+
+    def close(self):
+        self._transport.close()
@@ -0,0 +1,129 @@
+"""Negotiated gzip/brotli compression of large JSON responses.
+
+Status bodies embed every task's output and the final report, and compress
+several times over. Bodies of finished jobs never change, so their
+compressed forms are kept in a small LRU and reused by every later poll.
+Brotli is used when the `brotli` package is installed and the client
+accepts it, gzip otherwise.
+"""
+import gzip
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Bodies smaller than this gain too little to be worth the CPU.
+MIN_COMPRESS_BYTES = int(os.environ.get('CREW_COMPRESS_MIN_BYTES', 1024))
+# Total size of compressed bodies kept for finished jobs.
+MAX_CACHED_BYTES = int(os.environ.get('CREW_COMPRESS_CACHE_BYTES', 64 * 1024 * 1024))
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _qualities(accept_encoding: Optional[str]) -> Dict[str, float]:
+    qualities = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.strip().replace(' ', '')
+        quality = 1.0
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The best encoding both sides support, or None for identity."""
+    qualities = _qualities(accept_encoding)
+
+    def accepted(coding: str) -> bool:
+        # A coding listed by name, even refused with q=0, overrides `*`.
+        return qualities.get(coding, qualities.get('*', 0)) > 0
+
+    if brotli is not None and accepted('br'):
+        return 'br'
+    if accepted('gzip'):
+        return 'gzip'
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressedCache:
+    """Compressed bodies by (key, encoding), evicted least recently used
+    once they exceed `max_bytes` in total."""
+
+    def __init__(self, max_bytes: int = MAX_CACHED_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[Hashable, str], bytes]" = OrderedDict()
+        self._bytes = 0
+        self.hits = self.misses = 0
+
+    def get(self, key: Hashable, encoding: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get((key, encoding))
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((key, encoding))
+            self.hits += 1
+            return body
+
+    def put(self, key: Hashable, encoding: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop((key, encoding), None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[(key, encoding)] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+compressed_cache = CompressedCache()
+
+
+def negotiate(render: Callable[[], bytes], accept_encoding: Optional[str],
+              cache_key: Optional[Hashable] = None) -> Tuple[bytes, Optional[str]]:
+    """The body from `render`, compressed for the client if it is large enough.
+
+    Returns the bytes to send and their Content-Encoding (None for identity).
+    Pass `cache_key` only for bodies that will never change, such as the
+    status of a finished job at a given version; a cached body is returned
+    without calling `render` at all.
+    """
+    encoding = choose_encoding(accept_encoding)
+    if encoding is not None and cache_key is not None:
+        cached = compressed_cache.get(cache_key, encoding)
+        if cached is not None:
+            return cached, encoding
+    body = render()
+    if encoding is None or len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    compressed = compress(body, encoding)
+    if cache_key is not None:
+        compressed_cache.put(cache_key, encoding, compressed)
+    return compressed, encoding
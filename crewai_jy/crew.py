@@ -1,25 +1,32 @@
 from datetime import datetime
-from typing import Callable
-from langchain_openai import ChatOpenAI
+from typing import Callable, Optional
 from agents import AccountResearchAgents
-from job_manager import append_event
+from budget import TokenBudget, TokenBudgetExceeded
+from job_manager import JobCancelled, append_event, raise_if_cancelled
 from tasks import AccountResearchTasks
 from crewai import Task, Crew
 from langsmith import traceable
 from utils.logging import debug_process_inputs
 
+# Bump whenever agents, tasks or models change what a crew produces for the
+# same inputs, so new requests are not coalesced onto runs of the old crew.
+CREW_CONFIG_VERSION = 1
+
 class AccountResearchCrew:
-    def __init__(self, job_id: str):
+    def __init__(self, job_id: str, llm_cache: bool = True, max_tokens_budget: Optional[int] = None):
         self.job_id = job_id
+        self.llm_cache = llm_cache
+        self.budget = TokenBudget(max_tokens_budget)
         self.crew = None
         self.tasks = list[Task]
-        self.llm = ChatOpenAI(model="gpt-4-turbo-preview")
+        self.task_callbacks = None
 
     @traceable(name="setup crew", run_type="chain", process_inputs=debug_process_inputs)    
     def setup_crew(self, target_account: str, topics: list[str]):
-        agents = AccountResearchAgents()
+        agents = AccountResearchAgents(job_id=self.job_id, llm_cache=self.llm_cache)
         tasks = AccountResearchTasks(
-            job_id=self.job_id)
+            job_id=self.job_id, budget=self.budget)
+        self.task_callbacks = tasks
 
         report_writer = agents.report_writer(target_account, topics)
         research_manager = agents.research_manager(target_account, topics)
@@ -27,7 +34,7 @@ class AccountResearchCrew:
         account_researcher = agents.account_researcher()
 
         research_account_tasks = [
-            tasks.research_account(account_researcher, topic, target_account)
+            tasks.research_account(account_researcher, target_account, topic)
             for topic in topics
         ]
         
@@ -44,13 +51,50 @@ class AccountResearchCrew:
         write_report_task = tasks.write_report(
             report_writer, target_account, topics, manage_research_tasks)
         
+        planned = self.budget.plan(
+            [*research_account_tasks, *research_strategy_tasks, *manage_research_tasks, write_report_task],
+            optional=research_strategy_tasks)
+        if len(planned) < 3 * len(topics) + 1:
+            # Skipped tasks never run, so nothing may wait on their output.
+            kept = {id(task) for task in planned}
+            for task in manage_research_tasks:
+                task.context = [context for context in task.context if id(context) in kept]
+        if self.budget.estimated is not None:
+            append_event(self.job_id, f"Estimated {self.budget.estimated} tokens"
+                         + (f"; {', '.join(self.budget.degradations)}" if self.budget.degradations else ""))
         
         self.crew = Crew(
-            agents=[report_writer, research_manager, account_researcher],
-            tasks=[*research_account_tasks, *research_strategy_tasks, *manage_research_tasks, write_report_task],
+            agents=[report_writer, research_manager, strategy_researcher, account_researcher],
+            tasks=planned,
             verbose=2,
+            step_callback=self.check_cancelled,
         )
 
+    def check_cancelled(self, *_):
+        # Runs after every step of the crew's agents, so a cancelled job
+        # stops mid-task rather than after the remaining LLM and Exa calls.
+        raise_if_cancelled(self.job_id)
+
+    def token_usage(self) -> dict:
+        return self.budget.report()
+
+    def work_saved(self) -> dict:
+        total = len(self.crew.tasks) if self.crew else 0
+        completed = self.task_callbacks.completed if self.task_callbacks else 0
+        over_budget = self.task_callbacks.skipped if self.task_callbacks else 0
+        return {
+            "tasks_total": total,
+            "tasks_completed": completed,
+            "tasks_skipped": max(total - completed, 0),
+            "tasks_skipped_over_budget": over_budget,
+        }
+
+    def partial_outputs(self) -> dict:
+        """Outputs of the tasks that got as far as producing one, by task."""
+        tasks = self.crew.tasks if self.crew else []
+        return {f"{task.task_type}: {task.topic}" if task.topic else task.task_type: task.output.raw_output
+                for task in tasks if task.output is not None}
+
     def kickoff(self):
         if not self.crew:
             append_event(self.job_id, "Crew not set up")
@@ -58,9 +102,12 @@ class AccountResearchCrew:
 
         append_event(self.job_id, "Task Started")
         try:
+            raise_if_cancelled(self.job_id)
             results = self.crew.kickoff()
             append_event(self.job_id, "Task Complete")
             return results
+        except (JobCancelled, TokenBudgetExceeded):
+            raise
         except Exception as e:
             append_event(self.job_id, f"An error occurred: {e}")
             return str(e)
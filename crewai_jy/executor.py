@@ -0,0 +1,132 @@
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from threading import Condition, Thread
+from typing import Any, Callable, Deque, List, Optional, Tuple
+from utils.logging import logger
+
+
+class QueueFull(Exception):
+    """Raised by `JobExecutor.submit` when the pending queue is at capacity."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class _PendingJob:
+    job_id: str
+    fn: Callable[..., Any]
+    args: Tuple[Any, ...]
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class JobExecutor:
+    """Fixed pool of worker threads fed from a bounded FIFO queue.
+
+    Replaces a thread per request: at most `max_workers` crews run at once and
+    at most `max_pending` wait behind them, anything beyond that is rejected
+    so the caller can shed load instead of piling up threads.
+
+    Batch submissions go to a separate, larger bulk queue that workers only
+    drain when no interactive job is waiting, so a batch of hundreds of
+    accounts never starves single requests.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, max_bulk_pending: int = 0,
+                 on_start: Optional[Callable[[str], None]] = None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_bulk_pending = max_bulk_pending
+        self._on_start = on_start
+        self._pending: Deque[_PendingJob] = deque()
+        self._bulk: Deque[_PendingJob] = deque()
+        self._cond = Condition()
+        self._running = 0
+        # Moving average of job run time, used to estimate Retry-After.
+        self._avg_duration = 60.0
+        self._workers = [
+            Thread(target=self._work, name=f"crew-worker-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, job_id: str, fn: Callable[..., Any], *args: Any):
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFull(self._retry_after())
+            self._pending.append(_PendingJob(job_id, fn, args))
+            self._cond.notify()
+
+    def submit_bulk(self, jobs: List[Tuple[str, Callable[..., Any], Tuple[Any, ...]]]):
+        """Queue `(job_id, fn, args)` entries on the bulk queue, all or none."""
+        with self._cond:
+            if len(self._bulk) + len(jobs) > self.max_bulk_pending:
+                raise QueueFull(self._retry_after(len(self._bulk) + len(jobs) - self.max_bulk_pending))
+            self._bulk.extend(_PendingJob(job_id, fn, args) for job_id, fn, args in jobs)
+            self._cond.notify(len(jobs))
+
+    def cancel(self, job_id: str) -> bool:
+        """Drop a job that is still waiting in a queue; False if it already left."""
+        with self._cond:
+            for queue in (self._pending, self._bulk):
+                for pending in queue:
+                    if pending.job_id == job_id:
+                        queue.remove(pending)
+                        return True
+        return False
+
+    def position(self, job_id: str) -> Optional[int]:
+        """1-based position of a job in the queues, None once it has left them.
+
+        Bulk jobs count from behind every interactive job, as that is the
+        order workers take them in.
+        """
+        with self._cond:
+            for index, pending in enumerate(self._pending):
+                if pending.job_id == job_id:
+                    return index + 1
+            for index, pending in enumerate(self._bulk):
+                if pending.job_id == job_id:
+                    return len(self._pending) + index + 1
+        return None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "workers": self.max_workers,
+                "running": self._running,
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "bulk_pending": len(self._bulk),
+                "max_bulk_pending": self.max_bulk_pending,
+            }
+
+    def _retry_after(self, slots: int = 1) -> int:
+        # Time for the workers to drain the missing queue slots, at least a second.
+        return max(1, math.ceil(self._avg_duration * slots / self.max_workers))
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._bulk:
+                    self._cond.wait()
+                pending = (self._pending or self._bulk).popleft()
+                self._running += 1
+            logger.info("Job %s waited %.1fs in queue", pending.job_id,
+                        time.monotonic() - pending.enqueued_at)
+            start = time.monotonic()
+            try:
+                if self._on_start is not None:
+                    self._on_start(pending.job_id)
+                pending.fn(*pending.args)
+            except Exception:
+                logger.exception("Unhandled error in worker for job %s", pending.job_id)
+            finally:
+                duration = time.monotonic() - start
+                with self._cond:
+                    self._running -= 1
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
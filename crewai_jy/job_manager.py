@@ -1,18 +1,34 @@
-from dataclasses import dataclass
-from datetime import datetime
-from typing import List, Dict, Optional
-from threading import Lock
+import heapq
+import json
+import sys
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta
+from typing import Any, Callable, Hashable, Iterable, List, Dict, Optional, Set, Tuple
+from threading import Condition, Lock, Thread
+from metrics import JOB_DURATION, JOB_QUEUE_WAIT, JOBS_FINISHED, JOBS_LOCK_WAIT, TimedLock
+from serialization import dumps
 from utils.logging import logger
 
 
-jobs_lock = Lock()
-jobs: Dict[str, "Job"] = {}
+NUM_SHARDS = 16
+TERMINAL_STATUSES = ('COMPLETE', 'ERROR', 'CANCELLED')
+# Ids of evicted jobs remembered per shard, so late polls get 410 not 404.
+MAX_TOMBSTONES_PER_SHARD = 1024
+
+
+class JobCancelled(Exception):
+    """Raised inside a running crew once its job has been asked to stop."""
 
 
 @dataclass
 class Event:
     timestamp: datetime
     data: str
+    seq: int = 0
+    # orjson encoding, filled in on first read (see serialization.py).
+    encoded: Optional[bytes] = field(default=None, repr=False, compare=False)
 
 
 @dataclass
@@ -20,17 +36,723 @@ class Job:
     status: str
     events: List[Event]
     result: Optional[str]
+    # Sequence number of the newest event, 0 while there are none.
+    seq: int = 0
+    # Bumped on every event and status change, so equal versions mean an
+    # unchanged job (served as the status ETag).
+    version: int = 0
+    cancel_requested: bool = False
+    target_account: Optional[str] = None
+    topics: Optional[List[str]] = None
+    created_at: datetime = field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    # Bookkeeping for eviction: monotonic time of the last read and an
+    # approximate footprint in bytes of the event payloads and result.
+    last_access: float = field(default_factory=time.monotonic)
+    size: int = 0
+    # The result decoded once when it is set, plus its JSON encoding, so
+    # polls of finished jobs never parse or re-serialize the report.
+    result_json: Any = None
+    result_bytes: bytes = b'null'
+
+    def _append(self, event_data: str) -> int:
+        # Sequence numbers start at 1 and equal the event's position in the
+        # list, so `events[since:]` is everything newer than cursor `since`.
+        self.seq += 1
+        self.events.append(
+            Event(timestamp=datetime.now(), data=event_data, seq=self.seq))
+        added = _approx_size(event_data)
+        self.size += added
+        return added
+
+    def set_result(self, result: Optional[str], result_json: Any = None) -> int:
+        """Store the result with its decoded form, parsing it unless the
+        caller already has `result_json`. Returns the change in size."""
+        previous = _approx_size(self.result) + len(self.result_bytes)
+        self.result = result
+        self.result_json = result_json if result_json is not None else parse_result(result)
+        self.result_bytes = dumps(self.result_json)
+        delta = _approx_size(result) + len(self.result_bytes) - previous
+        self.size += delta
+        return delta
+
+
+def parse_result(result) -> Any:
+    # Initialize result_json as None to handle cases where job.result is None
+    result_json = None
+    # Only attempt to parse job.result if it's not None
+    if result is not None:
+        try:
+            result_json = json.loads(result)
+        except (json.JSONDecodeError, TypeError):
+            # If parsing fails, set result_json to the original job.result string
+            result_json = result if isinstance(result, str) else str(result)
+    return result_json
+
+
+def normalize_account(target_account: str) -> str:
+    return ' '.join(target_account.split()).casefold()
+
+
+def _approx_size(value) -> int:
+    if value is None:
+        return 0
+    return len(value) if isinstance(value, str) else len(str(value))
+
+
+@dataclass
+class EvictionPolicy:
+    """Limits applied to finished jobs; running and queued jobs are never evicted."""
+    ttl_seconds: Optional[float] = 3600
+    max_jobs: Optional[int] = 1000
+    max_bytes: Optional[int] = 256 * 1024 * 1024
+
+
+@dataclass
+class Batch:
+    """Jobs submitted together through POST /api/crew/batch."""
+    job_ids: List[str]
+    target_accounts: List[str]
+    created_at: datetime = field(default_factory=datetime.now)
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = TimedLock(JOBS_LOCK_WAIT)
+        self.jobs: Dict[str, Job] = {}
+        # One condition per job, all sharing the shard lock, so producers can
+        # wake exactly the streams watching the job they just changed.
+        self.changed: Dict[str, Condition] = {}
+        # Callbacks for waiters that cannot block on a Condition, such as
+        # coroutines on an event loop (see api_asgi.py).
+        self.listeners: Dict[str, List[Callable[[], None]]] = {}
+        self.bytes = 0
+        self.evicted: "OrderedDict[str, None]" = OrderedDict()
+        self.evictions: Counter = Counter()
+        # Secondary indexes over the resident jobs, kept in step with every
+        # status change so listings never scan `jobs`.
+        self.by_status: Dict[str, Set[str]] = {}
+        self.by_account: Dict[str, Set[str]] = {}
+
+    def create(self, job_id: str, job: Job) -> Job:
+        self.jobs[job_id] = job
+        self.changed[job_id] = Condition(self.lock)
+        self.by_status.setdefault(job.status, set()).add(job_id)
+        if job.target_account is not None:
+            self.by_account.setdefault(normalize_account(job.target_account), set()).add(job_id)
+        return job
+
+    def set_status(self, job_id: str, job: Job, status: str):
+        if job.status == status:
+            return
+        self._unindex(self.by_status, job.status, job_id)
+        job.status = status
+        self.by_status.setdefault(status, set()).add(job_id)
+
+    @staticmethod
+    def _unindex(index: Dict[str, Set[str]], key: str, job_id: str):
+        job_ids = index.get(key)
+        if job_ids is not None:
+            job_ids.discard(job_id)
+            if not job_ids:
+                del index[key]
+
+    def touch(self, job_id: str, job: Job):
+        """Mark a change to the job and wake anything waiting on it."""
+        job.version += 1
+        self.changed[job_id].notify_all()
+        for listener in self.listeners.get(job_id, ()):
+            listener()
+
+    def remove(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.pop(job_id, None)
+        self.changed.pop(job_id, None)
+        self.listeners.pop(job_id, None)
+        if job is not None:
+            self.bytes -= job.size
+            self._unindex(self.by_status, job.status, job_id)
+            if job.target_account is not None:
+                self._unindex(self.by_account, normalize_account(job.target_account), job_id)
+        return job
+
+    def evict(self, job_id: str, reason: str):
+        if self.remove(job_id) is None:
+            return
+        self.evictions[reason] += 1
+        self.tombstone(job_id)
+
+    def tombstone(self, job_id: str):
+        self.evicted[job_id] = None
+        if len(self.evicted) > MAX_TOMBSTONES_PER_SHARD:
+            self.evicted.popitem(last=False)
+
+
+def _summary(job_id: str, job: Job) -> dict:
+    return {
+        "job_id": job_id,
+        "status": job.status,
+        "target_account": job.target_account,
+        "topics": job.topics,
+        "version": job.version,
+        "cursor": job.seq,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+class JobStore:
+    """Jobs partitioned across hash-sharded locks.
+
+    Appends and polls for different jobs only contend when their ids hash to
+    the same shard, instead of every crew callback and every GET serializing
+    on one global lock.
+    """
+
+    def __init__(self, num_shards: int = NUM_SHARDS):
+        self._shards = [_Shard() for _ in range(num_shards)]
+        self._sweeper: Optional[Thread] = None
+        # Optional durable storage (see storage.py); None keeps jobs in memory only.
+        self._backend = None
+        # Batches are created rarely and read as a whole, one lock is plenty.
+        self._batches_lock = Lock()
+        self._batches: Dict[str, Batch] = {}
+        # Single flight: the running job for each coalescing key, and the
+        # alias ids attached to those jobs. Aliases live in memory only.
+        # Lock order is this lock before any shard lock.
+        self._coalesce_lock = Lock()
+        self._inflight: Dict[Hashable, str] = {}
+        self._inflight_keys: Dict[str, Hashable] = {}
+        self._aliases: Dict[str, str] = {}
+        # Running jobs whose own requester cancelled while aliases still
+        # wanted the result; the last alias to cancel stops the crew.
+        self._withdrawn: Set[str] = set()
+        self._coalesced = 0
+
+    def use_backend(self, backend):
+        self._backend = backend
+
+    @property
+    def durable(self) -> bool:
+        """Whether reads may fall through to the backend and touch disk."""
+        return self._backend is not None
+
+    def _record(self, job_id: str, job: Optional[Job] = None, event: Optional[Event] = None):
+        if self._backend is not None:
+            if event is not None:
+                self._backend.record_event(job_id, event)
+            if job is not None:
+                self._backend.record_job(job_id, job)
+
+    def _load(self, job_id: str, since: int) -> Optional[Job]:
+        if self._backend is None:
+            return None
+        return self._backend.load_job(job_id, since)
+
+    def _shard(self, job_id: str) -> _Shard:
+        return self._shards[hash(job_id) % len(self._shards)]
+
+    def resolve(self, job_id: str) -> str:
+        """The job an alias id mirrors, or the id itself."""
+        return self._aliases.get(job_id, job_id)
+
+    def attach(self, alias_id: str, key: Hashable) -> Optional[str]:
+        """Make `alias_id` mirror the running job registered under `key`.
+
+        Returns that job's id, or None when nothing is running for the key
+        (or it is finishing or being cancelled) and a new crew is needed.
+        """
+        with self._coalesce_lock:
+            job_id = self._inflight.get(key)
+            if job_id is None:
+                return None
+            shard = self._shard(job_id)
+            with shard.lock:
+                job = shard.jobs.get(job_id)
+                joinable = job is not None and job.status not in TERMINAL_STATUSES and not job.cancel_requested
+            if not joinable:
+                del self._inflight[key]
+                self._inflight_keys.pop(job_id, None)
+                return None
+            self._add_alias(alias_id, job_id)
+            return job_id
+
+    def add_alias(self, alias_id: str, job_id: str):
+        with self._coalesce_lock:
+            self._add_alias(alias_id, job_id)
+
+    def _add_alias(self, alias_id: str, job_id: str):
+        self._aliases[alias_id] = job_id
+        self._coalesced += 1
+
+    def register(self, job_id: str, key: Hashable):
+        """Let later identical requests attach to `job_id` until it finishes."""
+        with self._coalesce_lock:
+            self._inflight[key] = job_id
+            self._inflight_keys[job_id] = key
+
+    def drop_alias(self, alias_id: str):
+        with self._coalesce_lock:
+            self._aliases.pop(alias_id, None)
+
+    def _release(self, job_id: str):
+        # Called without any shard lock held, see the lock order above.
+        with self._coalesce_lock:
+            key = self._inflight_keys.pop(job_id, None)
+            if key is not None and self._inflight.get(key) == job_id:
+                del self._inflight[key]
+            self._withdrawn.discard(job_id)
+
+    def create(self, job_id: str, status: str = 'QUEUED', target_account: Optional[str] = None,
+               topics: Optional[List[str]] = None):
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.create(job_id, Job(status=status, events=[], result='',
+                                           target_account=target_account, topics=topics))
+            shard.touch(job_id, job)
+            self._record(job_id, job)
+
+    def discard(self, job_id: str):
+        self._release(job_id)
+        shard = self._shard(job_id)
+        with shard.lock:
+            shard.remove(job_id)
+            if self._backend is not None:
+                self._backend.delete_job(job_id)
+
+    def start(self, job_id: str):
+        """Move a queued job to STARTED when a worker picks it up."""
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            if job is None:
+                job = shard.create(job_id, Job(status='STARTED', events=[], result=''))
+            if not job.cancel_requested:
+                shard.set_status(job_id, job, 'STARTED')
+            job.started_at = datetime.now()
+            JOB_QUEUE_WAIT.observe((job.started_at - job.created_at).total_seconds())
+            shard.touch(job_id, job)
+            self._record(job_id, job)
+
+    def append_event(self, job_id: str, event_data: str):
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            created = job is None
+            if created:
+                logger.info("Job %s started", job_id)
+                job = shard.create(job_id, Job(
+                    status='STARTED',
+                    events=[],
+                    result=''))
+            else:
+                logger.info("Appending event for job %s: %s", job_id, event_data)
+            shard.bytes += job._append(event_data)
+            # The job row only changes on creation, so plain appends just add an event.
+            shard.touch(job_id, job)
+            self._record(job_id, job if created else None, job.events[-1])
+
+    def finish(self, job_id: str, status: str, result: Optional[str], event_data: Optional[str] = None,
+               result_json: Any = None):
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            if job is None:
+                job = shard.create(job_id, Job(status=status, events=[], result=result))
+            shard.set_status(job_id, job, status)
+            job.finished_at = datetime.now()
+            JOB_DURATION.observe((job.finished_at - job.created_at).total_seconds(), (status,))
+            JOBS_FINISHED.inc(labels=(status,))
+            shard.bytes += job.set_result(result, result_json)
+            event = None
+            if event_data is not None:
+                shard.bytes += job._append(event_data)
+                event = job.events[-1]
+            shard.touch(job_id, job)
+            self._record(job_id, job, event)
+        self._release(job_id)
+
+    def get(self, job_id: str, since: int = 0) -> Optional[Job]:
+        """Return a point-in-time copy of the job, safe to read without the lock.
+
+        Only events with a sequence number greater than `since` are copied.
+        Jobs no longer resident in memory are read from the backend, if any.
+        """
+        job_id = self.resolve(job_id)
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            if job is not None:
+                job.last_access = time.monotonic()
+                return replace(job, events=job.events[max(since, 0):])
+        return self._load(job_id, since)
+
+    def request_cancel(self, job_id: str) -> Optional[str]:
+        """Flag a job to stop at its next checkpoint and return its status.
+
+        Finished jobs are left alone; running ones move to CANCELLING until
+        the crew notices the flag and finishes the job as CANCELLED. A crew
+        shared by coalesced requests keeps running until all of them have
+        cancelled: an alias is detached and answers CANCELLED at once, while
+        the job it mirrors keeps its status until its last alias goes.
+        """
+        if job_id in self._aliases:
+            return self._detach(job_id)
+        with self._coalesce_lock:
+            shared = job_id in self._aliases.values()
+            if shared:
+                self._withdrawn.add(job_id)
+        if shared:
+            return self.status(job_id)
+        return self._cancel(job_id)
+
+    def _cancel(self, job_id: str) -> Optional[str]:
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status not in TERMINAL_STATUSES and not job.cancel_requested:
+                job.cancel_requested = True
+                shard.set_status(job_id, job, 'CANCELLING')
+                shard.touch(job_id, job)
+                self._record(job_id, job)
+            return job.status
+
+    def _detach(self, alias_id: str) -> Optional[str]:
+        status = self.status(alias_id)
+        if status in TERMINAL_STATUSES:
+            return status
+        with self._coalesce_lock:
+            job_id = self._aliases.pop(alias_id, None)
+            if job_id is None:
+                return self.request_cancel(alias_id)
+            last = job_id in self._withdrawn and job_id not in self._aliases.values()
+        self.finish(alias_id, 'CANCELLED', json.dumps({"cancelled": True}), "Crew cancelled")
+        if last:
+            self._cancel(job_id)
+        return 'CANCELLED'
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            return job is not None and job.cancel_requested
+
+    def version(self, job_id: str) -> Optional[Tuple[int, str]]:
+        """Current version and status of a resident job, without copying it."""
+        job_id = self.resolve(job_id)
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            if job is None:
+                return None
+            job.last_access = time.monotonic()
+            return job.version, job.status
+
+    def has_events_since(self, job_id: str, since: int) -> bool:
+        """Whether `wait` would return now: the job has events newer than
+        `since`, has finished, or is not resident."""
+        job_id = self.resolve(job_id)
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            return job is None or job.seq > since or job.status in TERMINAL_STATUSES
+
+    def status(self, job_id: str) -> Optional[str]:
+        """Status of a job without copying its events, EXPIRED once evicted."""
+        job_id = self.resolve(job_id)
+        current = self.version(job_id)
+        if current is not None:
+            return current[1]
+        job = self._load(job_id, sys.maxsize)
+        if job is not None:
+            return job.status
+        return 'EXPIRED' if self.is_evicted(job_id) else None
+
+    def find(self, status: Optional[str] = None, target_account: Optional[str] = None,
+             limit: Optional[int] = None) -> List[str]:
+        """Ids of jobs matching every given filter, newest first and at most
+        `limit` of them: resident jobs from the indexes, others from the
+        backend, if any."""
+        matches: List[Tuple[datetime, str]] = []
+        account = normalize_account(target_account) if target_account is not None else None
+        for shard in self._shards:
+            with shard.lock:
+                candidates: Optional[Set[str]] = None
+                if status is not None:
+                    candidates = shard.by_status.get(status, set())
+                if account is not None:
+                    by_account = shard.by_account.get(account, set())
+                    candidates = by_account if candidates is None else candidates & by_account
+                if candidates is None:
+                    candidates = set(shard.jobs)
+                matches.extend((shard.jobs[job_id].created_at, job_id) for job_id in candidates)
+        if self._backend is not None:
+            # Resident jobs may be ahead of their rows, so only the others are
+            # taken from the backend.
+            matches.extend(match for match in self._backend.find_jobs(status, target_account, limit)
+                           if match[1] not in self)
+        newest = heapq.nlargest(limit, matches) if limit is not None else sorted(matches, reverse=True)
+        return [job_id for _, job_id in newest]
+
+    def count_by_status(self) -> Dict[str, int]:
+        """Resident jobs per status, from the status index."""
+        counts: Counter = Counter()
+        for shard in self._shards:
+            with shard.lock:
+                for status, job_ids in shard.by_status.items():
+                    counts[status] += len(job_ids)
+        return dict(counts)
+
+    def summaries(self, job_ids: Iterable[str]) -> List[dict]:
+        """Compact per-job summaries, without copying any events."""
+        summaries = []
+        for job_id in job_ids:
+            target = self.resolve(job_id)
+            shard = self._shard(target)
+            with shard.lock:
+                job = shard.jobs.get(target)
+                if job is not None:
+                    summaries.append(_summary(job_id, job))
+                    continue
+            job = self._load(target, sys.maxsize)
+            if job is not None:
+                summaries.append(_summary(job_id, job))
+            else:
+                summaries.append({"job_id": job_id, "status": 'EXPIRED' if self.is_evicted(job_id) else None})
+        return summaries
+
+    def add_batch(self, batch_id: str, batch: Batch):
+        with self._batches_lock:
+            self._batches[batch_id] = batch
+
+    def get_batch(self, batch_id: str) -> Optional[Batch]:
+        with self._batches_lock:
+            return self._batches.get(batch_id)
+
+    def is_evicted(self, job_id: str) -> bool:
+        job_id = self.resolve(job_id)
+        shard = self._shard(job_id)
+        with shard.lock:
+            return job_id in shard.evicted
+
+    def subscribe(self, job_id: str, listener: Callable[[], None]) -> Optional[Callable[[], None]]:
+        """Call `listener` after every change to a resident job.
+
+        The listener runs under the shard lock and must only schedule work,
+        e.g. `loop.call_soon_threadsafe`. Returns an unsubscribe function, or
+        None if the job is not in memory.
+        """
+        job_id = self.resolve(job_id)
+        shard = self._shard(job_id)
+        with shard.lock:
+            if job_id not in shard.jobs:
+                return None
+            shard.listeners.setdefault(job_id, []).append(listener)
+
+        def unsubscribe():
+            with shard.lock:
+                listeners = shard.listeners.get(job_id)
+                if listeners and listener in listeners:
+                    listeners.remove(listener)
+                    if not listeners:
+                        del shard.listeners[job_id]
+
+        return unsubscribe
+
+    def wait_for_change(self, job_id: str, version: int, timeout: float) -> bool:
+        """Block until the job's version moves past `version`, it finishes, or
+        the timeout elapses. Returns whether the job has changed."""
+        job_id = self.resolve(job_id)
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            if job is None:
+                return False
+            return shard.changed[job_id].wait_for(
+                lambda: job.version != version or job.status in TERMINAL_STATUSES, timeout) \
+                and job.version != version
+
+    def wait(self, job_id: str, since: int, timeout: float) -> Optional[Job]:
+        """Block until the job has events newer than `since` or has finished.
+
+        Returns the same copy as `get`, possibly with no new events if the
+        timeout elapsed first. Waiting threads sleep on the job's condition
+        and use no CPU while the job is idle.
+        """
+        job_id = self.resolve(job_id)
+        shard = self._shard(job_id)
+        with shard.lock:
+            job = shard.jobs.get(job_id)
+            if job is not None:
+                shard.changed[job_id].wait_for(
+                    lambda: job.seq > since or job.status in TERMINAL_STATUSES, timeout)
+                job.last_access = time.monotonic()
+                return replace(job, events=job.events[max(since, 0):])
+        # Only finished jobs leave memory, so there is nothing to wait for.
+        return self._load(job_id, since)
+
+    def sweep(self, policy: EvictionPolicy) -> int:
+        """Evict finished jobs past their TTL, then least recently read ones
+        until the store is back under the job count and byte budget."""
+        evicted_ids = []
+        now = datetime.now()
+        if policy.ttl_seconds is not None and self._backend is not None:
+            # The TTL is the retention policy on disk too. Jobs evicted for
+            # capacity stay readable from disk until then, and jobs from
+            # before a restart were never resident to be evicted.
+            self._backend.delete_finished_before(now - timedelta(seconds=policy.ttl_seconds))
+        candidates = []
+        total_jobs = total_bytes = 0
+        for shard in self._shards:
+            with shard.lock:
+                for job_id, job in list(shard.jobs.items()):
+                    if job.finished_at is None:
+                        continue
+                    if policy.ttl_seconds is not None and \
+                            (now - job.finished_at).total_seconds() > policy.ttl_seconds:
+                        shard.evict(job_id, 'ttl')
+                        evicted_ids.append(job_id)
+                        continue
+                    candidates.append((job.last_access, job_id))
+                total_jobs += len(shard.jobs)
+                total_bytes += shard.bytes
+
+        candidates.sort()
+        for last_access, job_id in candidates:
+            over_jobs = policy.max_jobs is not None and total_jobs > policy.max_jobs
+            over_bytes = policy.max_bytes is not None and total_bytes > policy.max_bytes
+            if not (over_jobs or over_bytes):
+                break
+            shard = self._shard(job_id)
+            with shard.lock:
+                job = shard.jobs.get(job_id)
+                # Skip jobs read again since the scan; they are no longer the LRU.
+                if job is None or job.last_access != last_access:
+                    continue
+                total_jobs -= 1
+                total_bytes -= job.size
+                shard.evict(job_id, 'capacity')
+                evicted_ids.append(job_id)
+
+        if evicted_ids:
+            logger.info("Evicted %d jobs, %d resident bytes remain", len(evicted_ids), total_bytes)
+            # A batch goes once none of its jobs are resident any more.
+            with self._batches_lock:
+                batches = list(self._batches.items())
+            for batch_id, batch in batches:
+                if not any(job_id in self for job_id in batch.job_ids):
+                    with self._batches_lock:
+                        self._batches.pop(batch_id, None)
+            # Aliases go with their job and answer 410 from then on.
+            gone = set(evicted_ids)
+            with self._coalesce_lock:
+                aliases = [alias_id for alias_id, job_id in self._aliases.items() if job_id in gone]
+                for alias_id in aliases:
+                    del self._aliases[alias_id]
+                    shard = self._shard(alias_id)
+                    with shard.lock:
+                        shard.tombstone(alias_id)
+        return len(evicted_ids)
+
+    def start_sweeper(self, policy: EvictionPolicy, interval: float):
+        if self._sweeper is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sweep(policy)
+                except Exception:
+                    logger.exception("Job sweeper failed")
+
+        self._sweeper = Thread(target=run, name="job-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stats(self) -> dict:
+        jobs = resident_bytes = 0
+        evictions: Counter = Counter()
+        for shard in self._shards:
+            with shard.lock:
+                jobs += len(shard.jobs)
+                resident_bytes += shard.bytes
+                evictions.update(shard.evictions)
+        with self._coalesce_lock:
+            coalescing = {"inflight": len(self._inflight), "aliases": len(self._aliases),
+                          "coalesced_total": self._coalesced}
+        return {
+            "jobs": jobs,
+            "resident_bytes": resident_bytes,
+            "evictions": dict(evictions),
+            "coalescing": coalescing,
+        }
+
+    def __contains__(self, job_id: str) -> bool:
+        job_id = self.resolve(job_id)
+        shard = self._shard(job_id)
+        with shard.lock:
+            return job_id in shard.jobs
+
+    def __len__(self) -> int:
+        return sum(len(shard.jobs) for shard in self._shards)
+
+
+job_store = JobStore()
+
+
+def create_job(job_id: str, target_account: Optional[str] = None, topics: Optional[List[str]] = None):
+    job_store.create(job_id, target_account=target_account, topics=topics)
+
+
+def discard_job(job_id: str):
+    job_store.discard(job_id)
+
+
+def start_job(job_id: str):
+    job_store.start(job_id)
 
 
 def append_event(job_id: str, event_data: str):
-    with jobs_lock:
-        if job_id not in jobs:
-            logger.info("Job %s started", job_id)
-            jobs[job_id] = Job(
-                status='STARTED',
-                events=[],
-                result='')
-        else:
-            logger.info("Appending event for job %s: %s", job_id, event_data)
-        jobs[job_id].events.append(
-            Event(timestamp=datetime.now(), data=event_data))
+    job_store.append_event(job_id, event_data)
+
+
+def finish_job(job_id: str, status: str, result: Optional[str], event_data: Optional[str] = None,
+               result_json: Any = None):
+    job_store.finish(job_id, status, result, event_data, result_json)
+
+
+def get_job(job_id: str, since: int = 0) -> Optional[Job]:
+    return job_store.get(job_id, since)
+
+
+def wait_for_change(job_id: str, version: int, timeout: float) -> bool:
+    return job_store.wait_for_change(job_id, version, timeout)
+
+
+def request_cancel(job_id: str) -> Optional[str]:
+    return job_store.request_cancel(job_id)
+
+
+def is_cancelled(job_id: Optional[str]) -> bool:
+    return job_id is not None and job_store.is_cancel_requested(job_id)
+
+
+def raise_if_cancelled(job_id: Optional[str]):
+    """Checkpoint for crews, task callbacks and LLM calls: stop here if the
+    job has been cancelled."""
+    if is_cancelled(job_id):
+        raise JobCancelled(f"Job {job_id} was cancelled")
+
+
+def get_job_version(job_id: str) -> Optional[Tuple[int, str]]:
+    return job_store.version(job_id)
+
+
+def is_evicted(job_id: str) -> bool:
+    return job_store.is_evicted(job_id)
+
+
+def wait_for_events(job_id: str, since: int, timeout: float) -> Optional[Job]:
+    return job_store.wait(job_id, since, timeout)
@@ -0,0 +1,121 @@
+"""Process-wide LLM clients.
+
+Building a ChatOpenAI also builds an OpenAI client with its own HTTP
+connection pool, so constructing one per job made every job pay fresh TCP
+and TLS handshakes. `chat_llm` instead keeps one configured client per
+model and parameters, all on a single keep-alive pool shared by every job
+and agent in the process.
+
+CREW_SHARED_LLM_POOL=0 goes back to a private client per call. Either way
+requests pass through the process-wide rate limiter in rate_limit.py, and
+have their max_tokens capped by the job's token budget.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Sequence
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+from langchain_openai import ChatOpenAI
+
+from budget import CompletionCapTransport
+from llm_cache import llm_cache
+# Imported for its configure hook, which times every LLM call.
+import llm_metrics
+from rate_limit import RateLimitedTransport, rate_limiter
+from semantic_cache import semantic_cache
+
+
+SHARED_POOL = os.environ.get('CREW_SHARED_LLM_POOL', '1') != '0'
+# Every worker runs a crew whose async tasks call the LLM concurrently, so
+# the pool is sized for workers x parallel tasks rather than for one job.
+MAX_CONNECTIONS = int(os.environ.get('CREW_LLM_MAX_CONNECTIONS', 64))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('CREW_LLM_MAX_KEEPALIVE', 32))
+# Long enough to bridge the gaps between a crew's calls, which last as
+# long as a tool call or another agent's turn.
+KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get('CREW_LLM_KEEPALIVE_SECONDS', 120))
+TIMEOUT = httpx.Timeout(float(os.environ.get('CREW_LLM_TIMEOUT_SECONDS', 600)), connect=10)
+
+_lock = threading.Lock()
+_http_client: Optional[httpx.Client] = None
+_llms: Dict[Hashable, ChatOpenAI] = {}
+# One context variable per handler slot of task_callbacks.
+_task_callbacks: List[ContextVar] = []
+
+
+def _new_http_client() -> httpx.Client:
+    transport = httpx.HTTPTransport(limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                                        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                                                        keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS))
+    if rate_limiter is not None:
+        transport = RateLimitedTransport(transport, rate_limiter)
+    # Outermost, so the rate limiter counts the capped completion.
+    return httpx.Client(transport=CompletionCapTransport(transport), timeout=TIMEOUT)
+
+
+def http_client() -> httpx.Client:
+    """The keep-alive pool shared by all LLM clients."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = _new_http_client()
+        return _http_client
+
+
+def chat_llm(model: str, cache: bool = True, callbacks: Sequence[Any] = (), **params) -> ChatOpenAI:
+    """A ChatOpenAI for `model` and `params` backed by the shared pool.
+
+    With `cache` responses are served from and saved to the LLM response
+    cache, and the semantic cache when enabled; without it every call goes
+    to the model. llm_metrics sees every call without being in `callbacks`.
+    """
+    response_cache = (semantic_cache or llm_cache or False) if cache else False
+    if not SHARED_POOL:
+        return ChatOpenAI(model=model, http_client=_new_http_client(), callbacks=list(callbacks),
+                          cache=response_cache, **params)
+    key = (model, tuple(sorted(params.items())))
+    with _lock:
+        llm = _llms.get(key)
+    if llm is None:
+        llm = ChatOpenAI(model=model, http_client=http_client(), **params)
+        with _lock:
+            llm = _llms.setdefault(key, llm)
+    # crewai agents replace `llm.callbacks` with their own token counter, so
+    # each caller gets a shallow copy with its own list; the OpenAI client inside,
+    # and with it the connection pool, stays shared. copy() leaves out fields
+    # declared with exclude=True, the client among them, so those are carried
+    # over explicitly.
+    excluded = {name: getattr(llm, name) for name, field in llm.__fields__.items() if field.field_info.exclude}
+    return llm.copy(update={**excluded, "callbacks": list(callbacks), "cache": response_cache})
+
+
+@contextmanager
+def task_callbacks(handlers: Sequence[BaseCallbackHandler]) -> Iterator[None]:
+    """Attach `handlers` to every LLM call made on this thread in the block.
+
+    crewai replaces the callbacks of agents' LLMs, so handlers that must see
+    all of a task's calls go through LangChain configure hooks instead.
+    """
+    with _lock:
+        while len(_task_callbacks) < len(handlers):
+            var = ContextVar(f'task_callback_{len(_task_callbacks)}', default=None)
+            register_configure_hook(var, inheritable=True)
+            _task_callbacks.append(var)
+    tokens = [(var, var.set(handler)) for var, handler in zip(_task_callbacks, handlers)]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def stats() -> dict:
+    with _lock:
+        clients = len(_llms)
+    return {"shared_pool": SHARED_POOL, "clients": clients,
+            "cache": llm_cache.stats() if llm_cache is not None else None,
+            "semantic_cache": semantic_cache.stats() if semantic_cache is not None else None,
+            "rate_limit": rate_limiter.stats() if rate_limiter is not None else None}
@@ -0,0 +1,185 @@
+"""Content-addressed cache of LLM responses, in front of every chat_llm.
+
+Agents and tasks build their prompts from fixed templates, so researching an
+account again sends the LLM many prompts it has already answered. Responses
+are keyed by a hash of the model, sampling parameters and messages (which
+LangChain passes as `llm_string` and `prompt`), kept in a byte-bounded LRU
+in memory and in a size-bounded SQLite file, and expire after a TTL.
+
+Jobs submitted with "llm_cache": false bypass it and always call the LLM.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Sequence, Tuple
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from metrics import LLM_CACHE_LOOKUPS, LLM_CACHE_TOKENS_SAVED
+from utils.logging import logger
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text.
+    return max(1, len(text) // 4)
+
+
+class LLMResponseCache(BaseCache):
+    """LangChain cache with an in-memory LRU over an optional SQLite store."""
+
+    def __init__(self, ttl_seconds: float = 7 * 86400, max_memory_bytes: int = 64 * 1024 * 1024,
+                 path: Optional[str] = None, max_disk_bytes: int = 1024 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        # key -> (generations, tokens, size, created_at)
+        self._memory: "OrderedDict[str, Tuple[Any, int, int, float]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._hits = self._disk_hits = self._misses = self._tokens_saved = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+        if path:
+            # Single-row reads and writes, cheap next to the LLM call they
+            # stand in for, so they share this connection under `_lock`.
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            self._db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - ttl_seconds,))
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode()).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Any]]:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[3] > self.ttl_seconds:
+                self._forget(key)
+                entry = None
+            source = 'memory'
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, tokens, size, created_at FROM responses WHERE key = ? AND created_at >= ?",
+                    (key, now - self.ttl_seconds)).fetchone()
+                if row is not None:
+                    value, tokens, size, created_at = row
+                    entry = (loads(value), tokens, size, created_at)
+                    self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._remember(key, entry)
+                    source = 'disk'
+            if entry is None:
+                self._misses += 1
+                LLM_CACHE_LOOKUPS.inc(labels=('miss',))
+                return None
+            self._memory.move_to_end(key)
+            self._hits += 1
+            self._disk_hits += source == 'disk'
+            self._tokens_saved += entry[1]
+        LLM_CACHE_LOOKUPS.inc(labels=(f'hit_{source}',))
+        LLM_CACHE_TOKENS_SAVED.inc(entry[1])
+        return entry[0]
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]):
+        key = self._key(prompt, llm_string)
+        value = dumps(list(return_val))
+        # What a hit saves: the prompt sent plus the completion received.
+        tokens = estimate_tokens(prompt) + sum(estimate_tokens(generation.text) for generation in return_val)
+        size = len(value)
+        now = time.time()
+        with self._lock:
+            self._remember(key, (list(return_val), tokens, size, now))
+            if self._db is None:
+                return
+            try:
+                previous = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, tokens, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (key, value, tokens, size, now, now))
+                self._disk_bytes += size - (previous[0] if previous else 0)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._shrink_disk()
+            except sqlite3.Error:
+                logger.exception("Failed to persist LLM response")
+
+    def _shrink_disk(self):
+        # Drop least recently used responses until back under 90% of the
+        # budget, so eviction runs now and then rather than on every write.
+        target = self.max_disk_bytes * 0.9
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._disk_bytes <= target:
+                break
+            evicted.append((key,))
+            self._disk_bytes -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def _remember(self, key: str, entry: Tuple[Any, int, int, float]):
+        self._forget(key)
+        self._memory[key] = entry
+        self._memory_bytes += entry[2]
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, (_, _, size, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= size
+
+    def _forget(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry[2]
+
+    def clear(self, **kwargs: Any):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._disk_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "tokens_saved": self._tokens_saved,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
+
+
+def _from_env() -> Optional[LLMResponseCache]:
+    if os.environ.get('CREW_LLM_CACHE', '1') == '0':
+        return None
+    return LLMResponseCache(
+        ttl_seconds=float(os.environ.get('CREW_LLM_CACHE_TTL_SECONDS', 7 * 86400)),
+        max_memory_bytes=int(os.environ.get('CREW_LLM_CACHE_MEMORY_BYTES', 64 * 1024 * 1024)),
+        path=os.environ.get('CREW_LLM_CACHE_DB', 'llm_cache.db') or None,
+        max_disk_bytes=int(os.environ.get('CREW_LLM_CACHE_DISK_BYTES', 1024 * 1024 * 1024)))
+
+
+# None when disabled with CREW_LLM_CACHE=0.
+llm_cache = _from_env()
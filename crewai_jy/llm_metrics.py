@@ -0,0 +1,63 @@
+"""LangChain callback feeding LLM latency and token usage into metrics.py,
+and each call into the calling task's timeline."""
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.tracers.context import register_configure_hook
+
+from metrics import LLM_CALL_DURATION, LLM_CALL_TOKENS, LLM_TOKENS
+from timeline import Span, timelines
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Times every LLM call by run id and counts the tokens it reports."""
+
+    def __init__(self):
+        # run id -> (perf_counter at start, model, timeline span); single
+        # dict operations are atomic, so concurrent calls need no lock.
+        self._started: Dict[UUID, Tuple[float, str, Optional[Span]]] = {}
+
+    @staticmethod
+    def _model(serialized: Optional[Dict[str, Any]]) -> str:
+        kwargs = (serialized or {}).get('kwargs', {})
+        return kwargs.get('model_name') or kwargs.get('model') or 'unknown'
+
+    def _start(self, serialized: Optional[Dict[str, Any]], run_id: UUID):
+        # Callbacks fire on the thread making the call, i.e. the task's own.
+        model = self._model(serialized)
+        self._started[run_id] = (time.perf_counter(), model, timelines.begin(None, 'llm', model))
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts, *, run_id: UUID, **kwargs: Any):
+        self._start(serialized, run_id)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, *, run_id: UUID, **kwargs: Any):
+        self._start(serialized, run_id)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        start, model, span = self._started.pop(run_id, (None, 'unknown', None))
+        if start is not None:
+            LLM_CALL_DURATION.observe(time.perf_counter() - start, (model, 'ok'))
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+        timelines.end(span, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        LLM_TOKENS.inc(prompt_tokens, (model, 'prompt'))
+        LLM_TOKENS.inc(completion_tokens, (model, 'completion'))
+        LLM_CALL_TOKENS.observe(prompt_tokens + completion_tokens, (model,))
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        start, model, span = self._started.pop(run_id, (None, 'unknown', None))
+        if start is not None:
+            LLM_CALL_DURATION.observe(time.perf_counter() - start, (model, 'error'))
+        timelines.end(span, error=type(error).__name__)
+
+
+llm_metrics = LLMMetricsHandler()
+# crewai replaces the callbacks of an agent's LLM with its own token counter
+# whenever the agent is validated, so the handler is attached to every call
+# in the process through a LangChain configure hook instead.
+register_configure_hook(ContextVar('llm_metrics', default=llm_metrics), inheritable=True)
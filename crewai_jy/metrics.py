@@ -0,0 +1,262 @@
+"""Process metrics in the Prometheus text format, served at /metrics.
+
+Recording is on the hot path of crew callbacks, tool calls and job store
+locks, so it takes no lock: every thread updates its own cells, and a
+scrape sums the cells of all threads. Histograms use fixed buckets chosen
+up front, so an observation is a bisect and two additions. Gauges such as
+queue depth are computed by collectors only when scraped.
+"""
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+
+# Bucket upper bounds, in seconds unless noted.
+LOCK_WAIT_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 0.01, 0.1, 1.0)
+CALL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TASK_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200)
+JOB_BUCKETS = (1, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+TOKEN_BUCKETS = (100, 500, 1000, 2000, 4000, 8000, 16000, 32000, 128000)
+
+
+class _PerThread:
+    """One cell per thread; a cell is only ever written by its own thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._live: List[Tuple["weakref.ref[threading.Thread]", dict]] = []
+        # Cells of threads that have exited, merged so short-lived request
+        # threads do not accumulate.
+        self._retired: dict = {}
+
+    def cell(self) -> dict:
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = {}
+            with self._lock:
+                self._live.append((weakref.ref(threading.current_thread()), cell))
+            return cell
+
+    def snapshot(self, merge: Callable[[dict, dict], None]) -> dict:
+        total: dict = {}
+        with self._lock:
+            live = []
+            for thread_ref, cell in self._live:
+                thread = thread_ref()
+                if thread is None or not thread.is_alive():
+                    merge(self._retired, cell.copy())
+                else:
+                    live.append((thread_ref, cell))
+            self._live = live
+            merge(total, self._retired)
+            cells = [cell for _, cell in live]
+        for cell in cells:
+            # dict.copy is atomic under the GIL, unlike iterating the cell.
+            merge(total, cell.copy())
+        return total
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._cells = _PerThread()
+
+    def inc(self, amount: float = 1, labels: Labels = ()):
+        cell = self._cells.cell()
+        cell[labels] = cell.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(total: dict, cell: dict):
+        for labels, value in cell.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def values(self) -> Dict[Labels, float]:
+        return self._cells.snapshot(self._merge)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._cells = _PerThread()
+
+    def observe(self, value: float, labels: Labels = ()):
+        cell = self._cells.cell()
+        counts = cell.get(labels)
+        if counts is None:
+            # One count per bucket plus +Inf, then the sum.
+            counts = cell[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, labels: Labels = ()) -> "_Timer":
+        return _Timer(self, labels)
+
+    @staticmethod
+    def _merge(total: dict, cell: dict):
+        for labels, counts in cell.items():
+            merged = total.get(labels)
+            if merged is None:
+                total[labels] = list(counts)
+            else:
+                for i, count in enumerate(counts):
+                    merged[i] += count
+
+    def values(self) -> Dict[Labels, List[float]]:
+        return self._cells.snapshot(self._merge)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels((*self.labelnames, 'le'), (*labels, le))} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram: Histogram, labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.histogram.observe(time.perf_counter() - self.start, self.labels)
+
+
+class Gauge:
+    """A value computed at scrape time by `collect`."""
+
+    def __init__(self, name: str, help: str, collect: Callable[[], Dict[Labels, float]],
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class TimedLock:
+    """A Lock that records how long callers waited for it when contended.
+
+    Uncontended acquisitions only pay for a non-blocking attempt. Works as
+    the lock of a threading.Condition.
+    """
+    __slots__ = ('_lock', '_histogram', '_labels')
+
+    def __init__(self, histogram: Histogram, labels: Labels = ()):
+        self._lock = threading.Lock()
+        self._histogram = histogram
+        self._labels = labels
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        acquired = self._lock.acquire(True, timeout)
+        self._histogram.observe(time.perf_counter() - start, self._labels)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *_):
+        self._lock.release()
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+JOBS_LOCK_WAIT = registry.register(Histogram(
+    'crew_jobs_lock_wait_seconds', 'Time spent waiting for a contended job store shard lock.',
+    LOCK_WAIT_BUCKETS))
+JOB_QUEUE_WAIT = registry.register(Histogram(
+    'crew_job_queue_wait_seconds', 'Time jobs spent queued before a worker started them.', JOB_BUCKETS))
+JOB_DURATION = registry.register(Histogram(
+    'crew_job_duration_seconds', 'Time from submission to a terminal status.', JOB_BUCKETS, ('status',)))
+JOBS_FINISHED = registry.register(Counter(
+    'crew_jobs_finished_total', 'Jobs that reached a terminal status.', ('status',)))
+TASK_DURATION = registry.register(Histogram(
+    'crew_task_duration_seconds', 'Latency of crew tasks by task type.', TASK_BUCKETS, ('task',)))
+EXA_CALL_DURATION = registry.register(Histogram(
+    'crew_exa_call_duration_seconds', 'Latency of Exa API calls.', CALL_BUCKETS, ('operation', 'outcome')))
+LLM_CALL_DURATION = registry.register(Histogram(
+    'crew_llm_call_duration_seconds', 'Latency of LLM calls.', CALL_BUCKETS, ('model', 'outcome')))
+LLM_TOKENS = registry.register(Counter(
+    'crew_llm_tokens_total', 'Tokens used by LLM calls.', ('model', 'kind')))
+LLM_CALL_TOKENS = registry.register(Histogram(
+    'crew_llm_call_tokens', 'Total tokens per LLM call.', TOKEN_BUCKETS, ('model',)))
+LLM_CACHE_LOOKUPS = registry.register(Counter(
+    'crew_llm_cache_lookups_total', 'LLM response cache lookups by result.', ('result',)))
+LLM_CACHE_TOKENS_SAVED = registry.register(Counter(
+    'crew_llm_cache_tokens_saved_total', 'Estimated tokens not sent to the LLM thanks to cache hits.'))
+LLM_RATE_LIMIT_WAIT = registry.register(Histogram(
+    'crew_llm_rate_limit_wait_seconds', 'Time OpenAI requests waited for the shared rate limiter.',
+    LOCK_WAIT_BUCKETS + CALL_BUCKETS[2:]))
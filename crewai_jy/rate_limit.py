@@ -0,0 +1,258 @@
+"""Process-wide token buckets for OpenAI requests and tokens per minute.
+
+crewai's RPMController throttles one crew at a time, so concurrent jobs
+together overran the account's limits and answered the resulting 429s with
+retries of their own. Every request to the OpenAI API now goes through
+`RateLimitedTransport` on the shared HTTP client, retries included, and
+first takes one request and its estimated tokens from `rate_limiter`.
+
+Callers that have to wait are served round-robin by job, so one job with
+many parallel tasks cannot starve the others. Token estimates are the
+prompt as tiktoken counts it plus the completion allowance, and are
+corrected with the usage OpenAI reports once the response is in.
+
+With CREW_RATE_LIMIT_FILE the bucket levels live in that file under an
+flock, shared by every process on the host; fairness between jobs then
+holds within each process.
+"""
+import json
+import os
+import struct
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from metrics import LLM_RATE_LIMIT_WAIT
+from timeline import timelines
+from tokens import EXPECTED_COMPLETION_TOKENS, count_messages
+from utils.logging import logger
+
+
+def _refill(levels: List[float], elapsed: float, rates: Tuple[float, float],
+            capacities: Tuple[float, float]):
+    for i, rate in enumerate(rates):
+        if rate:
+            levels[i] = min(capacities[i], levels[i] + elapsed * rate)
+
+
+def _take(levels: List[float], amounts: Tuple[float, float], rates: Tuple[float, float],
+          capacities: Tuple[float, float]) -> float:
+    """Take `amounts` from `levels` and return 0, or leave them and return
+    the seconds until both buckets hold enough."""
+    wait = 0.0
+    for i, rate in enumerate(rates):
+        # A request larger than the bucket could never be served; it waits
+        # for a full bucket instead.
+        amount = min(amounts[i], capacities[i])
+        if rate and levels[i] < amount:
+            wait = max(wait, (amount - levels[i]) / rate)
+    if wait:
+        return wait
+    for i, rate in enumerate(rates):
+        if rate:
+            levels[i] -= min(amounts[i], capacities[i])
+    return 0.0
+
+
+class _LocalBuckets:
+    def __init__(self, rates: Tuple[float, float], capacities: Tuple[float, float]):
+        self.rates = rates
+        self.capacities = capacities
+        self.levels = list(capacities)
+        self.updated = time.monotonic()
+
+    def _update(self) -> List[float]:
+        now = time.monotonic()
+        _refill(self.levels, now - self.updated, self.rates, self.capacities)
+        self.updated = now
+        return self.levels
+
+    def take(self, requests: float, tokens: float) -> float:
+        return _take(self._update(), (requests, tokens), self.rates, self.capacities)
+
+    def adjust(self, tokens: float):
+        levels = self._update()
+        levels[1] = min(self.capacities[1], levels[1] - tokens)
+
+    def snapshot(self) -> List[float]:
+        return list(self._update())
+
+
+class _FileBuckets:
+    """Bucket levels kept in a file, so processes on one host share them."""
+    _FORMAT = struct.Struct('<ddd')
+
+    def __init__(self, path: str, rates: Tuple[float, float], capacities: Tuple[float, float]):
+        import fcntl
+        self._fcntl = fcntl
+        self.rates = rates
+        self.capacities = capacities
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _locked(self, update) -> object:
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+        try:
+            data = os.pread(self._fd, self._FORMAT.size, 0)
+            now = time.time()
+            if len(data) == self._FORMAT.size:
+                requests, tokens, updated = self._FORMAT.unpack(data)
+                levels = [requests, tokens]
+                _refill(levels, max(now - updated, 0.0), self.rates, self.capacities)
+            else:
+                levels = list(self.capacities)
+            result = update(levels)
+            os.pwrite(self._fd, self._FORMAT.pack(*levels, now), 0)
+            return result
+        finally:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    def take(self, requests: float, tokens: float) -> float:
+        return self._locked(lambda levels: _take(levels, (requests, tokens), self.rates, self.capacities))
+
+    def adjust(self, tokens: float):
+        def update(levels):
+            levels[1] = min(self.capacities[1], levels[1] - tokens)
+        self._locked(update)
+
+    def snapshot(self) -> List[float]:
+        return self._locked(list)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets with fair queueing.
+
+    A limit of 0 disables that bucket. The buckets hold `burst_seconds`
+    worth of their limit, so a quiet spell cannot bank a whole minute.
+    """
+
+    def __init__(self, rpm: float, tpm: float, burst_seconds: float = 10, path: Optional[str] = None):
+        rates = (rpm / 60, tpm / 60)
+        capacities = (max(rpm * burst_seconds / 60, 1), tpm * burst_seconds / 60)
+        self.rpm = rpm
+        self.tpm = tpm
+        self._buckets = _FileBuckets(path, rates, capacities) if path else _LocalBuckets(rates, capacities)
+        self._cond = threading.Condition()
+        # Waiting callers per job, and the jobs in the order they are served.
+        self._queues: Dict[Optional[str], Deque[object]] = {}
+        self._order: Deque[Optional[str]] = deque()
+        self._waited = 0.0
+        self._throttled = 0
+
+    def acquire(self, job_id: Optional[str], tokens: float) -> float:
+        """Block until one request and `tokens` may be sent; returns the
+        seconds spent waiting."""
+        start = time.perf_counter()
+        ticket = object()
+        with self._cond:
+            queue = self._queues.get(job_id)
+            if queue is None:
+                queue = self._queues[job_id] = deque()
+                self._order.append(job_id)
+            queue.append(ticket)
+            granted = False
+            try:
+                while True:
+                    if self._order[0] == job_id and queue[0] is ticket:
+                        wait = self._buckets.take(1, tokens)
+                        if not wait:
+                            granted = True
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+            finally:
+                queue.remove(ticket)
+                if granted or not queue:
+                    # Served jobs go to the back of the line.
+                    self._order.remove(job_id)
+                    if queue:
+                        self._order.append(job_id)
+                    else:
+                        del self._queues[job_id]
+                self._cond.notify_all()
+            waited = time.perf_counter() - start
+            if waited > 0.001:
+                self._waited += waited
+                self._throttled += 1
+        LLM_RATE_LIMIT_WAIT.observe(waited)
+        return waited
+
+    def settle(self, estimated: float, actual: float):
+        """Charge the difference once a request's real usage is known."""
+        with self._cond:
+            self._buckets.adjust(actual - estimated)
+            if actual < estimated:
+                self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            requests, tokens = self._buckets.snapshot()
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "available_requests": round(requests, 1),
+                "available_tokens": round(tokens),
+                "waiting": sum(len(queue) for queue in self._queues.values()),
+                "jobs_waiting": len(self._queues),
+                "throttled": self._throttled,
+                "seconds_waited": round(self._waited, 3),
+            }
+
+
+def estimate_request_tokens(request: httpx.Request) -> int:
+    """Prompt tokens plus the completion allowance of an OpenAI request."""
+    try:
+        body = json.loads(request.read())
+    except ValueError:
+        return 0
+    if not isinstance(body, dict) or 'messages' not in body:
+        return 0
+    model = body.get('model') or 'gpt-3.5-turbo'
+    completion = body.get('max_tokens') or EXPECTED_COMPLETION_TOKENS
+    return count_messages(body['messages'], model) + completion * (body.get('n') or 1)
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """Takes every request through `limiter` before sending it."""
+
+    def __init__(self, transport: httpx.BaseTransport, limiter: RateLimiter):
+        self._transport = transport
+        self._limiter = limiter
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        estimated = estimate_request_tokens(request)
+        # The OpenAI client sends from the calling task's thread.
+        current = timelines.current()
+        self._limiter.acquire(current[0] if current else None, estimated)
+        response = self._transport.handle_request(request)
+        if response.status_code == 200 and 'json' in response.headers.get('content-type', ''):
+            # Non-streamed completions are small; reading them here leaves
+            # the content cached on the response for the client.
+            try:
+                usage = json.loads(response.read()).get('usage') or {}
+            except (ValueError, AttributeError):
+                usage = {}
+            if 'total_tokens' in usage:
+                self._limiter.settle(estimated, usage['total_tokens'])
+        elif response.status_code == 429:
+            logger.warning("OpenAI rate limit hit despite the limiter; check CREW_OPENAI_RPM/TPM")
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+def _from_env() -> Optional[RateLimiter]:
+    rpm = float(os.environ.get('CREW_OPENAI_RPM', 3500))
+    tpm = float(os.environ.get('CREW_OPENAI_TPM', 200_000))
+    if not rpm and not tpm:
+        return None
+    return RateLimiter(rpm, tpm, burst_seconds=float(os.environ.get('CREW_RATE_LIMIT_BURST_SECONDS', 10)),
+                       path=os.environ.get('CREW_RATE_LIMIT_FILE') or None)
+
+
+# None when both CREW_OPENAI_RPM and CREW_OPENAI_TPM are 0.
+rate_limiter = _from_env()
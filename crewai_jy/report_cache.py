@@ -0,0 +1,129 @@
+"""Cache of finished account reports, keyed like crew coalescing.
+
+The same accounts are researched again every day; a POST /api/crew with
+`max_age` is answered from here when a report for the same account, topics
+and crew version finished recently enough. Reports live in a bounded LRU in
+memory and, optionally, in a SQLite file that survives restarts.
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional
+
+from job_manager import parse_result
+from utils.logging import logger
+
+
+@dataclass
+class CachedReport:
+    result: str
+    result_json: Any
+    # Wall-clock time the report finished, so ages survive a restart.
+    created_at: float
+    job_id: str
+
+    @property
+    def age(self) -> float:
+        return max(time.time() - self.created_at, 0.0)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    job_id TEXT NOT NULL
+)
+"""
+
+
+class ReportCache:
+    """Finished reports by coalescing key, expiring after `ttl_seconds`."""
+
+    def __init__(self, ttl_seconds: float = 86400, max_entries: int = 1000, path: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, CachedReport]" = OrderedDict()
+        self._hits = self._disk_hits = self._misses = self._stale = self._stores = 0
+        self._hit_age_total = 0.0
+        self._hit_age_max = 0.0
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            # Reports are written once per finished crew, so one connection
+            # behind the cache lock is plenty.
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(_SCHEMA)
+            self._db.execute("DELETE FROM reports WHERE created_at < ?", (time.time() - ttl_seconds,))
+
+    @staticmethod
+    def _encode_key(key: Hashable) -> str:
+        return json.dumps(key, separators=(',', ':'))
+
+    def get(self, key: Hashable, max_age: float) -> Optional[CachedReport]:
+        """A report for `key` no older than `max_age` (and the TTL), else None."""
+        encoded = self._encode_key(key)
+        max_age = min(max_age, self.ttl_seconds)
+        with self._lock:
+            report = self._entries.get(encoded)
+            from_disk = False
+            if report is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT result, created_at, job_id FROM reports WHERE key = ?", (encoded,)).fetchone()
+                if row is not None:
+                    result, created_at, job_id = row
+                    report = CachedReport(result, parse_result(result), created_at, job_id)
+                    self._remember(encoded, report)
+                    from_disk = True
+            if report is None:
+                self._misses += 1
+                return None
+            if report.age > max_age:
+                self._stale += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(encoded)
+            self._hits += 1
+            self._disk_hits += from_disk
+            self._hit_age_total += report.age
+            self._hit_age_max = max(self._hit_age_max, report.age)
+            return report
+
+    def put(self, key: Hashable, job_id: str, result: str, result_json: Any):
+        encoded = self._encode_key(key)
+        report = CachedReport(result, result_json, time.time(), job_id)
+        with self._lock:
+            self._remember(encoded, report)
+            self._stores += 1
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO reports (key, result, created_at, job_id) VALUES (?, ?, ?, ?)",
+                        (encoded, result, report.created_at, job_id))
+                except sqlite3.Error:
+                    logger.exception("Failed to persist report for job %s", job_id)
+
+    def _remember(self, encoded: str, report: CachedReport):
+        self._entries[encoded] = report
+        self._entries.move_to_end(encoded)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "stale": self._stale,
+                "stores": self._stores,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "hit_age_avg_seconds": self._hit_age_total / self._hits if self._hits else 0.0,
+                "hit_age_max_seconds": self._hit_age_max,
+            }
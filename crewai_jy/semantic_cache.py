@@ -0,0 +1,276 @@
+"""Opt-in semantic cache of LLM responses, consulted after the exact cache.
+
+Prompts that differ only in the casing of an account name or the phrasing
+of a topic hash differently, so the exact cache misses them. Tasks make
+their LLM calls within a `scope` naming their account and topics; this
+cache masks those out of the prompt and answers with the response to an
+earlier prompt that is otherwise the same, for the same model, parameters
+and account, and whose topics are similar enough: the cosine similarity
+of their embeddings reaches a threshold.
+
+Only the topics are embedded because the task templates make up most of
+every prompt: whole prompts about different accounts or topics embed
+almost alike, and so do successive steps of one task. Calls made outside
+a scope only use the exact cache.
+
+Vectors live in a NumPy file memory-mapped from disk, used as a ring of
+fixed capacity, and are searched by brute force; responses are stored in a
+SQLite file next to it. After a restart the map is reopened as is, so the
+index costs nothing to load and its pages are read in as searches touch
+them.
+
+Enable with CREW_SEMANTIC_CACHE=1. CREW_SEMANTIC_CACHE_EMBEDDING names an
+embedding function as "module:function", taking a string and returning a
+vector; the default is a local hashing embedding that needs no model.
+"""
+import hashlib
+import importlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from llm_cache import estimate_tokens, llm_cache
+from metrics import LLM_CACHE_LOOKUPS, LLM_CACHE_TOKENS_SAVED
+from utils.logging import logger
+
+
+Embedding = Callable[[str], Sequence[float]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    row INTEGER PRIMARY KEY,
+    llm_string TEXT NOT NULL,
+    value TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+_WORD = re.compile(r"\w+")
+
+# The account and topics of the current task, set by `scope`.
+_scope: ContextVar[Optional[Tuple[str, Tuple[str, ...]]]] = ContextVar('semantic_cache_scope', default=None)
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(_WORD.findall(text.casefold()))
+
+
+@contextmanager
+def scope(target_account: str, topics: Sequence[str]) -> Iterator[None]:
+    """Lets the LLM calls made inside match earlier calls for the same
+    account and similar `topics`."""
+    token = _scope.set((target_account, tuple(topics)))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def _mask(text: str, value: str, placeholder: str) -> str:
+    # Matches `value` whatever its casing and the punctuation between words.
+    words = _WORD.findall(value)
+    if not words:
+        return text
+    pattern = r'\b' + r'\W+'.join(map(re.escape, words)) + r'\b'
+    return re.sub(pattern, placeholder, text, flags=re.IGNORECASE)
+
+
+def hashing_embedding(text: str, dim: int = 256) -> np.ndarray:
+    """Feature-hashed bag of lowercased words and word bigrams."""
+    words = _WORD.findall(text.lower())
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in (*words, *(f"{a} {b}" for a, b in zip(words, words[1:]))):
+        digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), 'little')
+        vector[digest % dim] += 1.0 if digest >> 63 else -1.0
+    return vector
+
+
+def load_embedding(path: str) -> Embedding:
+    module, _, name = path.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def _prompt_text(prompt: str) -> str:
+    # Chat models pass their messages serialized by langchain_core.load;
+    # masking works on the contents, not on their JSON escaping.
+    try:
+        messages = loads(prompt)
+    except Exception:
+        return prompt
+    if not isinstance(messages, list):
+        return prompt
+    return '\n'.join(str(getattr(message, 'content', message)) for message in messages)
+
+
+def _key(llm_string: str, target_account: str, masked_prompt: str) -> int:
+    digest = hashlib.sha256(f"{llm_string}\0{_normalize(target_account)}\0{masked_prompt}".encode()).digest()
+    return int.from_bytes(digest[:8], 'little', signed=True)
+
+
+class SemanticCache(BaseCache):
+    """LangChain cache answering near-duplicate prompts from a vector index.
+
+    Lookups go to `exact` first, and updates are written to both. Vectors
+    of topics are keyed by the model parameters, the account and the masked
+    prompt, and only compared with vectors of the same key.
+    """
+
+    def __init__(self, directory: str, embed: Optional[Embedding] = None, dim: int = 256,
+                 threshold: float = 0.9, capacity: int = 100_000, ttl_seconds: float = 7 * 86400,
+                 exact: Optional[BaseCache] = None):
+        self.embed = embed or partial(hashing_embedding, dim=dim)
+        self.dim = dim
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.exact = exact
+        self._lock = threading.Lock()
+        self._hits = self._misses = self._tokens_saved = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, 'responses.db'), check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        vectors_path = os.path.join(directory, 'vectors.npy')
+        keys_path = os.path.join(directory, 'keys.npy')
+        try:
+            self._vectors = np.lib.format.open_memmap(vectors_path, mode='r+')
+            self._keys = np.lib.format.open_memmap(keys_path, mode='r+')
+            if self._vectors.shape != (capacity, dim) or self._keys.shape != (capacity,):
+                raise ValueError("index shape changed")
+        except (OSError, ValueError):
+            # First start, or a different embedding or capacity: start over.
+            self._vectors = np.lib.format.open_memmap(vectors_path, mode='w+', dtype=np.float32,
+                                                      shape=(capacity, dim))
+            self._keys = np.lib.format.open_memmap(keys_path, mode='w+', dtype=np.int64,
+                                                   shape=(capacity,))
+            self._db.execute("DELETE FROM responses")
+            self._db.execute("DELETE FROM meta")
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'written'").fetchone()
+        # Vectors ever written; slot `written % capacity` is overwritten next.
+        self._written = row[0] if row else 0
+
+    def _entry(self, prompt: str, llm_string: str) -> Optional[Tuple[int, np.ndarray]]:
+        """The key and topics vector of `prompt` in the current scope."""
+        current = _scope.get()
+        if current is None:
+            return None
+        target_account, topics = current
+        # Longest first, so a topic containing another is masked whole.
+        masked = _mask(_prompt_text(prompt), target_account, '{target_account}')
+        for topic in sorted(topics, key=len, reverse=True):
+            masked = _mask(masked, topic, '{topic}')
+        vector = np.asarray(self.embed('\n'.join(sorted(_normalize(topic) for topic in topics))),
+                            dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return _key(llm_string, target_account, masked), vector / norm if norm else vector
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Any]]:
+        if self.exact is not None:
+            cached = self.exact.lookup(prompt, llm_string)
+            if cached is not None:
+                return cached
+        entry = self._entry(prompt, llm_string)
+        if entry is None:
+            return None
+        key, vector = entry
+        with self._lock:
+            filled = min(self._written, self.capacity)
+            row = None
+            if filled:
+                scores = self._vectors[:filled] @ vector
+                scores[self._keys[:filled] != key] = -1.0
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    row = self._db.execute(
+                        "SELECT value, tokens FROM responses WHERE row = ? AND llm_string = ? AND created_at >= ?",
+                        (best, llm_string, time.time() - self.ttl_seconds)).fetchone()
+            if row is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._tokens_saved += row[1]
+        if row is None:
+            LLM_CACHE_LOOKUPS.inc(labels=('miss_semantic',))
+            return None
+        LLM_CACHE_LOOKUPS.inc(labels=('hit_semantic',))
+        LLM_CACHE_TOKENS_SAVED.inc(row[1])
+        return loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]):
+        if self.exact is not None:
+            self.exact.update(prompt, llm_string, return_val)
+        entry = self._entry(prompt, llm_string)
+        if entry is None:
+            return
+        key, vector = entry
+        value = dumps(list(return_val))
+        tokens = estimate_tokens(prompt) + sum(estimate_tokens(generation.text) for generation in return_val)
+        with self._lock:
+            row = self._written % self.capacity
+            try:
+                # Drop the slot's old response before overwriting its vector,
+                # so a crash in between leaves an empty slot, not a wrong one.
+                self._db.execute("DELETE FROM responses WHERE row = ?", (row,))
+                self._vectors[row] = vector
+                self._keys[row] = key
+                self._vectors.flush()
+                self._keys.flush()
+                self._written += 1
+                self._db.execute("INSERT INTO responses (row, llm_string, value, tokens, created_at) "
+                                 "VALUES (?, ?, ?, ?, ?)", (row, llm_string, value, tokens, time.time()))
+                self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('written', ?)",
+                                 (self._written,))
+            except (OSError, sqlite3.Error):
+                logger.exception("Failed to index LLM response")
+
+    def clear(self, **kwargs: Any):
+        if self.exact is not None:
+            self.exact.clear(**kwargs)
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.execute("DELETE FROM meta")
+            self._written = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "tokens_saved": self._tokens_saved,
+                "entries": min(self._written, self.capacity),
+                "threshold": self.threshold,
+            }
+
+
+def _from_env() -> Optional[SemanticCache]:
+    if os.environ.get('CREW_SEMANTIC_CACHE', '0') != '1':
+        return None
+    embedding = os.environ.get('CREW_SEMANTIC_CACHE_EMBEDDING')
+    return SemanticCache(
+        directory=os.environ.get('CREW_SEMANTIC_CACHE_DIR', 'semantic_cache'),
+        embed=load_embedding(embedding) if embedding else None,
+        dim=int(os.environ.get('CREW_SEMANTIC_CACHE_DIM', 256)),
+        threshold=float(os.environ.get('CREW_SEMANTIC_CACHE_THRESHOLD', 0.9)),
+        capacity=int(os.environ.get('CREW_SEMANTIC_CACHE_CAPACITY', 100_000)),
+        ttl_seconds=float(os.environ.get('CREW_LLM_CACHE_TTL_SECONDS', 7 * 86400)),
+        exact=llm_cache)
+
+
+# None unless enabled with CREW_SEMANTIC_CACHE=1.
+semantic_cache = _from_env()
@@ -0,0 +1,48 @@
+"""orjson encoding of job status payloads.
+
+Events never change once appended, so each one is encoded a single time and
+the bytes are kept on the Event; a status body is then little more than a
+join of cached fragments around a small orjson-encoded header.
+"""
+import json
+from datetime import datetime
+from typing import Any, Iterable, Optional
+
+import orjson
+
+
+def dumps(value: Any) -> bytes:
+    try:
+        return orjson.dumps(value)
+    except TypeError:
+        # orjson rejects integers beyond 64 bits and non-str keys, which can
+        # turn up in LLM generated JSON.
+        return json.dumps(value, default=str).encode()
+
+
+def encode_event(event) -> bytes:
+    encoded = event.encoded
+    if encoded is None:
+        # Benign race: concurrent readers may both encode, with equal results.
+        encoded = event.encoded = orjson.dumps(
+            {"seq": event.seq, "timestamp": event.timestamp, "data": event.data})
+    return encoded
+
+
+def encode_events(events: Iterable) -> bytes:
+    return b'[' + b','.join(encode_event(event) for event in events) + b']'
+
+
+def encode_status(job_id: str, job, position: Optional[int]) -> bytes:
+    waited_until = job.started_at or datetime.now()
+    header = orjson.dumps({
+        "job_id": job_id,
+        "status": job.status,
+        "queue_position": position,
+        "queue_wait_seconds": (waited_until - job.created_at).total_seconds(),
+        "version": job.version,
+        "cursor": job.seq,
+    })
+    # The result and events are already encoded, so they are spliced around
+    # the header instead of being serialized again on every poll.
+    return b'{"result":' + job.result_bytes + b',' + header[1:-1] + b',"events":' + encode_events(job.events) + b'}'
@@ -0,0 +1,395 @@
+"""Crew job service shared by the Flask (api.py) and ASGI (api_asgi.py) front ends.
+
+Owns the process-wide executor and job store configuration, runs crews and
+builds status payloads, leaving the web modules to deal only with HTTP.
+"""
+import json
+import math
+import os
+import sys
+import traceback
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from langsmith import traceable
+from pydantic import ValidationError
+
+from budget import TokenBudgetExceeded
+from crew import CREW_CONFIG_VERSION, AccountResearchCrew
+from executor import JobExecutor, QueueFull
+from job_manager import (
+    TERMINAL_STATUSES, Batch, EvictionPolicy, Job, JobCancelled, append_event, create_job, discard_job,
+    finish_job, job_store, normalize_account, parse_result, raise_if_cancelled, request_cancel, start_job)
+import llm
+import metrics
+from models import AccountInfo
+from report_cache import ReportCache
+from compression import compressed_cache, negotiate
+from serialization import dumps, encode_event, encode_status
+from storage import SQLiteBackend
+from timeline import analyze, timelines
+from utils.logging import logger, debug_process_inputs
+
+
+load_dotenv()
+
+# Seconds between SSE comment frames on an idle stream, which keep proxies
+# from closing the connection.
+STREAM_HEARTBEAT_SECONDS = 15
+
+# Long polls (?wait=) park a request each, so both how long one may wait
+# and how many may be parked at once are capped.
+MAX_LONG_POLL_SECONDS = 60
+MAX_LONG_POLLS = int(os.environ.get('CREW_MAX_LONG_POLLS', 64))
+
+# Largest number of accounts accepted in one POST /api/crew/batch.
+MAX_BATCH_SIZE = int(os.environ.get('CREW_MAX_BATCH_SIZE', 500))
+
+# Most jobs returned by one GET /api/crews.
+MAX_LISTED_JOBS = 500
+
+# Finished reports are reused by POST /api/crew with max_age for up to
+# CREW_REPORT_TTL_SECONDS; CREW_REPORT_CACHE_DB also keeps them on disk.
+report_cache = ReportCache(
+    ttl_seconds=float(os.environ.get('CREW_REPORT_TTL_SECONDS', 86400)),
+    max_entries=int(os.environ.get('CREW_REPORT_CACHE_SIZE', 1000)),
+    path=os.environ.get('CREW_REPORT_CACHE_DB') or None)
+
+# CREW_JOB_STORE=sqlite persists jobs and events to CREW_JOB_DB so they
+# survive restarts; the default keeps them in memory only.
+if os.environ.get('CREW_JOB_STORE', 'memory') == 'sqlite':
+    job_store.use_backend(SQLiteBackend(os.environ.get('CREW_JOB_DB', 'jobs.db')))
+
+# Crews run on a fixed pool of workers; submissions beyond the pending queue
+# are rejected with 429 rather than each spawning another thread.
+executor = JobExecutor(
+    max_workers=int(os.environ.get('CREW_MAX_WORKERS', 4)),
+    max_pending=int(os.environ.get('CREW_MAX_PENDING', 32)),
+    max_bulk_pending=int(os.environ.get('CREW_MAX_BULK_PENDING', 1000)),
+    on_start=start_job)
+
+# Finished jobs are evicted after a TTL, or least recently read first once the
+# store holds too many jobs or bytes. Limits of 0 disable that check.
+job_store.start_sweeper(
+    EvictionPolicy(
+        ttl_seconds=float(os.environ.get('CREW_JOB_TTL_SECONDS', 3600)) or None,
+        max_jobs=int(os.environ.get('CREW_MAX_JOBS', 1000)) or None,
+        max_bytes=int(os.environ.get('CREW_MAX_JOB_BYTES', 256 * 1024 * 1024)) or None),
+    interval=float(os.environ.get('CREW_SWEEP_INTERVAL_SECONDS', 30)))
+
+
+metrics.registry.register(metrics.Gauge(
+    'crew_jobs', 'Resident jobs by status.',
+    lambda: {(status,): count for status, count in job_store.count_by_status().items()}, ('status',)))
+metrics.registry.register(metrics.Gauge(
+    'crew_queue_depth', 'Jobs waiting for a worker, by queue.',
+    lambda: {('interactive',): executor.stats()['pending'], ('bulk',): executor.stats()['bulk_pending']},
+    ('queue',)))
+metrics.registry.register(metrics.Gauge(
+    'crew_workers_busy', 'Workers currently running a crew.', lambda: {(): executor.stats()['running']}))
+
+
+def parse_and_validate_result(job_id, results) -> Tuple[Any, bool]:
+    # Parsed once here when the crew finishes; polls reuse the stored form.
+    result_json = parse_result(results)
+    try:
+        AccountInfo.model_validate(result_json)
+    except ValidationError as e:
+        logger.warning(f"Result for job {job_id} does not match AccountInfo: {e}")
+        return result_json, False
+    return result_json, True
+
+
+@traceable(name="kick off crew", process_inputs=debug_process_inputs)
+def kickoff_crew(job_id, target_account: str, topics: list[str], llm_cache: bool = True,
+                 max_tokens_budget: Optional[int] = None):
+    logger.info(f"Running kickoff_crew with job_id={job_id}, target_account={target_account}, topics={topics}")
+
+    results = None
+    account_research_crew = None
+    try:
+        raise_if_cancelled(job_id)
+        account_research_crew = AccountResearchCrew(job_id, llm_cache=llm_cache, max_tokens_budget=max_tokens_budget)
+        account_research_crew.setup_crew(
+            target_account, topics)
+        results = account_research_crew.kickoff()
+        logger.info(f"Crew for job {job_id} is complete", results)
+
+    except JobCancelled:
+        logger.info(f"Crew for job {job_id} was cancelled")
+        saved = {**account_research_crew.work_saved(), "tokens": account_research_crew.token_usage()} \
+            if account_research_crew else {}
+        finish_job(job_id, 'CANCELLED', json.dumps({"cancelled": True, **saved}), "Crew cancelled")
+        return
+
+    except TokenBudgetExceeded as e:
+        # A stopped run has no report, only what its tasks got to, so it
+        # ends in ERROR and never reaches the report cache.
+        logger.info(f"Crew for job {job_id} stopped by its token budget: {e}")
+        stopped = {"error": str(e), "budget_exhausted": True, **account_research_crew.work_saved(),
+                   "partial": account_research_crew.partial_outputs(),
+                   "tokens": account_research_crew.token_usage()}
+        finish_job(job_id, 'ERROR', json.dumps(stopped), f"Stopped: {e}")
+        return
+
+    except Exception as e:
+        logger.error(f"Error in kickoff_crew for job {job_id}: {e}")
+        logger.error(traceback.format_exc())
+        append_event(job_id, f"An error occurred: {e}")
+        finish_job(job_id, 'ERROR', str(e))
+        return
+
+    result_json, valid = parse_and_validate_result(job_id, results)
+    tokens = account_research_crew.token_usage()
+    # Only well-formed reports of the full crew are worth serving again.
+    if valid and not tokens["degradations"]:
+        report_cache.put(coalesce_key(target_account, topics), job_id, str(results), result_json)
+    # A crew that failed ends with a message rather than a report; it goes
+    # under "result" so the token usage is reported either way.
+    result_json = {**result_json, "tokens": tokens} if isinstance(result_json, dict) \
+        else {"result": result_json, "tokens": tokens}
+    results = json.dumps(result_json)
+    estimated = f", {tokens['estimated']} estimated" if tokens['estimated'] is not None else ""
+    finish_job(job_id, 'COMPLETE', results, f"Crew complete ({tokens['actual']} tokens{estimated})", result_json)
+
+
+def coalesce_key(target_account: str, topics: List[str]) -> Hashable:
+    """Requests with equal keys would run identical crews."""
+    return (normalize_account(target_account),
+            tuple(sorted(normalize_account(str(topic)) for topic in topics)),
+            CREW_CONFIG_VERSION)
+
+
+def submit_crew(target_account: str, topics: List[str], coalesce: bool = True,
+                max_age: Optional[float] = None, llm_cache: bool = True,
+                max_tokens_budget: Optional[int] = None) -> str:
+    """Queue a crew run and return its job id; raises QueueFull when saturated.
+
+    With `max_age`, a cached report at most that many seconds old is returned
+    as an already COMPLETE job. While an identical crew is still queued or
+    running, the request gets an alias id that mirrors that job's events and
+    result instead of a new crew.
+
+    Without `llm_cache` the crew calls the LLM for every prompt, and with
+    `max_tokens_budget` it may run a reduced crew; either way it is never
+    coalesced onto, nor shared with, other runs.
+    """
+    job_id = str(uuid4())
+    key = coalesce_key(target_account, topics)
+    if max_age is not None:
+        report = report_cache.get(key, max_age)
+        if report is not None:
+            create_job(job_id, target_account, topics)
+            finish_job(job_id, 'COMPLETE', report.result,
+                       f"Served cached report from job {report.job_id} ({report.age:.0f}s old)",
+                       report.result_json)
+            return job_id
+    shareable = llm_cache and max_tokens_budget is None
+    if coalesce and shareable:
+        primary_id = job_store.attach(job_id, key)
+        if primary_id is not None:
+            logger.info(f"Coalesced job {job_id} onto running job {primary_id}")
+            return job_id
+    create_job(job_id, target_account, topics)
+    try:
+        executor.submit(job_id, kickoff_crew, job_id, target_account, topics, llm_cache, max_tokens_budget)
+    except QueueFull:
+        discard_job(job_id)
+        raise
+    if shareable:
+        job_store.register(job_id, key)
+    return job_id
+
+
+def validate_crew(data: Any) -> bool:
+    """Whether `data` is a well-formed crew request: a target account and a
+    list of topics, all strings."""
+    return isinstance(data, dict) and isinstance(data.get('target_account'), str) \
+        and isinstance(data.get('topics'), list) and all(isinstance(topic, str) for topic in data['topics'])
+
+
+def crew_options(data: dict, max_age: Any = None) -> Tuple[Optional[float], Optional[int]]:
+    """`max_age` and `max_tokens_budget` of a crew request, taking `max_age`
+    from the body before the query string value passed in. Raises ValueError
+    with a message for the client when either is malformed."""
+    max_age = data.get('max_age', max_age)
+    if max_age is not None:
+        try:
+            max_age = float(max_age)
+        except (TypeError, ValueError):
+            max_age = math.nan
+        if math.isnan(max_age) or max_age < 0:
+            raise ValueError("max_age must be a non-negative number of seconds.")
+    max_tokens_budget = data.get('max_tokens_budget')
+    if max_tokens_budget is not None and (type(max_tokens_budget) is not int or max_tokens_budget <= 0):
+        raise ValueError("max_tokens_budget must be a positive integer.")
+    return max_age, max_tokens_budget
+
+
+def validate_batch(data: Any) -> Optional[List[dict]]:
+    """The batch items if `data` is a well-formed batch request, else None."""
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_SIZE:
+        return None
+    if not all(validate_crew(item) for item in items):
+        return None
+    return items
+
+
+def submit_batch(items: List[dict]) -> Tuple[str, List[str]]:
+    """Queue one crew per item on the executor's bulk queue, all or none.
+    Items identical to a running crew or an earlier item become aliases.
+
+    Raises QueueFull when the bulk queue cannot take the whole batch.
+    """
+    batch_id = str(uuid4())
+    job_ids = [str(uuid4()) for _ in items]
+    keys = [coalesce_key(item['target_account'], item['topics']) for item in items]
+    # Items matching a running crew, or an earlier item of this batch, attach
+    # to it; only the rest are queued.
+    aliases: List[str] = []
+    duplicates: List[Tuple[str, Hashable]] = []
+    new: Dict[Hashable, Tuple[str, dict]] = {}
+    for job_id, key, item in zip(job_ids, keys, items):
+        if key in new:
+            duplicates.append((job_id, key))
+        elif job_store.attach(job_id, key) is not None:
+            aliases.append(job_id)
+        else:
+            new[key] = (job_id, item)
+            create_job(job_id, item['target_account'], item['topics'])
+    try:
+        executor.submit_bulk([
+            (job_id, kickoff_crew, (job_id, item['target_account'], item['topics']))
+            for job_id, item in new.values()
+        ])
+    except QueueFull:
+        for job_id, _ in new.values():
+            discard_job(job_id)
+        for job_id in aliases:
+            job_store.drop_alias(job_id)
+        raise
+    for key, (job_id, _) in new.items():
+        job_store.register(job_id, key)
+    for alias_id, key in duplicates:
+        job_store.add_alias(alias_id, new[key][0])
+    job_store.add_batch(batch_id, Batch(job_ids=job_ids,
+                                        target_accounts=[item['target_account'] for item in items]))
+    logger.info(f"Queued batch {batch_id} with {len(job_ids)} jobs")
+    return batch_id, job_ids
+
+
+def batch_status(batch_id: str) -> Optional[Dict[str, Any]]:
+    batch = job_store.get_batch(batch_id)
+    if batch is None:
+        return None
+    jobs = [
+        {"job_id": job_id, "target_account": account, "status": job_store.status(job_id)}
+        for job_id, account in zip(batch.job_ids, batch.target_accounts)
+    ]
+    counts = Counter(job["status"] for job in jobs)
+    finished = sum(counts[status] for status in (*TERMINAL_STATUSES, 'EXPIRED'))
+    return {
+        "batch_id": batch_id,
+        "created_at": batch.created_at.isoformat(),
+        "total": len(jobs),
+        "finished": finished,
+        "progress": finished / len(jobs) if jobs else 1.0,
+        "complete": finished == len(jobs),
+        "counts": dict(counts),
+        "jobs": jobs,
+    }
+
+
+def list_jobs(ids: Optional[List[str]] = None, status: Optional[str] = None,
+              target_account: Optional[str] = None, limit: int = 100) -> bytes:
+    """Encoded summaries of the given jobs, or of the jobs matching the
+    status and account filters, newest first."""
+    limit = max(1, min(limit, MAX_LISTED_JOBS))
+    if ids:
+        summaries = job_store.summaries(ids[:MAX_LISTED_JOBS])
+    else:
+        summaries = job_store.summaries(job_store.find(status, target_account, limit))
+        # Jobs evicted since they were found no longer match the filters.
+        summaries = [summary for summary in summaries if "created_at" in summary]
+    return dumps({"count": len(summaries), "jobs": summaries})
+
+
+def job_timeline(job_id: str) -> Optional[Dict[str, Any]]:
+    """Task, LLM and tool spans of a job with its critical path, None if the
+    job is unknown. Span times are seconds since the job started."""
+    job = job_store.get(job_id, sys.maxsize)
+    if job is None:
+        return None
+    origin = (job.started_at or job.created_at).timestamp()
+    finished = job.finished_at.timestamp() if job.finished_at else None
+    return {
+        "job_id": job_id,
+        "status": job.status,
+        "queue_wait_seconds": round(origin - job.created_at.timestamp(), 3),
+        "run_seconds": round((finished or datetime.now().timestamp()) - origin, 3),
+        **analyze(timelines.spans(job_store.resolve(job_id)), origin),
+    }
+
+
+def cancel_crew(job_id: str) -> Optional[str]:
+    """Cancel a job and return its resulting status, None if it is unknown."""
+    status = request_cancel(job_id)
+    if status is None or status in TERMINAL_STATUSES:
+        return status
+    # A job still waiting for a worker never started, so it is cancelled
+    # outright; a running crew stops at its next checkpoint. Any other
+    # status is a crew that coalesced requests still wait on.
+    if status == 'CANCELLING' and executor.cancel(job_id):
+        finish_job(job_id, 'CANCELLED', json.dumps({"cancelled": True, "tasks_completed": 0}), "Crew cancelled")
+        return 'CANCELLED'
+    return status
+
+
+def queue_position(job_id: str, status: str) -> Optional[int]:
+    return executor.position(job_store.resolve(job_id)) if status == 'QUEUED' else None
+
+
+def status_etag(version, status, since, position) -> str:
+    # Weak because queue_wait_seconds keeps ticking while a job is queued.
+    return f"{version}.{status}.{since}.{position}"
+
+
+def status_body(job_id: str, job: Job, since: int, position: Optional[int],
+                accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """The encoded status payload and its Content-Encoding, if compressed."""
+    # A finished job's payload is fixed for a given version and cursor.
+    cache_key = (job_id, job.version, since) if job.status in TERMINAL_STATUSES else None
+    return negotiate(lambda: encode_status(job_id, job, position), accept_encoding, cache_key)
+
+
+def stream_frames(job_id: str, job: Job) -> Tuple[List[str], bool]:
+    """SSE frames for the events in `job`, and whether the stream is done."""
+    frames = [
+        f"id: {event.seq}\nevent: event\ndata: {encode_event(event).decode()}\n\n"
+        for event in job.events
+    ]
+    if job.status in TERMINAL_STATUSES:
+        done = {"job_id": job_id, "status": job.status, "result": job.result_json}
+        frames.append(f"event: done\ndata: {dumps(done).decode()}\n\n")
+        return frames, True
+    if not frames:
+        frames.append(": heartbeat\n\n")
+    return frames, False
+
+
+def render_metrics() -> str:
+    return metrics.registry.render()
+
+
+def stats() -> dict:
+    return {
+        "jobs": job_store.stats(),
+        "executor": executor.stats(),
+        "report_cache": report_cache.stats(),
+        "compressed_cache": compressed_cache.stats(),
+        "llm": llm.stats(),
+    }
@@ -0,0 +1,253 @@
+import json
+import queue
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import List, Optional, Tuple
+from job_manager import TERMINAL_STATUSES, Event, Job, normalize_account
+from utils.logging import logger
+
+
+class JobBackend(ABC):
+    """Durable storage behind the in-memory JobStore.
+
+    The store calls the `record_*` hooks while holding the job's shard lock,
+    so they must not block; `load_job` and `find_jobs` serve reads for jobs
+    that are no longer resident in memory, e.g. after a restart or eviction.
+    """
+
+    @abstractmethod
+    def record_job(self, job_id: str, job: Job):
+        ...
+
+    @abstractmethod
+    def record_event(self, job_id: str, event: Event):
+        ...
+
+    @abstractmethod
+    def delete_job(self, job_id: str):
+        ...
+
+    @abstractmethod
+    def delete_finished_before(self, cutoff: datetime):
+        """Delete every job that finished before `cutoff`, resident or not."""
+
+    @abstractmethod
+    def load_job(self, job_id: str, since: int = 0) -> Optional[Job]:
+        ...
+
+    @abstractmethod
+    def find_jobs(self, status: Optional[str], target_account: Optional[str],
+                  limit: Optional[int]) -> List[Tuple[datetime, str]]:
+        """Creation time and id of stored jobs matching every given filter,
+        newest first and at most `limit` of them."""
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    result TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    version INTEGER NOT NULL DEFAULT 0,
+    target_account TEXT,
+    account_key TEXT,
+    topics TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    data TEXT,
+    PRIMARY KEY (job_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+"""
+
+# Added to the jobs table after its first release; databases created before
+# then get them on open. `account_key` is the normalized target account.
+_ADDED_COLUMNS = (
+    ("version", "INTEGER NOT NULL DEFAULT 0"),
+    ("target_account", "TEXT"),
+    ("account_key", "TEXT"),
+    ("topics", "TEXT"),
+)
+
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_account ON jobs (account_key, created_at);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+"""
+
+_UPSERT_JOB = """
+INSERT INTO jobs (job_id, status, result, created_at, started_at, finished_at, version,
+                  target_account, account_key, topics)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (job_id) DO UPDATE SET
+    status = excluded.status, result = excluded.result,
+    started_at = excluded.started_at, finished_at = excluded.finished_at,
+    version = excluded.version
+"""
+
+_INSERT_EVENT = "INSERT OR REPLACE INTO events (job_id, seq, timestamp, data) VALUES (?, ?, ?, ?)"
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _parse(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+class SQLiteBackend(JobBackend):
+    """SQLite in WAL mode with writes group-committed on a background thread.
+
+    Crew callbacks only enqueue rows; the writer drains whatever has piled up
+    into one transaction, so a burst of events costs one commit rather than
+    one per event and callers never wait on the disk.
+    """
+
+    def __init__(self, path: str, max_batch: int = 1000):
+        self.path = path
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Tuple]" = queue.Queue()
+        self._local = threading.local()
+
+        conn = self._connect()
+        conn.executescript(_SCHEMA)
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in _ADDED_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        conn.executescript(_INDEXES)
+        # Whatever was running when the process stopped will never finish.
+        interrupted = conn.execute(
+            f"UPDATE jobs SET status = 'ERROR', result = 'Interrupted by server restart', finished_at = ?, "
+            f"version = version + 1 "
+            f"WHERE status NOT IN ({', '.join('?' for _ in TERMINAL_STATUSES)})",
+            (datetime.now().isoformat(), *TERMINAL_STATUSES)).rowcount
+        conn.commit()
+        if interrupted:
+            logger.info("Marked %d interrupted jobs as ERROR in %s", interrupted, path)
+
+        self._writer = threading.Thread(target=self._write_loop, name="job-db-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL with NORMAL only syncs at checkpoints, still crash safe.
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record_job(self, job_id: str, job: Job):
+        self._queue.put((_UPSERT_JOB, (
+            job_id, job.status, None if job.result is None else str(job.result),
+            _isoformat(job.created_at), _isoformat(job.started_at), _isoformat(job.finished_at), job.version,
+            job.target_account,
+            normalize_account(job.target_account) if job.target_account is not None else None,
+            json.dumps(job.topics) if job.topics is not None else None)))
+
+    def record_event(self, job_id: str, event: Event):
+        self._queue.put((_INSERT_EVENT, (job_id, event.seq, event.timestamp.isoformat(), event.data)))
+
+    def delete_job(self, job_id: str):
+        self._queue.put(("DELETE FROM events WHERE job_id = ?", (job_id,)))
+        self._queue.put(("DELETE FROM jobs WHERE job_id = ?", (job_id,)))
+
+    def delete_finished_before(self, cutoff: datetime):
+        # ISO timestamps from one clock sort as strings.
+        self._queue.put(("DELETE FROM events WHERE job_id IN "
+                         "(SELECT job_id FROM jobs WHERE finished_at < ?)", (cutoff.isoformat(),)))
+        self._queue.put(("DELETE FROM jobs WHERE finished_at < ?", (cutoff.isoformat(),)))
+
+    def load_job(self, job_id: str, since: int = 0) -> Optional[Job]:
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT status, result, created_at, started_at, finished_at, version, target_account, topics, "
+            "(SELECT COALESCE(MAX(seq), 0) FROM events WHERE events.job_id = jobs.job_id) "
+            "FROM jobs WHERE job_id = ?",
+            (job_id,)).fetchone()
+        if row is None:
+            return None
+        events = [
+            Event(timestamp=datetime.fromisoformat(timestamp), data=data, seq=seq)
+            for seq, timestamp, data in conn.execute(
+                "SELECT seq, timestamp, data FROM events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, since))
+        ]
+        status, result, created_at, started_at, finished_at, version, target_account, topics, seq = row
+        job = Job(status=status, events=events, result=None, seq=seq, version=version,
+                  target_account=target_account, topics=json.loads(topics) if topics is not None else None,
+                  created_at=datetime.fromisoformat(created_at),
+                  started_at=_parse(started_at), finished_at=_parse(finished_at))
+        job.set_result(result)
+        return job
+
+    def find_jobs(self, status: Optional[str], target_account: Optional[str],
+                  limit: Optional[int]) -> List[Tuple[datetime, str]]:
+        filters, params = [], []
+        if status is not None:
+            filters.append("status = ?")
+            params.append(status)
+        if target_account is not None:
+            filters.append("account_key = ?")
+            params.append(normalize_account(target_account))
+        where = f"WHERE {' AND '.join(filters)} " if filters else ""
+        rows = self._connect().execute(
+            f"SELECT created_at, job_id FROM jobs {where}ORDER BY created_at DESC LIMIT ?",
+            (*params, -1 if limit is None else limit))
+        return [(datetime.fromisoformat(created_at), job_id) for created_at, job_id in rows]
+
+    def flush(self):
+        """Block until everything enqueued so far has been committed."""
+        done = threading.Event()
+        self._queue.put((None, done))
+        done.wait()
+
+    def close(self):
+        self.flush()
+        self._queue.put((None, None))
+        self._writer.join()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch: List[Tuple] = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            waiters = []
+            stop = False
+            try:
+                with conn:
+                    for sql, params in batch:
+                        if sql is not None:
+                            conn.execute(sql, params)
+                        elif params is None:
+                            stop = True
+                        else:
+                            waiters.append(params)
+            except sqlite3.Error:
+                logger.exception("Failed to commit %d job store writes", len(batch))
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                conn.close()
+                return
@@ -1,25 +1,135 @@
+import time
+from typing import Any, Dict, List, Optional
 from crewai import Task, Agent
+from crewai.tasks.task_output import TaskOutput
 from textwrap import dedent
-from job_manager import append_event
+from langchain_core.callbacks import BaseCallbackHandler
+from budget import TokenBudgetExceeded
+from job_manager import JobCancelled, append_event, raise_if_cancelled
+from llm import task_callbacks
+from metrics import TASK_DURATION
+from timeline import timelines
 from models import SubTopic, TopicInfo, AccountInfo
+from semantic_cache import scope as cache_scope
 from utils.logging import logger, debug_process_inputs
 from langsmith import wrappers, traceable
 
 
 
+class CancellationCheck(BaseCallbackHandler):
+    """Stops a cancelled job before its next LLM call.
+
+    Agents working on a delegated task run inside the delegating agent's
+    tool call, where crewai turns exceptions into an observation; the next
+    LLM call of the delegating agent then stops it.
+    """
+    # Let JobCancelled out of LangChain's callback manager.
+    raise_error = True
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, **kwargs: Any):
+        raise_if_cancelled(self.job_id)
+
+
+class TimedTask(Task):
+    """A Task that records how long it ran under its `task_type`, and a span
+    on its job's timeline that parents the LLM and tool calls it makes. Each
+    of those LLM calls first checks whether the job has been cancelled.
+
+    With a `budget` (a budget.TokenBudget) its context is truncated, or the
+    task skipped, when the job's remaining tokens call for it; a skipped
+    task reports through `skip_callback` rather than `callback`. The budget
+    also sees each of its LLM calls.
+
+    An async task stopped by the budget or by cancellation is recorded as
+    skipped: crewai runs it on a thread it only joins, so the exception
+    would otherwise be lost along with any trace of the task. The next
+    synchronous task stops the crew in its place.
+
+    Its LLM calls only match semantically cached prompts for the same
+    `target_account` and similar topics; `topics` is set for tasks covering
+    several.
+    """
+    task_type: str = "task"
+    job_id: Optional[str] = None
+    target_account: Optional[str] = None
+    topic: Optional[str] = None
+    topics: Optional[List[str]] = None
+    budget: Optional[Any] = None
+    skip_callback: Optional[Any] = None
+
+    def _execute(self, agent, task, context, tools):
+        # Runs on the task's own thread for async tasks, so this measures the
+        # task itself rather than time spent waiting on other tasks.
+        name = f"{self.task_type}: {self.topic}" if self.topic else self.task_type
+        start = time.perf_counter()
+        try:
+            # The budget goes last: a call the cancellation check stops
+            # never reserves tokens.
+            handlers = [CancellationCheck(self.job_id), *([self.budget] if self.budget is not None else [])]
+            with timelines.task(self.job_id, name, task_type=self.task_type,
+                                async_execution=bool(self.async_execution)), \
+                    task_callbacks(handlers), \
+                    cache_scope(self.target_account or '',
+                                self.topics if self.topics is not None else [self.topic or '']):
+                if self.budget is not None:
+                    try:
+                        context = self.budget.start_task(self, context)
+                    except TokenBudgetExceeded as e:
+                        return self._skip(str(e))
+                return super()._execute(agent, task, context, tools)
+        except (TokenBudgetExceeded, JobCancelled) as e:
+            if not self.async_execution:
+                raise
+            if self.output is not None:
+                # Raised by the callback once the task had finished.
+                return self.output.exported_output
+            # The callbacks of a cancelled job would only raise again.
+            return self._skip(f"{name} stopped: {e}", notify=isinstance(e, TokenBudgetExceeded))
+        finally:
+            TASK_DURATION.observe(time.perf_counter() - start, (self.task_type,))
+
+    def _skip(self, reason: str, notify: bool = True) -> str:
+        # Stands in for the output, so later tasks and the event stream see
+        # why there is none.
+        self.output = TaskOutput(description=self.description, exported_output=reason, raw_output=reason)
+        callback = self.skip_callback or self.callback
+        if callback and notify:
+            callback(self.output)
+        return reason
+
+
 @traceable
 class AccountResearchTasks():
-    def __init__(self, job_id: str):
+    def __init__(self, job_id: str, budget: Optional[Any] = None):
         self.job_id = job_id
+        self.budget = budget
+        self.completed = 0
+        self.skipped = 0
 
     def append_event_callback(self, task_output):
         logger.info("Callback called: %s", task_output)
         append_event(self.job_id, task_output.exported_output)
+        self.completed += 1
+        raise_if_cancelled(self.job_id)
+
+    def skip_event_callback(self, task_output):
+        # A skipped task made no calls to cut short, so unlike
+        # append_event_callback this leaves cancellation to the next one.
+        append_event(self.job_id, task_output.exported_output)
+        self.skipped += 1
         
         
     # @traceable(name="review research", run_type="prompt", process_inputs=debug_process_inputs)    
     def write_report(self, agent: Agent, target_account: str, topics: list[str], tasks: list[Task]):
-        return Task(            
+        return TimedTask(            
+            task_type='write_report',
+            job_id=self.job_id,
+            target_account=target_account,
+            topics=topics,
+            budget=self.budget,
             agent=agent,
             description=dedent(f"""
                 Create a comprehensive and structured report that integrates all collected information on {target_account} with findings 
@@ -46,7 +156,12 @@ class AccountResearchTasks():
     
     # @traceable(name="review research", run_type="prompt", process_inputs=debug_process_inputs)    
     def manage_research(self, agent: Agent, target_account: str, topic: str, tasks: list[Task]):
-        return Task(            
+        return TimedTask(            
+            task_type='manage_research',
+            job_id=self.job_id,
+            target_account=target_account,
+            budget=self.budget,
+            topic=topic,
             description=dedent(f"""
                 For the {target_account}, establish research objectives for each {topic}, and oversee the integration of account and strategy 
                 research, ensuring operational data and strategic insights are seamlessly combined. Monitor all subtopic data collection to align 
@@ -79,7 +194,12 @@ class AccountResearchTasks():
 
     # @traceable(name="research strategy", run_type="retriever", process_inputs=debug_process_inputs)    
     def research_strategy(self, agent: Agent, target_account: str, topic: str, tasks: list[Task]):
-        return Task(
+        return TimedTask(
+            task_type='research_strategy',
+            job_id=self.job_id,
+            target_account=target_account,
+            budget=self.budget,
+            topic=topic,
             description=dedent(f"""
                 Research and compile strategic initiatives relevant to {target_account}'s using authoritative sources.
         
@@ -98,6 +218,7 @@ class AccountResearchTasks():
                 A detailed compilation of `SubTopic` models summarizing detailing AI/ML strategies within the {target_account}'s industry, each enriched 
                 with strategically gathered information from primary sources."""),
             callback=self.append_event_callback,
+            skip_callback=self.skip_event_callback,
             context=tasks,
             output_json=SubTopic,
             async_execution=True
@@ -105,7 +226,12 @@ class AccountResearchTasks():
 
     # @traceable(name="research account", run_type="retriever", process_inputs=debug_process_inputs)    
     def research_account(self, agent: Agent, target_account: str, topic: str):
-        return Task(
+        return TimedTask(
+            task_type='research_account',
+            job_id=self.job_id,
+            target_account=target_account,
+            budget=self.budget,
+            topic=topic,
             description=dedent(f"""
                 Conduct thorough research to gather detailed operational information for {target_account} for each {topic} following 
                 direction from the research manager. Ensure the process focuses on the most authoritative sources to support insightful analysis.
@@ -123,6 +249,7 @@ class AccountResearchTasks():
                 A detailed compilation of `SubTopic` models summarizing key operational data about {target_account}, each enriched 
                 with strategically gathered information from primary sources. ."""),
             callback=self.append_event_callback,
+            skip_callback=self.skip_event_callback,
             output_json=SubTopic,
             async_execution=True
         )
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# Modules import each other by flat name from the package directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the caches in memory and the services offline; modules read these
+# when first imported.
+os.environ.setdefault('CREW_LLM_CACHE_DB', '')
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('LANGCHAIN_TRACING_V2', 'false')
+os.environ.setdefault('OTEL_SDK_DISABLED', 'true')
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    """Real crews on the benchmark fakes, with negligible latency."""
+    import llm
+    from benchmarks import fakes
+    from tools import exa_search_tool
+
+    monkeypatch.setattr(llm, 'ChatOpenAI', fakes.FakeChatOpenAI)
+    monkeypatch.setattr(llm, '_llms', {})
+    monkeypatch.setattr(exa_search_tool, 'Exa', fakes.FakeExa)
+    monkeypatch.setattr(fakes, 'settings', fakes.FakeSettings(llm_latency_ms=0, exa_latency_ms=0,
+                                                              llm_output_bytes=500, exa_output_bytes=200))
+    return fakes
+
@@ -0,0 +1,120 @@
+import gzip
+import json
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+import api_asgi
+import compression
+import service
+from job_manager import Batch, append_event, create_job, job_store
+from report_cache import ReportCache
+
+
+@pytest.fixture(params=['flask', 'asgi'])
+def client(request):
+    if request.param == 'flask':
+        return api.app.test_client()
+    return TestClient(api_asgi.app)
+
+
+def body(response):
+    # Flask's test response has `json` as a property, httpx's as a method.
+    return response.json() if callable(response.json) else response.json
+
+
+def _job():
+    job_id = str(uuid.uuid4())
+    create_job(job_id, 'Acme', ['supply chain'])
+    return job_id
+
+
+def test_long_poll_with_since_waits_for_events(client):
+    job_id = _job()
+    threading.Timer(0.2, append_event, args=(job_id, 'found something')).start()
+    start = time.monotonic()
+    response = client.get(f'/api/crew/{job_id}?wait=5&since=0')
+    assert response.status_code == 200
+    assert 0.1 < time.monotonic() - start < 4
+    assert [event['data'] for event in body(response)['events']] == ['found something']
+
+
+def test_long_poll_with_since_returns_pending_events_at_once(client):
+    job_id = _job()
+    append_event(job_id, 'first')
+    start = time.monotonic()
+    response = client.get(f'/api/crew/{job_id}?wait=5&since=0')
+    assert time.monotonic() - start < 1
+    assert body(response)['cursor'] == 1
+
+
+@pytest.mark.parametrize('data', [
+    {"target_account": 42, "topics": ["supply chain"]},
+    {"target_account": "Acme", "topics": "supply chain"},
+    {"target_account": "Acme", "topics": ["supply chain", {"name": "cloud"}]},
+    ["Acme", ["supply chain"]],
+])
+def test_malformed_crew_request_is_rejected(client, data):
+    assert client.post('/api/crew', json=data).status_code == 400
+    assert client.post('/api/crew/batch', json=[data]).status_code == 400
+
+
+@pytest.mark.parametrize('query, extra', [
+    ('?max_age=nan', {}),
+    ('?max_age=-1', {}),
+    ('?max_age=soon', {}),
+    ('', {"max_age": "NaN"}),
+    ('', {"max_tokens_budget": 0}),
+    ('', {"max_tokens_budget": 1.5}),
+])
+def test_malformed_crew_options_are_rejected(client, query, extra):
+    data = {"target_account": "Acme", "topics": ["supply chain"], **extra}
+    assert client.post(f'/api/crew{query}', json=data).status_code == 400
+
+
+def test_recent_cached_report_is_served_as_a_finished_job(client, monkeypatch):
+    monkeypatch.setattr(service, 'report_cache', ReportCache())
+    account = f"Acme {uuid.uuid4()}"
+    service.report_cache.put(service.coalesce_key(account, ['supply chain']), 'earlier-job',
+                             '{"account_name": "Acme"}', {"account_name": "Acme"})
+    response = client.post('/api/crew?max_age=60', json={"target_account": account, "topics": ['supply chain']})
+    job = job_store.get(body(response)["job_id"])
+    assert job.status == 'COMPLETE' and job.result_json == {"account_name": "Acme"}
+    assert "earlier-job" in job.events[-1].data
+
+
+def test_cancel_requests_cancellation_of_unfinished_job(client):
+    job_id = _job()
+    response = client.delete(f'/api/crew/{job_id}')
+    assert response.status_code == 202
+    assert body(response) == {"job_id": job_id, "status": 'CANCELLING'}
+    assert client.delete('/api/crew/no-such-job').status_code == 404
+
+
+def test_timeline_and_batch_status_are_compressed(client, monkeypatch):
+    monkeypatch.setattr(compression, 'MIN_COMPRESS_BYTES', 0)
+    job_id = _job()
+    response = client.get(f'/api/crew/{job_id}/timeline', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    # httpx decodes the body itself; Flask's test client does not.
+    content = response.content if hasattr(response, 'content') else gzip.decompress(response.data)
+    assert json.loads(content)['job_id'] == job_id
+
+    batch_id = str(uuid.uuid4())
+    job_store.add_batch(batch_id, Batch(job_ids=[job_id], target_accounts=['Acme']))
+    response = client.get(f'/api/crew/batch/{batch_id}', headers={'Accept-Encoding': 'br;q=0, gzip;q=0, *'})
+    assert 'Content-Encoding' not in response.headers
+    assert body(response)['jobs'][0]['job_id'] == job_id
+
+
+def test_listing_skips_jobs_evicted_after_they_were_found(client, monkeypatch):
+    job_id = _job()
+    gone = str(uuid.uuid4())
+    monkeypatch.setattr(job_store, 'find', lambda status, target_account, limit: [gone, job_id])
+    response = client.get('/api/crews?target_account=Acme')
+    assert response.status_code == 200
+    assert [job["job_id"] for job in body(response)["jobs"]] == [job_id]
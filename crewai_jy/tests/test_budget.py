@@ -0,0 +1,164 @@
+import json
+import threading
+import uuid
+
+import httpx
+import pytest
+import tiktoken
+from crewai import Agent
+from langchain_core.messages import HumanMessage
+from langchain_core.outputs import LLMResult
+
+from benchmarks.fakes import FakeChatOpenAI
+from budget import CompletionCapTransport, TokenBudget, TokenBudgetExceeded, completion_cap
+from job_manager import create_job, get_job
+from service import kickoff_crew
+from tasks import AccountResearchTasks
+import budget
+import service
+import tokens
+from tokens import EXPECTED_COMPLETION_TOKENS, count_tokens
+
+MESSAGES = [[HumanMessage(content="hello")]]
+
+
+PROMPT = count_tokens("hello") + 3
+
+
+@pytest.fixture(autouse=True)
+def _reset_completion_cap():
+    # Calls left in flight would otherwise cap requests of later tests.
+    token = completion_cap.set(None)
+    yield
+    completion_cap.reset(token)
+
+
+def _start(budget, run_id=None, **kwargs):
+    budget.on_chat_model_start({}, MESSAGES, run_id=run_id or uuid.uuid4(), **kwargs)
+
+
+def _usage(tokens):
+    return LLMResult(generations=[], llm_output={"token_usage": {"total_tokens": tokens}})
+
+
+def test_concurrent_calls_reserve_tokens_until_they_end():
+    budget = TokenBudget(2 * (PROMPT + EXPECTED_COMPLETION_TOKENS) + 10)
+    barrier = threading.Barrier(8)
+    admitted, refused = [], []
+
+    def call():
+        run_id = uuid.uuid4()
+        barrier.wait()
+        try:
+            _start(budget, run_id)
+            admitted.append(run_id)
+        except TokenBudgetExceeded:
+            refused.append(run_id)
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(admitted) == 2 and len(refused) == 6
+
+    budget.on_llm_end(_usage(100), run_id=admitted[0])
+    budget.on_llm_end(_usage(100), run_id=admitted[1])
+    assert budget.report()["actual"] == 200
+    _start(budget)
+
+
+def test_failed_call_releases_its_reservation():
+    budget = TokenBudget(PROMPT + EXPECTED_COMPLETION_TOKENS)
+    run_id = uuid.uuid4()
+    _start(budget, run_id)
+    with pytest.raises(TokenBudgetExceeded):
+        _start(budget)
+    budget.on_llm_error(RuntimeError("timeout"), run_id=run_id)
+    _start(budget)
+
+
+def test_admitted_call_is_capped_at_what_remains():
+    budget = TokenBudget(PROMPT + 2000)
+    budget.on_llm_end(_usage(500), run_id=uuid.uuid4())
+    _start(budget, invocation_params={"max_tokens": 1000})
+    assert completion_cap.get() == 1500
+    budget.on_llm_end(_usage(0), run_id=uuid.uuid4())
+    assert completion_cap.get() is None
+
+
+@pytest.mark.parametrize('requested, sent', [(None, 300), (1000, 300), (100, 100)])
+def test_transport_lowers_max_tokens_to_the_cap(requested, sent):
+    bodies = []
+
+    def handler(request):
+        bodies.append(json.loads(request.content))
+        return httpx.Response(200, json={})
+
+    client = httpx.Client(transport=CompletionCapTransport(httpx.MockTransport(handler)))
+    body = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "hi"}]}
+    if requested is not None:
+        body["max_tokens"] = requested
+    token = completion_cap.set(300)
+    try:
+        client.post("https://api.openai.com/v1/chat/completions", json=body)
+    finally:
+        completion_cap.reset(token)
+    assert bodies[0]["max_tokens"] == sent
+
+
+def test_task_skipped_over_budget_is_not_counted_as_completed(fakes):
+    tasks = AccountResearchTasks(str(uuid.uuid4()))
+    agent = Agent(role="Strategy Researcher", goal="Research", backstory="Researches", llm=FakeChatOpenAI())
+    task = tasks.research_strategy(agent, 'Acme', 'supply chain', [])
+    task._skip("research_strategy skipped to stay within the token budget")
+    assert tasks.completed == 0 and tasks.skipped == 1
+
+
+def test_async_task_stopped_by_the_budget_is_recorded_as_skipped(fakes):
+    tasks = AccountResearchTasks(str(uuid.uuid4()), budget=TokenBudget(10))
+    agent = Agent(role="Account Researcher", goal="Research", backstory="Researches", llm=FakeChatOpenAI())
+    task = tasks.research_account(agent, 'Acme', 'supply chain')
+    task.execute()
+    task.thread.join()
+    assert "exhausted" in task.output.raw_output
+    assert tasks.completed == 0 and tasks.skipped == 1
+
+
+def test_run_stopped_by_the_budget_ends_in_error_with_its_tokens(fakes, monkeypatch):
+    puts = []
+    monkeypatch.setattr(service.report_cache, 'put', lambda *args: puts.append(args))
+    job_id = str(uuid.uuid4())
+    create_job(job_id, 'Acme', ['supply chain'])
+    kickoff_crew(job_id, 'Acme', ['supply chain'], llm_cache=False, max_tokens_budget=1000)
+    job = get_job(job_id)
+    assert job.status == 'ERROR' and not puts
+    assert job.result_json["budget_exhausted"] and "exhausted" in job.result_json["error"]
+    assert job.result_json["tokens"]["budget"] == 1000
+    assert "stopped an LLM call that would exceed the budget" in job.result_json["tokens"]["degradations"]
+
+
+def test_crew_without_a_budget_is_not_estimated(fakes, monkeypatch):
+    def estimate_task(task, context_tokens):
+        raise AssertionError("estimated without a budget")
+
+    monkeypatch.setattr(budget, 'estimate_task', estimate_task)
+    job_id = str(uuid.uuid4())
+    create_job(job_id, 'Acme', ['supply chain'])
+    kickoff_crew(job_id, 'Acme', ['supply chain'], llm_cache=False)
+    job = get_job(job_id)
+    assert job.status == 'COMPLETE'
+    assert job.result_json["tokens"]["estimated"] is None
+
+
+def test_tokens_are_approximated_without_tiktoken_encodings(monkeypatch):
+    def unavailable(name):
+        raise ConnectionError("no network")
+
+    monkeypatch.setattr(tiktoken, 'get_encoding', unavailable)
+    tokens.encoding.cache_clear()
+    try:
+        assert count_tokens("a" * 40, model='not-a-model') == 10
+        assert tokens.truncate("abcdefgh", 1, model='not-a-model') == "abcd"
+    finally:
+        tokens.encoding.cache_clear()
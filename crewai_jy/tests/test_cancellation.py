@@ -0,0 +1,73 @@
+import uuid
+
+import pytest
+
+from benchmarks.fakes import FakeChatOpenAI
+from crew import AccountResearchCrew
+from job_manager import JobCancelled, create_job, request_cancel, start_job
+from tasks import CancellationCheck
+from tools.exa_search_tool import CANCELLED, ExaSearchToolset
+
+
+def _started_job():
+    job_id = str(uuid.uuid4())
+    create_job(job_id, 'Acme', ['supply chain'])
+    start_job(job_id)
+    return job_id
+
+
+def test_llm_call_of_cancelled_job_raises_before_reaching_the_model(monkeypatch):
+    import benchmarks.fakes
+    calls = []
+    monkeypatch.setattr(benchmarks.fakes, 'fake_answer', lambda prompt: calls.append(prompt) or "ok")
+    job_id = _started_job()
+    llm = FakeChatOpenAI(callbacks=[CancellationCheck(job_id)])
+    assert llm.invoke("hello").content == "ok"
+    request_cancel(job_id)
+    with pytest.raises(JobCancelled):
+        llm.invoke("hello again")
+    assert len(calls) == 1
+
+
+def test_tool_of_cancelled_job_answers_without_searching(fakes, monkeypatch):
+    searches = []
+    monkeypatch.setattr(fakes.FakeExa, 'search', lambda self, query, **kwargs: searches.append(query))
+    job_id = _started_job()
+    request_cancel(job_id)
+    tool = ExaSearchToolset(job_id=job_id)
+    assert tool.run(target_account="Acme", topic="supply chain") == CANCELLED
+    assert searches == []
+
+
+def test_every_agent_gets_the_cancellation_step_callback(fakes):
+    crew = AccountResearchCrew(_started_job(), llm_cache=False)
+    crew.setup_crew('Acme', ['supply chain'])
+    agents = {task.agent.role for task in crew.crew.tasks}
+    assert agents <= {agent.role for agent in crew.crew.agents}
+
+
+def test_cancel_stops_async_strategy_research_and_the_rest_of_the_crew(fakes, monkeypatch):
+    job_id = _started_job()
+    strategy, manager, writer = ('You are AI/ML Strategy Researcher.', 'You are Research Manager.',
+                                 'You are Research Writer.')
+    prompts = []
+    answer = fakes.fake_answer
+
+    def fake_answer(prompt):
+        prompts.append(prompt)
+        if strategy in prompt:
+            # Cancel while the async strategy task is mid-way: it has asked
+            # for a search and would answer on its next call.
+            request_cancel(job_id)
+        return answer(prompt)
+
+    monkeypatch.setattr(fakes, 'fake_answer', fake_answer)
+    crew = AccountResearchCrew(job_id, llm_cache=False)
+    crew.setup_crew('Acme', ['supply chain'])
+    with pytest.raises(JobCancelled):
+        crew.kickoff()
+    for task in crew.crew.tasks:
+        if task.thread is not None:
+            task.thread.join(5)
+    assert sum(strategy in prompt for prompt in prompts) == 1
+    assert not any(manager in prompt or writer in prompt for prompt in prompts)
@@ -0,0 +1,48 @@
+import gzip
+
+import pytest
+
+import compression
+from compression import CompressedCache, choose_encoding, negotiate
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip;q=0.5, deflate', 'gzip'),
+    ('gzip;q=0', None),
+    ('*', 'gzip'),
+    ('gzip;q=0, *', None),
+    ('*;q=0', None),
+    ('*;q=0, gzip', 'gzip'),
+])
+def test_choose_encoding_without_brotli(monkeypatch, header, expected):
+    monkeypatch.setattr(compression, 'brotli', None)
+    assert choose_encoding(header) == expected
+
+
+def test_refused_brotli_falls_back_to_gzip():
+    if compression.brotli is None:
+        pytest.skip("brotli is not installed")
+    assert choose_encoding('br, gzip') == 'br'
+    assert choose_encoding('br;q=0, *') == 'gzip'
+
+
+def test_negotiate_compresses_only_large_bodies(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+    small = b'{"a": 1}'
+    large = b'{"data": "' + b'x' * compression.MIN_COMPRESS_BYTES + b'"}'
+    assert negotiate(lambda: small, 'gzip') == (small, None)
+    body, encoding = negotiate(lambda: large, 'gzip')
+    assert encoding == 'gzip' and gzip.decompress(body) == large
+
+
+def test_compressed_cache_evicts_least_recently_used():
+    cache = CompressedCache(max_bytes=10)
+    cache.put('a', 'gzip', b'12345')
+    cache.put('b', 'gzip', b'12345')
+    assert cache.get('a', 'gzip') == b'12345'
+    cache.put('c', 'gzip', b'12345')
+    assert cache.get('b', 'gzip') is None
+    assert cache.get('a', 'gzip') == b'12345'
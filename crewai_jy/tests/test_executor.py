@@ -0,0 +1,88 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+import api
+import service
+from executor import JobExecutor, QueueFull
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def gate():
+    """Jobs that block until the test ends or opens the gate."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_runs_at_most_max_workers_and_queues_the_rest(gate):
+    executor = JobExecutor(max_workers=2, max_pending=2)
+    for n in range(2):
+        executor.submit(f"job-{n}", gate.wait)
+    _wait_until(lambda: executor.stats()["running"] == 2)
+    for n in range(2, 4):
+        executor.submit(f"job-{n}", gate.wait)
+    assert executor.stats()["pending"] == 2
+    assert executor.position('job-3') == 2
+
+    with pytest.raises(QueueFull) as full:
+        executor.submit('job-4', gate.wait)
+    assert full.value.retry_after >= 1
+
+    gate.set()
+    _wait_until(lambda: executor.stats()["running"] == 0 and executor.stats()["pending"] == 0)
+
+
+def test_interactive_jobs_go_before_bulk_jobs(gate):
+    executor = JobExecutor(max_workers=1, max_pending=4, max_bulk_pending=4)
+    order = []
+    executor.submit('blocker', gate.wait)
+    _wait_until(lambda: executor.stats()["running"] == 1)
+    executor.submit_bulk([(f"bulk-{n}", order.append, (f"bulk-{n}",)) for n in range(2)])
+    executor.submit('single', order.append, 'single')
+    assert executor.position('single') == 1 and executor.position('bulk-0') == 2
+
+    gate.set()
+    _wait_until(lambda: len(order) == 3)
+    assert order == ['single', 'bulk-0', 'bulk-1']
+
+
+def test_bulk_submission_is_all_or_none(gate):
+    executor = JobExecutor(max_workers=1, max_pending=1, max_bulk_pending=2)
+    executor.submit('blocker', gate.wait)
+    _wait_until(lambda: executor.stats()["running"] == 1)
+    with pytest.raises(QueueFull):
+        executor.submit_bulk([(f"bulk-{n}", gate.wait, ()) for n in range(3)])
+    assert executor.stats()["bulk_pending"] == 0
+
+
+def test_cancel_drops_a_job_that_has_not_started(gate):
+    executor = JobExecutor(max_workers=1, max_pending=2)
+    ran = []
+    executor.submit('blocker', gate.wait)
+    _wait_until(lambda: executor.stats()["running"] == 1)
+    executor.submit('queued', ran.append, 'queued')
+    assert executor.cancel('queued')
+    assert not executor.cancel('queued') and executor.position('queued') is None
+
+    gate.set()
+    _wait_until(lambda: executor.stats()["running"] == 0)
+    assert ran == []
+
+
+def test_full_queue_is_answered_with_429_and_retry_after(monkeypatch, gate):
+    executor = JobExecutor(max_workers=1, max_pending=0)
+    monkeypatch.setattr(service, 'executor', executor)
+    response = api.app.test_client().post(
+        '/api/crew', json={"target_account": f"Acme {uuid.uuid4()}", "topics": ["supply chain"]})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
@@ -0,0 +1,194 @@
+import sqlite3
+import threading
+import time
+
+from job_manager import EvictionPolicy, JobStore
+from storage import SQLiteBackend
+
+
+def test_concurrent_appends_keep_per_job_order():
+    store = JobStore(num_shards=4)
+    job_ids = [f"job-{i}" for i in range(8)]
+    for job_id in job_ids:
+        store.create(job_id)
+
+    def append(job_id):
+        for n in range(200):
+            store.append_event(job_id, f"{job_id}:{n}")
+
+    threads = [threading.Thread(target=append, args=(job_id,)) for job_id in job_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for job_id in job_ids:
+        job = store.get(job_id)
+        assert [event.seq for event in job.events] == list(range(1, 201))
+        assert [event.data for event in job.events] == [f"{job_id}:{n}" for n in range(200)]
+
+
+def test_get_since_returns_only_newer_events():
+    store = JobStore()
+    store.create('job')
+    for n in range(5):
+        store.append_event('job', str(n))
+    assert [event.data for event in store.get('job', since=3).events] == ['3', '4']
+
+
+def test_wait_wakes_on_append():
+    store = JobStore()
+    store.create('job')
+    threading.Timer(0.1, store.append_event, args=('job', 'hello')).start()
+    start = time.monotonic()
+    job = store.wait('job', since=0, timeout=5)
+    assert time.monotonic() - start < 2
+    assert [event.data for event in job.events] == ['hello']
+
+
+def test_wait_times_out_without_events():
+    store = JobStore()
+    store.create('job')
+    job = store.wait('job', since=0, timeout=0.05)
+    assert job.events == []
+
+
+def test_wait_for_change_wakes_on_finish():
+    store = JobStore()
+    store.create('job')
+    version = store.version('job')[0]
+    threading.Timer(0.1, store.finish, args=('job', 'COMPLETE', '{}')).start()
+    assert store.wait_for_change('job', version, timeout=5)
+    assert store.status('job') == 'COMPLETE'
+
+
+def _finished_store(tmp_path, count):
+    store = JobStore()
+    backend = SQLiteBackend(str(tmp_path / 'jobs.db'))
+    store.use_backend(backend)
+    for n in range(count):
+        store.create(f"j{n}")
+        store.append_event(f"j{n}", 'step')
+        store.finish(f"j{n}", 'COMPLETE', '{}')
+    return store, backend
+
+
+def _rows(backend, table):
+    backend.flush()
+    return backend._connect().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_capacity_eviction_keeps_job_readable_from_disk(tmp_path):
+    store, backend = _finished_store(tmp_path, 5)
+    assert store.sweep(EvictionPolicy(ttl_seconds=None, max_jobs=1, max_bytes=None)) == 4
+    assert _rows(backend, 'jobs') == 5
+    assert store.get('j0').status == 'COMPLETE'
+    backend.close()
+
+
+def test_ttl_deletes_capacity_evicted_jobs_from_disk(tmp_path):
+    store, backend = _finished_store(tmp_path, 5)
+    store.sweep(EvictionPolicy(ttl_seconds=0.5, max_jobs=1, max_bytes=None))
+    backend.flush()
+    time.sleep(0.6)
+    store.sweep(EvictionPolicy(ttl_seconds=0.5, max_jobs=1, max_bytes=None))
+    assert _rows(backend, 'jobs') == 0
+    assert _rows(backend, 'events') == 0
+    assert store.get('j0') is None
+    assert store.is_evicted('j0')
+    backend.close()
+
+
+def test_ttl_deletes_jobs_left_from_before_restart(tmp_path):
+    old_store, backend = _finished_store(tmp_path, 3)
+    backend.close()
+    store = JobStore()
+    backend = SQLiteBackend(str(tmp_path / 'jobs.db'))
+    store.use_backend(backend)
+    assert store.get('j1').status == 'COMPLETE'
+    time.sleep(0.1)
+    store.sweep(EvictionPolicy(ttl_seconds=0.05, max_jobs=None, max_bytes=None))
+    assert _rows(backend, 'jobs') == 0
+    assert store.get('j1') is None
+    backend.close()
+
+
+def test_restart_keeps_version_account_and_topics(tmp_path):
+    store = JobStore()
+    backend = SQLiteBackend(str(tmp_path / 'jobs.db'))
+    store.use_backend(backend)
+    store.create('job', target_account='Acme Corp', topics=['supply chain'])
+    store.append_event('job', 'step')
+    store.finish('job', 'COMPLETE', '{}')
+    version = store.version('job')[0]
+    backend.close()
+
+    store = JobStore()
+    backend = SQLiteBackend(str(tmp_path / 'jobs.db'))
+    store.use_backend(backend)
+    job = store.get('job')
+    assert job.version == version
+    assert job.target_account == 'Acme Corp' and job.topics == ['supply chain']
+    assert store.find(status='COMPLETE', target_account='acme  corp') == ['job']
+    assert store.summaries(['job'])[0]["topics"] == ['supply chain']
+    backend.close()
+
+
+def test_backend_adds_columns_to_an_older_database(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE jobs (job_id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT, "
+                 "created_at TEXT NOT NULL, started_at TEXT, finished_at TEXT)")
+    conn.execute("INSERT INTO jobs VALUES ('old', 'COMPLETE', '{}', '2024-01-01T00:00:00', NULL, "
+                 "'2024-01-01T00:01:00')")
+    conn.commit()
+    conn.close()
+    backend = SQLiteBackend(path)
+    job = backend.load_job('old')
+    assert job.status == 'COMPLETE' and job.version == 0 and job.target_account is None
+    backend.close()
+
+
+def _coalesced_store():
+    store = JobStore()
+    store.create('primary')
+    store.register('primary', 'key')
+    assert store.attach('alias', 'key') == 'primary'
+    return store
+
+
+def test_alias_mirrors_the_events_and_result_of_its_job():
+    store = _coalesced_store()
+    store.append_event('primary', 'progress')
+    store.finish('primary', 'COMPLETE', '{"report": 1}')
+    alias = store.get('alias')
+    assert alias.status == 'COMPLETE' and alias.result_json == {"report": 1}
+    assert [event.data for event in alias.events] == ['progress']
+
+
+def test_cancelling_an_alias_leaves_the_shared_crew_running():
+    store = _coalesced_store()
+    store.start('primary')
+    assert store.request_cancel('alias') == 'CANCELLED'
+    assert store.status('alias') == 'CANCELLED'
+    assert store.status('primary') == 'STARTED' and not store.is_cancel_requested('primary')
+
+
+def test_shared_crew_stops_when_its_last_requester_cancels():
+    store = _coalesced_store()
+    assert store.attach('second', 'key') == 'primary'
+    store.start('primary')
+    assert store.request_cancel('primary') == 'STARTED'
+    assert store.request_cancel('alias') == 'CANCELLED'
+    assert not store.is_cancel_requested('primary')
+    assert store.request_cancel('second') == 'CANCELLED'
+    assert store.is_cancel_requested('primary') and store.status('primary') == 'CANCELLING'
+
+
+def test_find_returns_the_newest_matches_first():
+    store = JobStore(num_shards=4)
+    for n in range(6):
+        store.create(f"job-{n}", target_account='Acme' if n % 2 else 'Other')
+        time.sleep(0.002)
+    assert store.find(target_account='acme', limit=2) == ['job-5', 'job-3']
+    assert store.find(status='QUEUED') == [f"job-{n}" for n in reversed(range(6))]
@@ -0,0 +1,23 @@
+from crewai import Agent, Task
+
+import llm
+from llm_metrics import llm_metrics
+
+
+def test_shared_llm_copies_keep_the_client_and_their_own_callbacks():
+    first = llm.chat_llm("gpt-3.5-turbo-0125", callbacks=["first"])
+    second = llm.chat_llm("gpt-3.5-turbo-0125", callbacks=["second"])
+    assert first.client is second.client
+    assert first.async_client is second.async_client
+    assert first.tags is None and first.metadata is None
+    assert first.callbacks == ["first"] and second.callbacks == ["second"]
+
+
+def test_metrics_see_calls_of_llms_whose_callbacks_crewai_replaced(fakes, monkeypatch):
+    started = []
+    monkeypatch.setattr(llm_metrics, 'on_chat_model_start', lambda *args, **kwargs: started.append(args))
+    agent = Agent(role="Tester", goal="Test", backstory="Tests", llm=llm.chat_llm("gpt-3.5-turbo-0125"))
+    Task(description="Test", expected_output="A test", agent=agent)
+    assert llm_metrics not in agent.llm.callbacks
+    agent.llm.invoke("hello")
+    assert len(started) == 1
@@ -0,0 +1,43 @@
+from langchain_core.outputs import Generation
+
+from llm_cache import LLMResponseCache
+
+PROMPT = '[{"role": "user", "content": "Research Acme"}]'
+LLM = 'gpt-4-turbo temperature=0.7'
+
+
+def test_response_is_served_from_memory_after_update():
+    cache = LLMResponseCache()
+    assert cache.lookup(PROMPT, LLM) is None
+    cache.update(PROMPT, LLM, [Generation(text="Acme makes anvils.")])
+    assert [generation.text for generation in cache.lookup(PROMPT, LLM)] == ["Acme makes anvils."]
+    assert cache.lookup(PROMPT, 'gpt-3.5-turbo temperature=0.7') is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2 and stats["tokens_saved"] > 0
+
+
+def test_responses_survive_a_restart_on_disk(tmp_path):
+    path = str(tmp_path / 'llm_cache.db')
+    LLMResponseCache(path=path).update(PROMPT, LLM, [Generation(text="Acme makes anvils.")])
+    cache = LLMResponseCache(path=path)
+    assert [generation.text for generation in cache.lookup(PROMPT, LLM)] == ["Acme makes anvils."]
+    assert cache.stats()["disk_hits"] == 1
+    # The disk hit is promoted into memory.
+    cache.lookup(PROMPT, LLM)
+    assert cache.stats()["disk_hits"] == 1 and cache.stats()["hits"] == 2
+
+
+def test_expired_responses_are_dropped_on_open(tmp_path):
+    path = str(tmp_path / 'llm_cache.db')
+    LLMResponseCache(path=path).update(PROMPT, LLM, [Generation(text="Acme makes anvils.")])
+    assert LLMResponseCache(path=path, ttl_seconds=-1).stats()["disk_bytes"] == 0
+
+
+def test_disk_is_shrunk_to_its_budget_oldest_first(tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / 'llm_cache.db'), max_disk_bytes=1000)
+    for n in range(4):
+        cache.update(f"{PROMPT} {n}", LLM, [Generation(text="x" * 200)])
+    assert cache.stats()["disk_bytes"] <= 900
+    reopened = LLMResponseCache(path=str(tmp_path / 'llm_cache.db'))
+    assert reopened.lookup(f"{PROMPT} 0", LLM) is None
+    assert reopened.lookup(f"{PROMPT} 3", LLM) is not None
@@ -0,0 +1,95 @@
+import json
+import threading
+import time
+
+import httpx
+
+from rate_limit import RateLimitedTransport, RateLimiter
+
+
+def _queue_in_order(limiter, callers):
+    """Start `callers` (job id, tokens) one at a time, each once the one
+    before is waiting, and return the order in which they were let through."""
+    served = []
+    lock = threading.Lock()
+
+    def call(n, job_id, tokens):
+        limiter.acquire(job_id, tokens)
+        with lock:
+            served.append(n)
+
+    threads = []
+    for n, (job_id, tokens) in enumerate(callers):
+        thread = threading.Thread(target=call, args=(n, job_id, tokens))
+        thread.start()
+        threads.append(thread)
+        deadline = time.monotonic() + 5
+        while limiter.stats()["waiting"] < len(threads) - len(served) and time.monotonic() < deadline:
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    return served
+
+
+def test_callers_of_one_job_are_served_in_arrival_order():
+    # One request at a time, refilled every 100ms.
+    limiter = RateLimiter(rpm=600, tpm=0, burst_seconds=0.1)
+    limiter.acquire('job', 0)
+    assert _queue_in_order(limiter, [('job', 0)] * 6) == list(range(6))
+
+
+def test_jobs_take_turns_while_waiting():
+    limiter = RateLimiter(rpm=600, tpm=0, burst_seconds=0.1)
+    limiter.acquire('a', 0)
+    order = _queue_in_order(limiter, [('a', 0), ('a', 0), ('a', 0), ('b', 0)])
+    # b arrived last but is served as soon as a has had its turn.
+    assert order == [0, 3, 1, 2]
+
+
+def test_requests_are_held_to_the_request_limit():
+    # 50 requests a second, one at a time.
+    limiter = RateLimiter(rpm=3000, tpm=0, burst_seconds=0.02)
+    start = time.monotonic()
+    threads = [threading.Thread(target=limiter.acquire, args=(f"job-{n % 3}", 0)) for n in range(11)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The first goes at once, the other ten each wait for a refill.
+    assert time.monotonic() - start >= 0.18
+    assert limiter.stats()["throttled"] >= 9
+
+
+def test_tokens_are_held_to_the_token_limit_and_corrected_by_usage():
+    # 1000 tokens a second, at most 100 at once.
+    limiter = RateLimiter(rpm=0, tpm=60_000, burst_seconds=0.1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=limiter.acquire, args=(f"job-{n % 2}", 50)) for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 300 tokens against 100 in the bucket: 200 more take 0.2s to refill.
+    assert time.monotonic() - start >= 0.18
+
+    # Usage below the estimate gives the difference back.
+    limiter.settle(estimated=50, actual=0)
+    assert limiter.acquire('job-0', 40) < 0.01
+
+
+def test_transport_settles_the_estimate_with_the_reported_usage():
+    limiter = RateLimiter(rpm=0, tpm=60_000, burst_seconds=1)
+
+    def handler(request):
+        return httpx.Response(200, json={"usage": {"total_tokens": 10}})
+
+    client = httpx.Client(transport=RateLimitedTransport(httpx.MockTransport(handler), limiter))
+    body = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "hi"}], "max_tokens": 500}
+    threads = [threading.Thread(target=client.post, args=("https://api.openai.com/v1/chat/completions",),
+                                kwargs={"content": json.dumps(body)}) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Each request reserved over 500 tokens but is charged only the 10 it used.
+    assert 950 <= limiter.stats()["available_tokens"] <= 1000
@@ -0,0 +1,38 @@
+import time
+
+from report_cache import ReportCache
+
+KEY = ('acme', ('supply chain',), 1)
+
+
+def test_report_is_served_while_younger_than_max_age():
+    cache = ReportCache()
+    cache.put(KEY, 'job', '{"account_name": "Acme"}', {"account_name": "Acme"})
+    report = cache.get(KEY, max_age=60)
+    assert report.job_id == 'job' and report.result_json == {"account_name": "Acme"}
+    time.sleep(0.02)
+    assert cache.get(KEY, max_age=0.01) is None
+    assert cache.stats()["stale"] == 1
+
+
+def test_ttl_caps_max_age():
+    cache = ReportCache(ttl_seconds=0.01)
+    cache.put(KEY, 'job', '{}', {})
+    time.sleep(0.02)
+    assert cache.get(KEY, max_age=3600) is None
+
+
+def test_least_recently_used_report_goes_first():
+    cache = ReportCache(max_entries=2)
+    for n in range(3):
+        cache.put(('account', n), f"job-{n}", '{}', {})
+    assert cache.get(('account', 0), max_age=60) is None
+    assert cache.get(('account', 2), max_age=60).job_id == 'job-2'
+
+
+def test_reports_survive_a_restart_on_disk(tmp_path):
+    path = str(tmp_path / 'reports.db')
+    ReportCache(path=path).put(KEY, 'job', '{"account_name": "Acme"}', {"account_name": "Acme"})
+    cache = ReportCache(path=path)
+    assert cache.get(KEY, max_age=60).result_json == {"account_name": "Acme"}
+    assert cache.stats()["disk_hits"] == 1
@@ -0,0 +1,68 @@
+import pytest
+from crewai import Agent
+from langchain_core.load import dumps
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration
+
+from benchmarks.fakes import FakeChatOpenAI
+from semantic_cache import SemanticCache, scope
+from tasks import AccountResearchTasks
+
+LLM_STRING = "fake-chat-openai"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SemanticCache(str(tmp_path), capacity=16)
+
+
+def _prompt(target_account, topic, observation=None):
+    agent = Agent(role="Account Researcher", goal="Research", backstory="Researches", llm=FakeChatOpenAI())
+    task = AccountResearchTasks('job').research_account(agent, target_account, topic)
+    text = task.description + task.expected_output
+    if observation:
+        text += f"\nAction: Exa Search Toolset\nObservation: {observation}"
+    return dumps([HumanMessage(content=text)])
+
+
+def _answer(text):
+    return [ChatGeneration(message=AIMessage(content=text))]
+
+
+def _store(cache, target_account, topic):
+    with scope(target_account, [topic]):
+        cache.update(_prompt(target_account, topic), LLM_STRING, _answer(f"{target_account} {topic}"))
+
+
+def _lookup(cache, target_account, topic, **kwargs):
+    with scope(target_account, [topic]):
+        cached = cache.lookup(_prompt(target_account, topic, **kwargs), LLM_STRING)
+    return cached[0].text if cached else None
+
+
+def test_rephrased_account_and_topic_hit(cache):
+    _store(cache, 'Acme', 'supply chain')
+    assert _lookup(cache, 'ACME', 'Supply-Chain') == "Acme supply chain"
+
+
+@pytest.mark.parametrize('target_account, topic', [
+    ('Globex', 'supply chain'),
+    ('Microsoft', 'cloud revenue'),
+    ('Acme', 'cloud revenue'),
+])
+def test_other_accounts_and_topics_never_hit(cache, target_account, topic):
+    _store(cache, 'Acme', 'supply chain')
+    _store(cache, 'Initech', 'cloud revenue')
+    assert _lookup(cache, target_account, topic) is None
+
+
+def test_next_step_of_a_task_does_not_hit_the_previous_one(cache):
+    _store(cache, 'Acme', 'supply chain')
+    assert _lookup(cache, 'Acme', 'supply chain', observation="No results.") is None
+
+
+def test_calls_outside_a_task_are_not_indexed(cache):
+    prompt = _prompt('Acme', 'supply chain')
+    cache.update(prompt, LLM_STRING, _answer("unscoped"))
+    assert cache.lookup(prompt, LLM_STRING) is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,210 @@
+"""Per-job spans of crew tasks, LLM calls and tool calls.
+
+Tasks open a span and make it the current one for their thread; LLM and
+tool calls made from that thread are recorded as its children. From the
+spans `analyze` derives the critical path of a job and how much the
+`async_execution` tasks actually overlapped.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Jobs whose spans are kept, least recently recorded dropped first.
+MAX_TIMELINES = 1000
+# Slack when matching a task's start to the end of the task it waited for.
+_WAIT_TOLERANCE = 0.05
+
+_ids = itertools.count(1)
+
+
+@dataclass
+class Span:
+    kind: str
+    name: str
+    start: float
+    end: Optional[float] = None
+    id: int = field(default_factory=lambda: next(_ids))
+    parent: Optional[int] = None
+    thread: str = field(default_factory=lambda: threading.current_thread().name)
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+
+class Timelines:
+    def __init__(self, max_jobs: int = MAX_TIMELINES):
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, List[Span]]" = OrderedDict()
+        self._current = threading.local()
+
+    def begin(self, job_id: Optional[str], kind: str, name: str, **attrs) -> Optional[Span]:
+        """Open a span for `job_id`, or for the current task's job when None.
+
+        Returns None when there is no job to attach the span to.
+        """
+        parent = None
+        if job_id is None:
+            current = self.current()
+            if current is None:
+                return None
+            job_id, parent = current[0], current[1].id
+        span = Span(kind=kind, name=name, start=time.time(), parent=parent, attrs=attrs)
+        with self._lock:
+            spans = self._jobs.get(job_id)
+            if spans is None:
+                spans = self._jobs[job_id] = []
+                while len(self._jobs) > self.max_jobs:
+                    self._jobs.popitem(last=False)
+            spans.append(span)
+        return span
+
+    @staticmethod
+    def end(span: Optional[Span], **attrs):
+        if span is not None:
+            span.attrs.update(attrs)
+            span.end = time.time()
+
+    def current(self) -> Optional[Tuple[str, Span]]:
+        return getattr(self._current, 'task', None)
+
+    @contextmanager
+    def task(self, job_id: Optional[str], name: str, **attrs) -> Iterator[Optional[Span]]:
+        """Span a task and make it the parent of calls made on this thread."""
+        span = self.begin(job_id, 'task', name, **attrs) if job_id is not None else None
+        previous = self.current()
+        if span is not None:
+            self._current.task = (job_id, span)
+        try:
+            yield span
+        finally:
+            self._current.task = previous
+            self.end(span)
+
+    def spans(self, job_id: str) -> List[Span]:
+        with self._lock:
+            spans = list(self._jobs.get(job_id, ()))
+        return [replace(span, attrs=dict(span.attrs)) for span in spans]
+
+
+timelines = Timelines()
+
+
+def _serialize(span: Span, origin: float) -> dict:
+    return {
+        "id": span.id,
+        "parent": span.parent,
+        "kind": span.kind,
+        "name": span.name,
+        "start": round(span.start - origin, 3),
+        "end": round(span.end - origin, 3) if span.end is not None else None,
+        "duration": round(span.duration, 3),
+        "thread": span.thread,
+        **span.attrs,
+    }
+
+
+def _union_length(intervals: List[Tuple[float, float]]) -> float:
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def _max_concurrent(intervals: List[Tuple[float, float]]) -> int:
+    edges = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    running = peak = 0
+    for _, delta in edges:
+        running += delta
+        peak = max(peak, running)
+    return peak
+
+
+def critical_path(tasks: List[Span]) -> List[Span]:
+    """The chain of tasks the job actually waited on, first to last.
+
+    Starts from the task that finished last and repeatedly steps to the
+    task that finished latest before the current one started, which is the
+    one it was held up by whether through `context` or the sequential order.
+    """
+    finished = [span for span in tasks if span.end is not None]
+    if not finished:
+        return []
+    path = [max(finished, key=lambda span: span.end)]
+    seen = {path[0].id}
+    while True:
+        start = path[-1].start
+        waited_on = [span for span in finished if span.end <= start + _WAIT_TOLERANCE and span.id not in seen]
+        if not waited_on:
+            break
+        path.append(max(waited_on, key=lambda span: span.end))
+        seen.add(path[-1].id)
+    path.reverse()
+    return path
+
+
+def analyze(spans: List[Span], origin: float) -> dict:
+    """Spans, critical path and async-task parallelism for one job."""
+    tasks = [span for span in spans if span.kind == 'task']
+    children: Dict[int, List[Span]] = {}
+    for span in spans:
+        if span.parent is not None:
+            children.setdefault(span.parent, []).append(span)
+
+    path = critical_path(tasks)
+    path_entries = []
+    by_kind: Dict[str, float] = {}
+    for task in path:
+        entry = _serialize(task, origin)
+        task_total = task.duration
+        for kind in ('llm', 'tool'):
+            seconds = _union_length([(child.start, child.end) for child in children.get(task.id, ())
+                                     if child.kind == kind and child.end is not None])
+            entry[f"{kind}_seconds"] = round(seconds, 3)
+            by_kind[kind] = by_kind.get(kind, 0.0) + seconds
+            task_total -= seconds
+        by_kind['other'] = by_kind.get('other', 0.0) + max(task_total, 0.0)
+        path_entries.append(entry)
+
+    async_intervals = [(span.start, span.end) for span in tasks
+                       if span.attrs.get('async_execution') and span.end is not None]
+    busy = sum(end - start for start, end in async_intervals)
+    wall = _union_length(async_intervals)
+
+    totals: Dict[str, dict] = {}
+    for span in spans:
+        kind = totals.setdefault(span.kind, {"count": 0, "seconds": 0.0})
+        kind["count"] += 1
+        kind["seconds"] = round(kind["seconds"] + span.duration, 3)
+
+    return {
+        "spans": [_serialize(span, origin) for span in sorted(spans, key=lambda span: span.start)],
+        "critical_path": {
+            "seconds": round(path[-1].end - path[0].start, 3) if path else 0.0,
+            "tasks": path_entries,
+            "by_kind": {kind: round(seconds, 3) for kind, seconds in by_kind.items()},
+        },
+        "async_parallelism": {
+            "tasks": len(async_intervals),
+            "busy_seconds": round(busy, 3),
+            "wall_seconds": round(wall, 3),
+            # 1.0 means the async tasks ran one at a time after all.
+            "achieved": round(busy / wall, 2) if wall else 0.0,
+            "max_concurrent": _max_concurrent(async_intervals),
+        },
+        "totals": totals,
+    }
@@ -0,0 +1,71 @@
+"""Token counts with tiktoken, as OpenAI counts them against rate limits.
+
+tiktoken downloads its encodings on first use; where that fails, counts
+fall back to four characters per token, the estimate llm_cache uses.
+"""
+import functools
+import json
+import os
+from typing import Any, Iterable, List, Mapping, Union
+
+import tiktoken
+
+from utils.logging import logger
+
+# Completion allowance for requests that do not set max_tokens.
+EXPECTED_COMPLETION_TOKENS = int(os.environ.get('CREW_LLM_EXPECTED_COMPLETION_TOKENS', 500))
+
+# Per-message framing of the chat format, from OpenAI's token counting guide.
+_TOKENS_PER_MESSAGE = 3
+_TOKENS_PER_NAME = 1
+_REPLY_PRIMING_TOKENS = 3
+_CHARS_PER_TOKEN = 4
+
+
+class _ApproximateEncoding:
+    """Splits text into four-character tokens."""
+
+    def encode(self, text: str, disallowed_special=()) -> List[str]:
+        return [text[i:i + _CHARS_PER_TOKEN] for i in range(0, len(text), _CHARS_PER_TOKEN)]
+
+    def decode(self, tokens: List[str]) -> str:
+        return ''.join(tokens)
+
+
+@functools.lru_cache(maxsize=None)
+def encoding(model: str) -> Union[tiktoken.Encoding, _ApproximateEncoding]:
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        # Cached like the real encoding, so the download is tried once.
+        logger.warning(f"Counting tokens for {model} approximately, tiktoken encoding unavailable: {e}")
+        return _ApproximateEncoding()
+
+
+def count_tokens(text: str, model: str = 'gpt-3.5-turbo') -> int:
+    return len(encoding(model).encode(text, disallowed_special=()))
+
+
+def count_messages(messages: Iterable[Mapping[str, Any]], model: str = 'gpt-3.5-turbo') -> int:
+    """Prompt tokens of OpenAI chat `messages` in their wire format."""
+    total = _REPLY_PRIMING_TOKENS
+    for message in messages:
+        total += _TOKENS_PER_MESSAGE
+        for key, value in message.items():
+            if value is None:
+                continue
+            total += count_tokens(value if isinstance(value, str) else json.dumps(value), model)
+            if key == 'name':
+                total += _TOKENS_PER_NAME
+    return total
+
+
+def truncate(text: str, max_tokens: int, model: str = 'gpt-3.5-turbo') -> str:
+    """`text` cut to its first `max_tokens` tokens."""
+    tokens = encoding(model).encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding(model).decode(tokens[:max_tokens])
@@ -5,11 +5,30 @@ from pydantic.v1 import BaseModel, Field, parse_obj_as
 from crewai_tools import BaseTool 
 from exa_py.api import Exa
 import re
+import time
+from job_manager import is_cancelled
+from metrics import EXA_CALL_DURATION
+from timeline import timelines
+
+CANCELLED = "The job was cancelled; stop and give your final answer."
 
 def to_snake_case(camel_str: str) -> str:
     """Convert a camelCase string to a snake_case string."""
     return re.sub(r'(?<!^)(?=[A-Z])', '_', camel_str).lower()
 
+def _timed(operation: str, call, *args, **kwargs):
+    """Make an Exa API call, recording its latency, outcome and timeline span."""
+    span = timelines.begin(None, 'tool', f"exa.{operation}")
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        result = call(*args, **kwargs)
+        outcome = 'ok'
+        return result
+    finally:
+        EXA_CALL_DURATION.observe(time.perf_counter() - start, (operation, outcome))
+        timelines.end(span, outcome=outcome)
+
 class SearchResult(BaseModel):
     results: str
     status: str
@@ -29,6 +48,11 @@ class ExaSearchToolset(BaseTool):
     name: str = "Exa Search Toolset"
     description: str = "Searches the web based on a target account and topic and returns search results."
     args_schema: Type[BaseModel] = ExaSearchInput
+    # Job this toolset searches for; checked before each Exa call so a
+    # cancelled job stops spending search quota. crewai turns exceptions
+    # from tools into observations for the agent, so the tool just answers;
+    # the agent's next LLM call is what stops it (see tasks.TimedTask).
+    job_id: Optional[str] = None
 
 
     def _run(self, target_account: str, topic: str, limit: int = 3):
@@ -39,23 +63,29 @@ class ExaSearchToolset(BaseTool):
 
     def search(self, query:str): 
         """Search for a webpage based on the query constructed from search input."""
-        return ExaSearchToolset._exa().search(query, use_autoprompt=True, num_results=3)
+        if is_cancelled(self.job_id):
+            return CANCELLED
+        return _timed('search', ExaSearchToolset._exa().search, query, use_autoprompt=True, num_results=3)
 
 
     def find_similar(self, url: str):
         """Search for webpages similar to a given URL.
         The url passed in should be a URL returned from `search`.
         """
-        return ExaSearchToolset._exa().find_similar(url, num_results=3)
+        if is_cancelled(self.job_id):
+            return CANCELLED
+        return _timed('find_similar', ExaSearchToolset._exa().find_similar, url, num_results=3)
 
 
     def get_contents(self, ids_str: str):
         """Get the contents of a webpage.
         The ids must be passed in as a string representing a list of ids.
         """
+        if is_cancelled(self.job_id):
+            return CANCELLED
         ids = json.loads(ids_str)
 
-        contents = str(ExaSearchToolset._exa().get_contents(ids))
+        contents = str(_timed('get_contents', ExaSearchToolset._exa().get_contents, ids))
         contents = contents.split("URL:")
         contents = [content[:1000] for content in contents]
         return "\n\n".join(contents)